@@ -1,24 +1,26 @@
 import streamlit as st
 import pandas as pd
-import gspread
-import json
-from google.oauth2.service_account import Credentials
-from datetime import date, datetime
+import numpy as np
+import logging
+import tempfile
+import zipfile
+import export_sheets
+from functools import partial
+from contextlib import ExitStack
+from datetime import date
+from sheet_store import (
+    PRIMARY_KEYS, SHEET_NAMES, Transaction, UnsettledTransactions, WriteConflict,
+    append_rows, get_backend, get_data, get_data_many, get_sheet_cache, get_txn_journal,
+    next_id, prefetch_sheets, rejected, reload_sheets, replay_transactions, update_rows,
+)
+from sheet_index import (
+    date_index, find_row, options, rows_at, settle_oldest_first, start_search,
+    unpaid_ledger, value_tally,
+)
 
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
-SHEET_NAMES = {
-    "workers": "workers",
-    "work_types": "work_types",
-    "work_logs": "work_logs",
-    "tools": "tools",
-    "tool_moves": "tool_moves",
-    "storage_places": "storage_places",
-    "chekkulu": "chekkulu",
-    "cold_storage": "cold_storage",
-}
-
 LABELS = {
     # Page names
     "dashboard": "డాష్\u200cబోర్డ్",
@@ -57,6 +59,9 @@ LABELS = {
     "filter_date": "తేదీ ఫిల్టర్",
     "filter_worker": "కూలీ ఫిల్టర్",
     "filter_pay_status": "చెల్లింపు స్థితి ఫిల్టర్",
+    "settle_worker": "కూలీ బాకీ చెల్లింపు",
+    "balance": "బాకీ (₹)",
+    "running_balance": "మొత్తం బాకీ (₹)",
     # Tools
     "tool_id": "పరికరం ID",
     "tool_name": "పరికరం పేరు",
@@ -113,96 +118,146 @@ LABELS = {
     "no": "కాదు",
     "full_day": "పూర్తి రోజు",
     "half_day": "సగం రోజు",
+    "sort_by": "క్రమం",
+    "descending": "తగ్గుతూ",
+    "page": "పేజీ",
+    # Export
+    "export": "డేటా ఎగుమతి (బ్యాకప్)",
+    "export_format": "ఫార్మాట్",
+    "export_changed_only": "గత ఎగుమతి తర్వాత మారినవి మాత్రమే",
+    "export_download": "డౌన్\u200cలోడ్",
+    "export_confirm": "డౌన్\u200cలోడ్ అందింది",
+    "export_confirm_help": "నొక్కిన తర్వాతే తదుపరి ఎగుమతి ఈ డౌన్\u200cలోడ్ తర్వాతి మార్పుల నుండి మొదలవుతుంది.",
+    "export_confirmed": "సరే, తదుపరి ఎగుమతిలో దీని తర్వాత మారినవి మాత్రమే ఉంటాయి.",
+    "export_not_staged": "ముందుగా డౌన్\u200cలోడ్ చేయండి.",
+    "write_conflict": "మీరు తెరిచిన తర్వాత వేరొకరు మార్చారు ({ids}). తాజా వివరాలు తెచ్చాము, చూసి మళ్లీ ప్రయత్నించండి.",
+    "dead_letters": "{n} మార్పులు సేవ్ కాలేదు: షీట్ వాటిని తిరస్కరించింది. వివరాలు చూసి మళ్లీ నమోదు చేయండి.",
+    "dead_letters_details": "సేవ్ కాని మార్పులు",
+    "dead_letters_discard": "ఈ జాబితాను తీసివేయి",
+    "txn_refused": "తరలింపు సేవ్ కాలేదు: షీట్ దానిని తిరస్కరించింది. వివరాలు చూసి మళ్లీ ప్రయత్నించండి.",
+    "txn_unsettled": "ముందటి తరలింపు ఇంకా షీట్‌లో సేవ్ కాలేదు; అది సేవ్ అయ్యే వరకు కొత్తది పంపలేము. కొద్దిసేపటి తర్వాత మళ్లీ ప్రయత్నించండి.",
+    "row_missing": "{id} దొరకలేదు; వేరొకరు మార్చి ఉండవచ్చు. పేజీని మళ్లీ తెరిచి ప్రయత్నించండి.",
 }
 
 TOOL_STATUSES = ["బాగుంది", "మరమ్మత్తు అవసరం", "పనిచేయడం లేదు"]
 PAY_METHODS = ["నగదు", "UPI"]
 PAY_STATUSES = ["PAID", "PARTIAL", "UNPAID"]
 
-# ---------------------------------------------------------------------------
-# Google Sheets connection
-# ---------------------------------------------------------------------------
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive",
-]
-
-
-@st.cache_resource
-def get_gspread_client():
-    creds_dict = st.secrets["gcp_service_account"]
-    # st.secrets returns an AttrDict; convert to plain dict for google-auth
-    creds_dict = dict(creds_dict)
-    creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-    return gspread.authorize(creds)
-
-
-def get_spreadsheet():
-    client = get_gspread_client()
-    return client.open_by_key(st.secrets["spreadsheet_id"])
+# Global search redraws partial results this often while a search runs
+SEARCH_POLL_SECONDS = 0.2
 
+# Rows shown per page in the record tables
+TABLE_PAGE_SIZE = 50
 
 # ---------------------------------------------------------------------------
-# Data helpers
+# Display helpers
 # ---------------------------------------------------------------------------
 
-SHEET_HEADERS = {
-    "chekkulu": ["chekkulu_id", "date", "rate", "weight", "tbgr_number", "type"],
-    "cold_storage": ["cold_storage_id", "date_stored", "count", "weight",
-                     "serial_number", "type", "date_removed"],
-}
+def format_date(value) -> str:
+    """A date cell as YYYY-MM-DD, or "" when blank."""
+    return "" if pd.isna(value) else value.strftime("%Y-%m-%d")
 
 
-def ensure_worksheet(sheet_name: str):
-    """Create the worksheet with headers if it does not exist yet."""
-    ss = get_spreadsheet()
-    try:
-        ss.worksheet(sheet_name)
-    except gspread.exceptions.WorksheetNotFound:
-        ws = ss.add_worksheet(title=sheet_name, rows=1000, cols=20)
-        if sheet_name in SHEET_HEADERS:
-            ws.update(range_name="A1", values=[SHEET_HEADERS[sheet_name]])
+def display_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Copy of df for st.dataframe, with dates shown without a time of day."""
+    out = df.copy()
+    for col in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[col]):
+            out[col] = out[col].dt.date.astype(object).where(out[col].notna(), None)
+    return out
 
 
-def load_sheet(sheet_name: str) -> pd.DataFrame:
-    ss = get_spreadsheet()
-    ensure_worksheet(sheet_name)
-    ws = ss.worksheet(sheet_name)
-    records = ws.get_all_records()
-    df = pd.DataFrame(records)
-    if df.empty:
-        # Return an empty DataFrame with the header row as columns
-        header = ws.row_values(1)
-        df = pd.DataFrame(columns=header)
-    str_cols = df.select_dtypes(include="object").columns
-    df[str_cols] = df[str_cols].fillna("")
-    return df
+def show_conflict(exc: WriteConflict):
+    st.error(LABELS["write_conflict"].format(ids=", ".join(exc.keys) or exc.sheet_name))
 
 
-def save_sheet(df: pd.DataFrame, sheet_name: str):
-    ss = get_spreadsheet()
-    ws = ss.worksheet(sheet_name)
-    ws.clear()
-    # Build list-of-lists: header + rows
-    data = [df.columns.tolist()] + df.astype(str).values.tolist()
-    ws.update(range_name="A1", values=data)
+def show_missing_row(key):
+    # key is None when the selectbox had no options left
+    st.error(LABELS["row_missing"].format(id="-" if key is None else key))
 
 
-def get_data(key: str, sheet_name: str) -> pd.DataFrame:
-    if key not in st.session_state:
-        st.session_state[key] = load_sheet(sheet_name)
-    return st.session_state[key]
+# ---------------------------------------------------------------------------
+# Tables
+# ---------------------------------------------------------------------------
 
+def paged_table(df: pd.DataFrame, cols: list, labels: list, key: str,
+                newest_first: bool = False, formats: dict = None):
+    """Show cols of df, headed by labels, one page at a time.
+
+    Sorting and paging happen here, so only the visible page of rows is
+    sent to the browser. Without a sort column rows keep sheet order, or
+    the reverse with newest_first. formats maps a column to a function
+    applied to its values on the visible page only.
+    """
+    n_rows = len(df)
+    pages = max(1, -(-n_rows // TABLE_PAGE_SIZE))
+    # Filters can shrink the table below the page the user was on
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+
+    c1, c2, c3 = st.columns([2, 1, 1])
+    with c1:
+        sort_label = st.selectbox(LABELS["sort_by"], ["—"] + labels, key=f"{key}_sort")
+    with c2:
+        descending = st.toggle(LABELS["descending"], key=f"{key}_desc")
+    with c3:
+        page = st.number_input(LABELS["page"], min_value=1, max_value=pages, step=1,
+                               key=f"{key}_page")
+
+    if sort_label == "—":
+        order = np.arange(n_rows)
+        if newest_first:
+            order = order[::-1]
+    else:
+        col = cols[labels.index(sort_label)]
+        order = (df[col].reset_index(drop=True)
+                 .sort_values(ascending=not descending, kind="stable", na_position="last")
+                 .index.to_numpy())
+    start = (int(page) - 1) * TABLE_PAGE_SIZE
+    rows = df.iloc[order[start:start + TABLE_PAGE_SIZE]][cols]
+    for col, fmt in (formats or {}).items():
+        rows = rows.assign(**{col: fmt(rows[col])})
+    rows.columns = labels
+    st.dataframe(display_frame(rows), hide_index=True, use_container_width=True)
+    if n_rows > TABLE_PAGE_SIZE:
+        st.caption(f"{start + 1}–{min(start + TABLE_PAGE_SIZE, n_rows)} / {n_rows}")
 
-def refresh(key: str, sheet_name: str):
-    st.session_state[key] = load_sheet(sheet_name)
 
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
 
-def next_id(df: pd.DataFrame, id_col: str, prefix: str, width: int) -> str:
-    if df.empty:
-        return f"{prefix}{1:0{width}d}"
-    nums = df[id_col].str.replace(prefix, "", regex=False).astype(int)
-    return f"{prefix}{nums.max() + 1:0{width}d}"
+def export_state_path() -> str:
+    return st.secrets.get("export_state_path", "farm_export.db")
+
+
+def export_archive(fmt: str, changed_only: bool):
+    """Zip of every sheet in SHEET_NAMES as CSV or Parquet, in a temporary file.
+
+    Called when the download button is clicked. Each sheet is streamed from
+    the backend a chunk at a time into the archive on disk. With
+    changed_only, only rows added or changed since the last confirmed
+    export are included (see export_sheets.SnapshotState); the state is
+    staged until the user confirms the download arrived.
+    """
+    backend = get_backend()
+    # Read every sheet's size afresh, once
+    backend.refresh_sizes()
+    sources = {name: (PRIMARY_KEYS.get(name), backend.fetch_chunks(name, export_sheets.CHUNK_ROWS))
+               for name in SHEET_NAMES.values()}
+    snapshot = export_sheets.SnapshotState.staged(export_state_path()) if changed_only else None
+    out = tempfile.TemporaryFile()
+    try:
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+            export_sheets.export_all(sources, export_sheets.zip_files(archive), fmt, snapshot)
+    except Exception:
+        out.close()
+        raise
+    finally:
+        if snapshot is not None:
+            snapshot.close()
+    out.seek(0)
+    return out
 
 
 # ---------------------------------------------------------------------------
@@ -354,6 +409,41 @@ st.radio(
 
 page = NAV_KEY_TO_LABEL[st.session_state["current_page"]]
 
+# ---------------------------------------------------------------------------
+# Queued writes the backend refused
+# ---------------------------------------------------------------------------
+
+
+def dead_letter_notice():
+    """Warn about accepted writes that were refused later, and reload their sheets.
+
+    Lists the backend's dead letters and those of replayed transactions.
+    """
+    backend = get_backend()
+    journal = get_txn_journal()
+    dropped = backend.dropped_sheets()
+    if dropped:
+        cache = get_sheet_cache()
+        with ExitStack() as stack:
+            for name in dropped:
+                stack.enter_context(cache.lock(name))
+            reload_sheets(dropped)
+    letters = backend.dead_letters()
+    txn_letters = journal.dead_letters()
+    if not letters and not txn_letters:
+        return
+    st.warning(LABELS["dead_letters"].format(n=len(letters) + len(txn_letters)))
+    with st.expander(LABELS["dead_letters_details"]):
+        st.dataframe(pd.DataFrame(letters + txn_letters).drop(columns="id"), hide_index=True,
+                     use_container_width=True)
+        if st.button(LABELS["dead_letters_discard"], key="dead_letters_discard"):
+            backend.discard_dead_letters([letter["id"] for letter in letters])
+            journal.discard_dead_letters([letter["id"] for letter in txn_letters])
+            st.rerun()
+
+
+dead_letter_notice()
+
 # ---------------------------------------------------------------------------
 # Global search
 # ---------------------------------------------------------------------------
@@ -390,46 +480,81 @@ SEARCH_SHEET_CONFIG = {
     },
 }
 
-search_query = st.text_input("🔍 అన్ని పేజీల్లో వెతకండి", key="global_search",
-                              placeholder="పేరు, ID, స్థలం...")
 
-if search_query and search_query.strip():
-    q = search_query.strip().lower()
+@st.fragment
+def global_search():
+    """Search box and results, rerun on their own so a new query does not redraw the page.
+
+    st.text_input reports the query on Enter or when it loses focus, so
+    each query is searched as soon as it arrives.
+    """
+    search_query = st.text_input("🔍 అన్ని పేజీల్లో వెతకండి", key="global_search",
+                                  placeholder="పేరు, ID, స్థలం...")
+    q = (search_query or "").strip()
+    if not q:
+        job = st.session_state.pop("search_job", None)
+        if job is not None:
+            job.cancel()
+        return
+
+    job = start_search(q, [(label, cfg["sheet"], cfg["cols"])
+                           for label, cfg in SEARCH_SHEET_CONFIG.items()])
+    # Draw each group as the worker finishes it. Any widget interaction
+    # interrupts this loop at the next status update.
+    status = st.empty()
+    shown = 0
     found_any = False
-    for group_label, cfg in SEARCH_SHEET_CONFIG.items():
-        df = get_data(cfg["key"], cfg["sheet"])
-        if df.empty:
-            continue
-        available_cols = [c for c in cfg["cols"] if c in df.columns]
-        if not available_cols:
-            continue
-        mask = df[available_cols].astype(str).apply(
-            lambda col: col.str.lower().str.contains(q, na=False)
-        ).any(axis=1)
-        matches = df[mask]
-        if not matches.empty:
-            found_any = True
-            st.markdown(f"**{group_label}** — {len(matches)} ఫలితాలు")
-            st.dataframe(matches[available_cols].head(10),
-                         hide_index=True, use_container_width=True)
+    done = False
+    while not done:
+        results, done = job.wait(SEARCH_POLL_SECONDS)
+        for group_label, df, available_cols, positions in results[shown:]:
+            # The index can be a write ahead of this copy; drop rows it lacks
+            positions = [p for p in positions if p < len(df)]
+            if positions:
+                found_any = True
+                cfg = SEARCH_SHEET_CONFIG[group_label]
+                st.markdown(f"**{group_label}** — {len(positions)} ఫలితాలు")
+                matches = df.iloc[positions[:10]][available_cols]
+                # Search may have used only the searched columns; load the
+                # whole sheet just for the groups the user opens
+                if st.toggle("అన్ని వివరాలు", key=f"search_full_{cfg['key']}"):
+                    full = get_data(cfg["key"], cfg["sheet"])
+                    id_col = PRIMARY_KEYS[cfg["sheet"]]
+                    if id_col in matches.columns and id_col in full.columns:
+                        matches = full[full[id_col].isin(matches[id_col])]
+                st.dataframe(display_frame(matches), hide_index=True, use_container_width=True)
+        shown = len(results)
+        if not done:
+            status.caption("వెతుకుతోంది...")
+    status.empty()
     if not found_any:
         st.info("ఫలితాలు దొరకలేదు.")
     st.divider()
 
+
+# Filled in at the end of the script, so the page renders before the
+# search loop starts waiting on results
+search_area = st.container()
+
 # ---------------------------------------------------------------------------
 # PAGE: Dashboard
 # ---------------------------------------------------------------------------
 if page == LABELS["dashboard"]:
-    workers = get_data("workers", SHEET_NAMES["workers"])
-    tools = get_data("tools", SHEET_NAMES["tools"])
-    work_logs = get_data("work_logs", SHEET_NAMES["work_logs"])
-
-    active_count = int((workers["active"] == "Y").sum())
-    total_tools = len(tools)
-    repair_count = int((tools["status_te"] != "బాగుంది").sum())
-
-    unpaid_logs = work_logs[work_logs["pay_status"].isin(["UNPAID", "PARTIAL"])].copy()
-    unpaid_total = float((unpaid_logs["amount_due"] - unpaid_logs["amount_paid"]).sum())
+    workers, tools, work_logs = get_data_many([
+        ("workers", SHEET_NAMES["workers"]),
+        ("tools", SHEET_NAMES["tools"]),
+        ("work_logs", SHEET_NAMES["work_logs"]),
+    ])
+
+    # Kept up to date by the write helpers, so no full-sheet scans here
+    tool_statuses = value_tally(SHEET_NAMES["tools"], "status_te")
+    active_count = value_tally(SHEET_NAMES["workers"], "active").count("Y")
+    total_tools = len(tool_statuses)
+    repair_count = total_tools - tool_statuses.count("బాగుంది")
+
+    ledger = unpaid_ledger()
+    unpaid_logs = rows_at(work_logs, ledger.positions())
+    unpaid_total = ledger.total
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric(LABELS["active_workers"], active_count)
@@ -441,12 +566,13 @@ if page == LABELS["dashboard"]:
     if unpaid_logs.empty:
         st.info("అన్ని చెల్లింపులు పూర్తయ్యాయి!")
     else:
-        display = unpaid_logs[["work_log_id", "date", "worker_name_te", "work_type_te",
-                                "amount_due", "amount_paid", "pay_status"]].copy()
-        display.columns = [LABELS["worker_id"], LABELS["date"], LABELS["name"],
-                           LABELS["work_type"], LABELS["amount_due"],
-                           LABELS["amount_paid"], LABELS["pay_status"]]
-        st.dataframe(display, hide_index=True, use_container_width=True)
+        paged_table(unpaid_logs,
+                    ["work_log_id", "date", "worker_name_te", "work_type_te",
+                     "amount_due", "amount_paid", "pay_status"],
+                    [LABELS["worker_id"], LABELS["date"], LABELS["name"],
+                     LABELS["work_type"], LABELS["amount_due"],
+                     LABELS["amount_paid"], LABELS["pay_status"]],
+                    key="unpaid_table")
 
     st.subheader(LABELS["repair_tools"])
     repair_tools = tools[tools["status_te"] != "బాగుంది"].copy()
@@ -459,6 +585,26 @@ if page == LABELS["dashboard"]:
                              LABELS["status"], LABELS["location"]]
         st.dataframe(display_t, hide_index=True, use_container_width=True)
 
+    with st.expander(LABELS["export"]):
+        export_format = st.radio(LABELS["export_format"], export_sheets.FORMATS,
+                                 format_func=str.upper, horizontal=True, key="export_format")
+        changed_only = st.checkbox(LABELS["export_changed_only"], key="export_changed_only")
+        st.download_button(
+            LABELS["export_download"],
+            # Built only when clicked, not on every rerun of the dashboard
+            partial(export_archive, export_format, changed_only),
+            file_name=f"farm-{date.today():%Y%m%d}{'-changes' if changed_only else ''}.zip",
+            mime="application/zip",
+            on_click="ignore",
+            key="export_download",
+        )
+        if changed_only and st.button(LABELS["export_confirm"], help=LABELS["export_confirm_help"],
+                                      key="export_confirm"):
+            if export_sheets.SnapshotState.confirm(export_state_path()):
+                st.success(LABELS["export_confirmed"])
+            else:
+                st.info(LABELS["export_not_staged"])
+
 # ---------------------------------------------------------------------------
 # PAGE: Workers
 # ---------------------------------------------------------------------------
@@ -483,7 +629,7 @@ elif page == LABELS["workers"]:
             submitted = st.form_submit_button(LABELS["save"])
 
         if submitted and new_name.strip():
-            new_id = next_id(workers, "worker_id", "W", 3)
+            new_id = next_id(SHEET_NAMES["workers"], workers, "worker_id", "W", 3)
             new_row = pd.DataFrame([{
                 "worker_id": new_id,
                 "name_te": new_name.strip(),
@@ -492,122 +638,125 @@ elif page == LABELS["workers"]:
                 "active": new_active,
                 "notes": new_notes.strip(),
             }])
-            workers = pd.concat([workers, new_row], ignore_index=True)
-            save_sheet(workers, SHEET_NAMES["workers"])
-            st.session_state["workers"] = workers
-            st.success(f"కూలీ {new_id} చేర్చబడింది!")
-            st.rerun()
+            try:
+                workers = append_rows(workers, new_row, SHEET_NAMES["workers"])
+            except WriteConflict as exc:
+                show_conflict(exc)
+            else:
+                st.session_state["workers"] = workers
+                st.success(f"కూలీ {new_id} చేర్చబడింది!")
+                st.rerun()
 
     # --- Edit worker ---
     with st.expander(LABELS["edit_worker"], expanded=False):
-        worker_options = [
-            f"{r.name_te} ({r.worker_id})" for _, r in workers.iterrows()
-        ]
-        if worker_options:
-            sel = st.selectbox("కూలీని ఎంచుకోండి", worker_options, key="edit_worker_sel")
-            sel_id = sel.split("(")[-1].rstrip(")")
-            row = workers[workers["worker_id"] == sel_id].iloc[0]
-
-            with st.form("edit_worker_form"):
-                ed_name = st.text_input(LABELS["name"], value=row["name_te"])
-                ed_phone = st.text_input(LABELS["phone"], value=str(row["phone"]))
-                ed_wage = st.number_input(LABELS["daily_wage"], min_value=0,
-                                          value=int(row["default_daily_wage"]), step=50)
-                ed_active = st.selectbox(LABELS["active"], ["Y", "N"],
-                                         index=0 if row["active"] == "Y" else 1)
-                ed_notes = st.text_input(LABELS["notes"], value=str(row["notes"]))
-                ed_submit = st.form_submit_button(LABELS["save"])
-
-            if ed_submit:
-                idx = workers.index[workers["worker_id"] == sel_id][0]
-                workers.at[idx, "name_te"] = ed_name.strip()
-                workers.at[idx, "phone"] = ed_phone.strip()
-                workers.at[idx, "default_daily_wage"] = int(ed_wage)
-                workers.at[idx, "active"] = ed_active
-                workers.at[idx, "notes"] = ed_notes.strip()
-                save_sheet(workers, SHEET_NAMES["workers"])
-                st.session_state["workers"] = workers
-                st.success(f"కూలీ {sel_id} అప్డేట్ చేయబడింది!")
-                st.rerun()
+        worker_options = options(SHEET_NAMES["workers"], workers, "{name_te} ({worker_id})")
+        if worker_options.ids:
+            sel_id = st.selectbox("కూలీని ఎంచుకోండి", worker_options.ids,
+                                  format_func=worker_options.label, key="edit_worker_sel")
+            idx = find_row(SHEET_NAMES["workers"], workers, sel_id)
+            if idx is None:
+                show_missing_row(sel_id)
+            else:
+                row = workers.loc[idx]
+
+                with st.form("edit_worker_form"):
+                    ed_name = st.text_input(LABELS["name"], value=row["name_te"])
+                    ed_phone = st.text_input(LABELS["phone"], value=str(row["phone"]))
+                    ed_wage = st.number_input(LABELS["daily_wage"], min_value=0,
+                                              value=int(row["default_daily_wage"]), step=50)
+                    ed_active = st.selectbox(LABELS["active"], ["Y", "N"],
+                                             index=0 if row["active"] == "Y" else 1)
+                    ed_notes = st.text_input(LABELS["notes"], value=str(row["notes"]))
+                    ed_submit = st.form_submit_button(LABELS["save"])
+
+                if ed_submit:
+                    try:
+                        workers = update_rows(workers, SHEET_NAMES["workers"], {idx: {
+                            "name_te": ed_name.strip(),
+                            "phone": ed_phone.strip(),
+                            "default_daily_wage": int(ed_wage),
+                            "active": ed_active,
+                            "notes": ed_notes.strip(),
+                        }})
+                    except WriteConflict as exc:
+                        show_conflict(exc)
+                    else:
+                        st.session_state["workers"] = workers
+                        st.success(f"కూలీ {sel_id} అప్డేట్ చేయబడింది!")
+                        st.rerun()
 
 # ---------------------------------------------------------------------------
 # PAGE: Work Logs
 # ---------------------------------------------------------------------------
 elif page == LABELS["work_logs"]:
-    work_logs = get_data("work_logs", SHEET_NAMES["work_logs"])
-    workers = get_data("workers", SHEET_NAMES["workers"])
-    work_types = get_data("work_types", SHEET_NAMES["work_types"])
+    work_logs, workers, work_types = get_data_many([
+        ("work_logs", SHEET_NAMES["work_logs"]),
+        ("workers", SHEET_NAMES["workers"]),
+        ("work_types", SHEET_NAMES["work_types"]),
+    ])
 
     st.subheader(LABELS["work_logs"])
 
     # --- Filters ---
+    wl_dates = date_index(SHEET_NAMES["work_logs"], "date", ["worker_name_te"])
     fc1, fc2, fc3 = st.columns(3)
     with fc1:
-        dates_in_data = sorted(work_logs["date"].unique())
-        min_d = datetime.strptime(dates_in_data[0], "%Y-%m-%d").date() if dates_in_data else date.today()
-        max_d = datetime.strptime(dates_in_data[-1], "%Y-%m-%d").date() if dates_in_data else date.today()
+        min_d = wl_dates.min_date or date.today()
+        max_d = wl_dates.max_date or date.today()
         date_range = st.date_input(LABELS["filter_date"], value=(min_d, max_d),
                                    min_value=min_d, max_value=max_d, key="wl_date_range")
     with fc2:
-        worker_names = [LABELS["all"]] + sorted(work_logs["worker_name_te"].unique().tolist())
+        worker_names = [LABELS["all"]] + wl_dates.values("worker_name_te")
         sel_worker = st.selectbox(LABELS["filter_worker"], worker_names, key="wl_worker_filter")
     with fc3:
         status_opts = [LABELS["all"]] + PAY_STATUSES
         sel_status = st.selectbox(LABELS["filter_pay_status"], status_opts, key="wl_status_filter")
 
-    filtered = work_logs.copy()
+    d_start = d_end = None
     if isinstance(date_range, tuple) and len(date_range) == 2:
         d_start, d_end = date_range
-        filtered = filtered[
-            (filtered["date"] >= d_start.strftime("%Y-%m-%d")) &
-            (filtered["date"] <= d_end.strftime("%Y-%m-%d"))
-        ]
-    if sel_worker != LABELS["all"]:
-        filtered = filtered[filtered["worker_name_te"] == sel_worker]
+    where = {} if sel_worker == LABELS["all"] else {"worker_name_te": sel_worker}
+    filtered = rows_at(work_logs, wl_dates.positions(d_start, d_end, where))
     if sel_status != LABELS["all"]:
         filtered = filtered[filtered["pay_status"] == sel_status]
 
-    display_wl = filtered[["work_log_id", "date", "worker_name_te", "work_type_te",
-                            "day_unit", "rate_daily", "amount_due", "amount_paid",
-                            "pay_status", "pay_method", "notes"]].copy()
-    display_wl.columns = ["ID", LABELS["date"], LABELS["name"], LABELS["work_type"],
-                          LABELS["day_unit"], LABELS["rate"], LABELS["amount_due"],
-                          LABELS["amount_paid"], LABELS["pay_status"],
-                          LABELS["pay_method"], LABELS["notes"]]
-    st.dataframe(display_wl, hide_index=True, use_container_width=True)
+    paged_table(filtered,
+                ["work_log_id", "date", "worker_name_te", "work_type_te",
+                 "day_unit", "rate_daily", "amount_due", "amount_paid",
+                 "pay_status", "pay_method", "notes"],
+                ["ID", LABELS["date"], LABELS["name"], LABELS["work_type"],
+                 LABELS["day_unit"], LABELS["rate"], LABELS["amount_due"],
+                 LABELS["amount_paid"], LABELS["pay_status"],
+                 LABELS["pay_method"], LABELS["notes"]],
+                key="wl_table")
 
     # --- Add work log ---
     with st.expander(LABELS["add_work_log"], expanded=False):
-        active_workers = workers[workers["active"] == "Y"].copy()
-        worker_opts = [
-            f"{r.name_te} ({r.worker_id})" for _, r in active_workers.iterrows()
-        ]
-        wt_opts = [
-            f"{r.name_te} ({r.work_type_id})" for _, r in work_types.iterrows()
-        ]
+        worker_opts = options(SHEET_NAMES["workers"], workers, "{name_te} ({worker_id})",
+                              where={"active": ["Y"]})
+        wt_opts = options(SHEET_NAMES["work_types"], work_types, "{name_te} ({work_type_id})")
 
         with st.form("add_wl_form"):
             wl_date = st.date_input(LABELS["date"], value=date.today())
-            wl_worker = st.selectbox(LABELS["worker"], worker_opts)
-            wl_type = st.selectbox(LABELS["work_type"], wt_opts)
+            w_id = st.selectbox(LABELS["worker"], worker_opts.ids, format_func=worker_opts.label)
+            wt_id = st.selectbox(LABELS["work_type"], wt_opts.ids, format_func=wt_opts.label)
             wl_unit = st.selectbox(LABELS["day_unit"], ["FULL", "HALF"],
                                    format_func=lambda x: LABELS["full_day"] if x == "FULL"
                                    else LABELS["half_day"])
 
-            # Extract IDs
-            w_id = wl_worker.split("(")[-1].rstrip(")")
-            wt_id = wl_type.split("(")[-1].rstrip(")")
-            w_row = active_workers[active_workers["worker_id"] == w_id].iloc[0]
-            wt_row = work_types[work_types["work_type_id"] == wt_id].iloc[0]
+            w_idx = find_row(SHEET_NAMES["workers"], workers, w_id)
+            wt_idx = find_row(SHEET_NAMES["work_types"], work_types, wt_id)
+            default_wage = int(workers.at[w_idx, "default_daily_wage"]) if w_idx is not None else 0
 
-            wl_rate = st.number_input(LABELS["rate"], min_value=0,
-                                      value=int(w_row["default_daily_wage"]), step=50)
+            wl_rate = st.number_input(LABELS["rate"], min_value=0, value=default_wage, step=50)
             wl_amount_paid = st.number_input(LABELS["amount_paid"], min_value=0, value=0, step=50)
             wl_pay_method = st.selectbox(LABELS["pay_method"], [""] + PAY_METHODS)
             wl_notes = st.text_input(LABELS["notes"])
             wl_submit = st.form_submit_button(LABELS["submit"])
 
-        if wl_submit:
+        if wl_submit and (w_idx is None or wt_idx is None):
+            show_missing_row(w_id if w_idx is None else wt_id)
+        elif wl_submit:
             amount_due = int(wl_rate) if wl_unit == "FULL" else int(wl_rate) // 2
             paid = int(wl_amount_paid)
             if paid == 0:
@@ -617,14 +766,14 @@ elif page == LABELS["work_logs"]:
             else:
                 pay_st = "PARTIAL"
 
-            new_wl_id = next_id(work_logs, "work_log_id", "WL", 6)
+            new_wl_id = next_id(SHEET_NAMES["work_logs"], work_logs, "work_log_id", "WL", 6)
             new_wl = pd.DataFrame([{
                 "work_log_id": new_wl_id,
                 "date": wl_date.strftime("%Y-%m-%d"),
                 "worker_id": w_id,
-                "worker_name_te": w_row["name_te"],
+                "worker_name_te": workers.at[w_idx, "name_te"],
                 "work_type_id": wt_id,
-                "work_type_te": wt_row["name_te"],
+                "work_type_te": work_types.at[wt_idx, "name_te"],
                 "day_unit": wl_unit,
                 "rate_daily": int(wl_rate),
                 "amount_due": amount_due,
@@ -633,27 +782,30 @@ elif page == LABELS["work_logs"]:
                 "pay_method": wl_pay_method if paid > 0 else "",
                 "notes": wl_notes.strip(),
             }])
-            work_logs = pd.concat([work_logs, new_wl], ignore_index=True)
-            save_sheet(work_logs, SHEET_NAMES["work_logs"])
-            st.session_state["work_logs"] = work_logs
-            st.success(f"పని రికార్డు {new_wl_id} చేర్చబడింది!")
-            st.rerun()
+            try:
+                work_logs = append_rows(work_logs, new_wl, SHEET_NAMES["work_logs"])
+            except WriteConflict as exc:
+                show_conflict(exc)
+            else:
+                st.session_state["work_logs"] = work_logs
+                st.success(f"పని రికార్డు {new_wl_id} చేర్చబడింది!")
+                st.rerun()
 
     # --- Mark payment ---
     with st.expander(LABELS["mark_payment"], expanded=False):
-        unpaid = work_logs[work_logs["pay_status"].isin(["UNPAID", "PARTIAL"])].copy()
-        if unpaid.empty:
+        pay_opts = options(
+            SHEET_NAMES["work_logs"], work_logs,
+            "{work_log_id} | {date} | {worker_name_te} | ₹{amount_due} (చెల్లించింది: ₹{amount_paid})",
+            where={"pay_status": ["UNPAID", "PARTIAL"]})
+        if not pay_opts.ids:
             st.info("చెల్లించని రికార్డులు లేవు!")
         else:
-            pay_opts = [
-                f"{r.work_log_id} | {r.date} | {r.worker_name_te} | ₹{r.amount_due} (చెల్లించింది: ₹{r.amount_paid})"
-                for _, r in unpaid.iterrows()
-            ]
             with st.form("mark_pay_form"):
-                sel_pay = st.selectbox("రికార్డు ఎంచుకోండి", pay_opts)
-                sel_pay_id = sel_pay.split(" | ")[0]
-                sel_row = work_logs[work_logs["work_log_id"] == sel_pay_id].iloc[0]
-                remaining = int(sel_row["amount_due"]) - int(sel_row["amount_paid"])
+                sel_pay_id = st.selectbox("రికార్డు ఎంచుకోండి", pay_opts.ids,
+                                          format_func=pay_opts.label)
+                idx = find_row(SHEET_NAMES["work_logs"], work_logs, sel_pay_id)
+                remaining = (0 if idx is None else
+                             int(work_logs.at[idx, "amount_due"]) - int(work_logs.at[idx, "amount_paid"]))
 
                 pay_amount = st.number_input(
                     f"చెల్లించే మొత్తం (బాకీ: ₹{remaining})",
@@ -662,21 +814,72 @@ elif page == LABELS["work_logs"]:
                 pay_method = st.selectbox(LABELS["pay_method"], PAY_METHODS, key="pay_method_mark")
                 pay_submit = st.form_submit_button(LABELS["submit"])
 
-            if pay_submit and pay_amount > 0:
-                idx = work_logs.index[work_logs["work_log_id"] == sel_pay_id][0]
+            if pay_submit and idx is None:
+                show_missing_row(sel_pay_id)
+            elif pay_submit and pay_amount > 0:
                 new_paid = int(work_logs.at[idx, "amount_paid"]) + pay_amount
-                work_logs.at[idx, "amount_paid"] = new_paid
+                changes = {"amount_paid": new_paid}
                 due = int(work_logs.at[idx, "amount_due"])
                 if new_paid >= due:
-                    work_logs.at[idx, "pay_status"] = "PAID"
+                    changes["pay_status"] = "PAID"
                 elif new_paid > 0:
-                    work_logs.at[idx, "pay_status"] = "PARTIAL"
+                    changes["pay_status"] = "PARTIAL"
                 # Update pay method
-                work_logs.at[idx, "pay_method"] = pay_method
-                save_sheet(work_logs, SHEET_NAMES["work_logs"])
-                st.session_state["work_logs"] = work_logs
-                st.success(f"₹{pay_amount} చెల్లింపు నమోదు చేయబడింది!")
-                st.rerun()
+                changes["pay_method"] = pay_method
+                try:
+                    work_logs = update_rows(work_logs, SHEET_NAMES["work_logs"], {idx: changes})
+                except WriteConflict as exc:
+                    show_conflict(exc)
+                else:
+                    st.session_state["work_logs"] = work_logs
+                    st.success(f"₹{pay_amount} చెల్లింపు నమోదు చేయబడింది!")
+                    st.rerun()
+
+    # --- Settle a worker's balance ---
+    with st.expander(LABELS["settle_worker"], expanded=False):
+        ledger = unpaid_ledger()
+        owing = {w: int(round(b)) for w, b in ledger.balances.items() if round(b) > 0}
+        if not owing:
+            st.info("చెల్లించని రికార్డులు లేవు!")
+        else:
+            def worker_name(worker_id):
+                idx = find_row(SHEET_NAMES["workers"], workers, worker_id)
+                return worker_id if idx is None else workers.at[idx, "name_te"]
+
+            settle_id = st.selectbox(
+                LABELS["worker"], sorted(owing, key=lambda w: -owing[w]),
+                format_func=lambda w: f"{worker_name(w)} ({w}) - ₹{owing[w]:,}",
+                key="settle_worker_sel")
+            logs = rows_at(work_logs, ledger.worker_positions(settle_id))
+            logs = logs.sort_values("date", kind="stable", na_position="last")
+            owed = (logs["amount_due"].astype("float64").fillna(0)
+                    - logs["amount_paid"].astype("float64").fillna(0))
+            ledger_view = logs[["work_log_id", "date", "work_type_te",
+                                "amount_due", "amount_paid"]].assign(
+                balance=owed.astype(int), running=owed.cumsum().astype(int))
+            ledger_view.columns = ["ID", LABELS["date"], LABELS["work_type"],
+                                   LABELS["amount_due"], LABELS["amount_paid"],
+                                   LABELS["balance"], LABELS["running_balance"]]
+            st.dataframe(display_frame(ledger_view), hide_index=True, use_container_width=True)
+
+            with st.form("settle_form"):
+                settle_amount = st.number_input(
+                    f"చెల్లించే మొత్తం (బాకీ: ₹{owing[settle_id]})",
+                    min_value=0, max_value=owing[settle_id], value=owing[settle_id], step=50)
+                settle_method = st.selectbox(LABELS["pay_method"], PAY_METHODS,
+                                             key="pay_method_settle")
+                settle_submit = st.form_submit_button(LABELS["submit"])
+
+            if settle_submit and settle_amount > 0:
+                changes = settle_oldest_first(logs, settle_amount, settle_method)
+                try:
+                    work_logs = update_rows(work_logs, SHEET_NAMES["work_logs"], changes)
+                except WriteConflict as exc:
+                    show_conflict(exc)
+                else:
+                    st.session_state["work_logs"] = work_logs
+                    st.success(f"₹{int(settle_amount)} చెల్లింపు {len(changes)} రికార్డులకు నమోదు చేయబడింది!")
+                    st.rerun()
 
 # ---------------------------------------------------------------------------
 # PAGE: Tools
@@ -707,66 +910,78 @@ elif page == LABELS["tools"]:
     display_tools.columns = [LABELS["tool_id"], LABELS["tool_name"], LABELS["tool_type"],
                              LABELS["quantity"], LABELS["status"], LABELS["location"],
                              LABELS["last_updated"], LABELS["notes"]]
-    st.dataframe(display_tools, hide_index=True, use_container_width=True)
+    st.dataframe(display_frame(display_tools), hide_index=True, use_container_width=True)
 
     # --- Update status ---
     with st.expander(LABELS["update_status"], expanded=False):
-        tool_opts = [
-            f"{r.name_te} ({r.tool_id}) - {r.status_te}" for _, r in tools.iterrows()
-        ]
+        tool_opts = options(SHEET_NAMES["tools"], tools, "{name_te} ({tool_id}) - {status_te}")
         with st.form("update_status_form"):
-            sel_tool = st.selectbox(LABELS["tool"], tool_opts)
-            sel_tool_id = sel_tool.split("(")[1].split(")")[0]
+            sel_tool_id = st.selectbox(LABELS["tool"], tool_opts.ids, format_func=tool_opts.label)
             new_status = st.selectbox(LABELS["status"], TOOL_STATUSES)
             status_submit = st.form_submit_button(LABELS["save"])
 
         if status_submit:
-            idx = tools.index[tools["tool_id"] == sel_tool_id][0]
-            tools.at[idx, "status_te"] = new_status
-            tools.at[idx, "last_updated"] = date.today().strftime("%Y-%m-%d")
-            save_sheet(tools, SHEET_NAMES["tools"])
-            st.session_state["tools"] = tools
-            st.success(f"పరికరం {sel_tool_id} స్థితి '{new_status}' కి మార్చబడింది!")
-            st.rerun()
+            idx = find_row(SHEET_NAMES["tools"], tools, sel_tool_id)
+            if idx is None:
+                show_missing_row(sel_tool_id)
+            else:
+                try:
+                    tools = update_rows(tools, SHEET_NAMES["tools"], {idx: {
+                        "status_te": new_status,
+                        "last_updated": date.today().strftime("%Y-%m-%d"),
+                    }})
+                except WriteConflict as exc:
+                    show_conflict(exc)
+                else:
+                    st.session_state["tools"] = tools
+                    st.success(f"పరికరం {sel_tool_id} స్థితి '{new_status}' కి మార్చబడింది!")
+                    st.rerun()
 
 # ---------------------------------------------------------------------------
 # PAGE: Tool Moves
 # ---------------------------------------------------------------------------
 elif page == LABELS["tool_moves"]:
-    tools = get_data("tools", SHEET_NAMES["tools"])
-    tool_moves = get_data("tool_moves", SHEET_NAMES["tool_moves"])
-    places = get_data("storage_places", SHEET_NAMES["storage_places"])
+    # A move left unsettled by a failed request shows up before anyone
+    # retries it. Once per session; a failed replay is tried again next time.
+    if not st.session_state.get("txn_replayed"):
+        st.session_state["txn_replayed"] = replay_transactions()
+        if not st.session_state["txn_replayed"]:
+            st.warning(LABELS["txn_unsettled"])
+    tools, tool_moves, places = get_data_many([
+        ("tools", SHEET_NAMES["tools"]),
+        ("tool_moves", SHEET_NAMES["tool_moves"]),
+        ("storage_places", SHEET_NAMES["storage_places"]),
+    ])
 
     st.subheader(LABELS["add_move"])
 
-    tool_opts = [
-        f"{r.name_te} ({r.tool_id}) - {r.current_place_te}" for _, r in tools.iterrows()
-    ]
-    place_opts = [
-        f"{r.name_te} ({r.place_id})" for _, r in places.iterrows()
-    ]
+    tool_opts = options(SHEET_NAMES["tools"], tools, "{name_te} ({tool_id}) - {current_place_te}")
+    place_opts = options(SHEET_NAMES["storage_places"], places, "{name_te} ({place_id})")
 
     with st.form("add_move_form"):
         mv_date = st.date_input(LABELS["date"], value=date.today())
-        mv_tool = st.selectbox(LABELS["tool"], tool_opts)
-        mv_tool_id = mv_tool.split("(")[1].split(")")[0]
-        tool_row = tools[tools["tool_id"] == mv_tool_id].iloc[0]
+        mv_tool_id = st.selectbox(LABELS["tool"], tool_opts.ids, format_func=tool_opts.label)
+        t_idx = find_row(SHEET_NAMES["tools"], tools, mv_tool_id)
+        tool_row = tools.loc[t_idx] if t_idx is not None else None
 
-        st.text_input(LABELS["from_place"], value=tool_row["current_place_te"], disabled=True)
+        st.text_input(LABELS["from_place"], disabled=True,
+                      value=tool_row["current_place_te"] if tool_row is not None else "")
 
-        mv_to = st.selectbox(LABELS["to_place"], place_opts)
-        mv_to_id = mv_to.split("(")[-1].rstrip(")")
-        mv_to_name = places[places["place_id"] == mv_to_id].iloc[0]["name_te"]
+        mv_to_id = st.selectbox(LABELS["to_place"], place_opts.ids, format_func=place_opts.label)
+        to_idx = find_row(SHEET_NAMES["storage_places"], places, mv_to_id)
 
         mv_by = st.text_input(LABELS["moved_by"])
         mv_notes = st.text_input(LABELS["notes"])
         mv_submit = st.form_submit_button(LABELS["submit"])
 
-    if mv_submit:
+    if mv_submit and (t_idx is None or to_idx is None):
+        show_missing_row(mv_tool_id if t_idx is None else mv_to_id)
+    elif mv_submit:
+        mv_to_name = places.at[to_idx, "name_te"]
         if mv_to_id == tool_row["current_place_id"]:
             st.error("పరికరం ఇప్పటికే ఆ స్థలంలో ఉంది! వేరే స్థలాన్ని ఎంచుకోండి.")
         else:
-            new_mv_id = next_id(tool_moves, "tool_move_id", "TM", 6)
+            new_mv_id = next_id(SHEET_NAMES["tool_moves"], tool_moves, "tool_move_id", "TM", 6)
             new_move = pd.DataFrame([{
                 "tool_move_id": new_mv_id,
                 "date": mv_date.strftime("%Y-%m-%d"),
@@ -779,30 +994,46 @@ elif page == LABELS["tool_moves"]:
                 "moved_by": mv_by.strip(),
                 "notes": mv_notes.strip(),
             }])
-            tool_moves = pd.concat([tool_moves, new_move], ignore_index=True)
-            save_sheet(tool_moves, SHEET_NAMES["tool_moves"])
-            st.session_state["tool_moves"] = tool_moves
-
-            # Update tool's current location
-            t_idx = tools.index[tools["tool_id"] == mv_tool_id][0]
-            tools.at[t_idx, "current_place_id"] = mv_to_id
-            tools.at[t_idx, "current_place_te"] = mv_to_name
-            tools.at[t_idx, "last_updated"] = mv_date.strftime("%Y-%m-%d")
-            save_sheet(tools, SHEET_NAMES["tools"])
-            st.session_state["tools"] = tools
-
-            st.success(f"పరికరం {mv_tool_id} తరలింపు {new_mv_id} నమోదు చేయబడింది!")
-            st.rerun()
+            # The move and the tool's new location are stored together
+            txn = Transaction()
+            txn.append_rows(tool_moves, new_move, SHEET_NAMES["tool_moves"])
+            txn.update_rows(tools, SHEET_NAMES["tools"], {t_idx: {
+                "current_place_id": mv_to_id,
+                "current_place_te": mv_to_name,
+                "last_updated": mv_date.strftime("%Y-%m-%d"),
+            }})
+            try:
+                frames = txn.commit()
+            except WriteConflict as exc:
+                show_conflict(exc)
+            except Exception as exc:
+                if not isinstance(exc, UnsettledTransactions) and rejected(exc):
+                    # Refused outright, so neither sheet was changed
+                    logging.getLogger(__name__).error("A tool move was refused", exc_info=True)
+                    st.error(LABELS["txn_refused"])
+                else:
+                    # Left in the journal; the next page load replays it
+                    logging.getLogger(__name__).warning("Storing a tool move failed", exc_info=True)
+                    st.session_state.pop("txn_replayed", None)
+                    st.warning(LABELS["txn_unsettled"])
+            else:
+                tool_moves = frames[SHEET_NAMES["tool_moves"]]
+                tools = frames[SHEET_NAMES["tools"]]
+                st.session_state["tool_moves"] = tool_moves
+                st.session_state["tools"] = tools
+
+                st.success(f"పరికరం {mv_tool_id} తరలింపు {new_mv_id} నమోదు చేయబడింది!")
+                st.rerun()
 
     st.subheader(LABELS["movement_history"])
-    display_mv = tool_moves[["tool_move_id", "date", "tool_name_te", "from_place_te",
-                              "to_place_te", "moved_by", "notes"]].copy()
-    display_mv.columns = [LABELS["move_id"], LABELS["date"], LABELS["tool_name"],
-                          LABELS["from_place"], LABELS["to_place"],
-                          LABELS["moved_by"], LABELS["notes"]]
     # Show most recent first
-    display_mv = display_mv.iloc[::-1].reset_index(drop=True)
-    st.dataframe(display_mv, hide_index=True, use_container_width=True)
+    paged_table(tool_moves,
+                ["tool_move_id", "date", "tool_name_te", "from_place_te",
+                 "to_place_te", "moved_by", "notes"],
+                [LABELS["move_id"], LABELS["date"], LABELS["tool_name"],
+                 LABELS["from_place"], LABELS["to_place"],
+                 LABELS["moved_by"], LABELS["notes"]],
+                key="mv_table", newest_first=True)
 
 # ---------------------------------------------------------------------------
 # PAGE: చెక్కులు (Tobacco Bales)
@@ -814,46 +1045,43 @@ elif page == LABELS["chekkulu"]:
 
     if not chekkulu.empty:
         # --- Filters ---
+        ck_dates = date_index(SHEET_NAMES["chekkulu"], "date", ["tbgr_number"])
         fc1, fc2, fc3 = st.columns(3)
         with fc1:
-            ck_dates = sorted(chekkulu["date"].unique())
-            ck_min_d = datetime.strptime(ck_dates[0], "%Y-%m-%d").date() if ck_dates else date.today()
-            ck_max_d = datetime.strptime(ck_dates[-1], "%Y-%m-%d").date() if ck_dates else date.today()
+            ck_min_d = ck_dates.min_date or date.today()
+            ck_max_d = ck_dates.max_date or date.today()
             ck_date_range = st.date_input(LABELS["filter_ck_date"],
                                           value=(ck_min_d, ck_max_d),
                                           min_value=ck_min_d, max_value=ck_max_d,
                                           key="ck_date_filter")
         with fc2:
-            tbgr_opts = [LABELS["all"]] + sorted([str(x) for x in chekkulu["tbgr_number"].unique() if x])
+            tbgr_opts = [LABELS["all"]] + [x for x in ck_dates.values("tbgr_number") if x]
             sel_tbgr = st.selectbox(LABELS["filter_tbgr"], tbgr_opts, key="ck_tbgr_filter")
         with fc3:
             type_opts = [LABELS["all"]] + sorted(chekkulu["type"].unique().tolist())
             sel_ck_type = st.selectbox(LABELS["filter_ck_type"], type_opts, key="ck_type_filter")
 
-        filtered_ck = chekkulu.copy()
+        d_start = d_end = None
         if isinstance(ck_date_range, tuple) and len(ck_date_range) == 2:
             d_start, d_end = ck_date_range
-            filtered_ck = filtered_ck[
-                (filtered_ck["date"] >= d_start.strftime("%Y-%m-%d")) &
-                (filtered_ck["date"] <= d_end.strftime("%Y-%m-%d"))
-            ]
-        if sel_tbgr != LABELS["all"]:
-            filtered_ck = filtered_ck[filtered_ck["tbgr_number"].astype(str) == sel_tbgr]
+        where = {} if sel_tbgr == LABELS["all"] else {"tbgr_number": sel_tbgr}
+        filtered_ck = rows_at(chekkulu, ck_dates.positions(d_start, d_end, where))
         if sel_ck_type != LABELS["all"]:
             filtered_ck = filtered_ck[filtered_ck["type"] == sel_ck_type]
 
-        filtered_ck["total"] = pd.to_numeric(filtered_ck["rate"], errors="coerce").fillna(0) \
-                              * pd.to_numeric(filtered_ck["weight"], errors="coerce").fillna(0)
+        filtered_ck = filtered_ck.assign(
+            total=filtered_ck["rate"].fillna(0) * filtered_ck["weight"].fillna(0))
 
         st.metric(LABELS["chekkulu_total"], f"₹{filtered_ck['total'].sum():,.2f}")
 
-        display_ck = filtered_ck[["chekkulu_id", "date", "rate", "weight",
-                                   "total", "tbgr_number", "type"]].copy()
-        display_ck.columns = [LABELS["chekkulu_id"], LABELS["date"],
-                              LABELS["chekkulu_rate"], LABELS["chekkulu_weight"],
-                              LABELS["chekkulu_total"],
-                              LABELS["tbgr_number"], LABELS["chekkulu_type"]]
-        st.dataframe(display_ck, hide_index=True, use_container_width=True)
+        paged_table(filtered_ck,
+                    ["chekkulu_id", "date", "rate", "weight",
+                     "total", "tbgr_number", "type"],
+                    [LABELS["chekkulu_id"], LABELS["date"],
+                     LABELS["chekkulu_rate"], LABELS["chekkulu_weight"],
+                     LABELS["chekkulu_total"],
+                     LABELS["tbgr_number"], LABELS["chekkulu_type"]],
+                    key="ck_table")
     else:
         st.info("చెక్కులు రికార్డులు లేవు.")
 
@@ -870,7 +1098,7 @@ elif page == LABELS["chekkulu"]:
             ck_submit = st.form_submit_button(LABELS["save"])
 
         if ck_submit:
-            new_ck_id = next_id(chekkulu, "chekkulu_id", "CK", 6)
+            new_ck_id = next_id(SHEET_NAMES["chekkulu"], chekkulu, "chekkulu_id", "CK", 6)
             new_ck = pd.DataFrame([{
                 "chekkulu_id": new_ck_id,
                 "date": ck_date.strftime("%Y-%m-%d"),
@@ -879,11 +1107,14 @@ elif page == LABELS["chekkulu"]:
                 "tbgr_number": ck_tbgr.strip(),
                 "type": ck_type.strip(),
             }])
-            chekkulu = pd.concat([chekkulu, new_ck], ignore_index=True)
-            save_sheet(chekkulu, SHEET_NAMES["chekkulu"])
-            st.session_state["chekkulu"] = chekkulu
-            st.success(f"చెక్క {new_ck_id} చేర్చబడింది!")
-            st.rerun()
+            try:
+                chekkulu = append_rows(chekkulu, new_ck, SHEET_NAMES["chekkulu"])
+            except WriteConflict as exc:
+                show_conflict(exc)
+            else:
+                st.session_state["chekkulu"] = chekkulu
+                st.success(f"చెక్క {new_ck_id} చేర్చబడింది!")
+                st.rerun()
 
 # ---------------------------------------------------------------------------
 # PAGE: కోల్డ్ స్టోరేజ్ (Cold Storage)
@@ -895,20 +1126,20 @@ elif page == LABELS["cold_storage"]:
 
     if not cold_storage.empty:
         # --- Filters ---
+        cs_stored = date_index(SHEET_NAMES["cold_storage"], "date_stored", ["serial_number"])
+        cs_removed = date_index(SHEET_NAMES["cold_storage"], "date_removed")
         fc1, fc2, fc3, fc4 = st.columns(4)
         with fc1:
-            cs_dates = sorted([d for d in cold_storage["date_stored"].unique() if d])
-            cs_min_d = datetime.strptime(cs_dates[0], "%Y-%m-%d").date() if cs_dates else date.today()
-            cs_max_d = datetime.strptime(cs_dates[-1], "%Y-%m-%d").date() if cs_dates else date.today()
+            cs_min_d = cs_stored.min_date or date.today()
+            cs_max_d = cs_stored.max_date or date.today()
             cs_date_range = st.date_input(LABELS["filter_cs_date_stored"],
                                           value=(cs_min_d, cs_max_d),
                                           min_value=cs_min_d, max_value=cs_max_d,
                                           key="cs_date_stored_filter")
         with fc2:
-            rm_dates = sorted([d for d in cold_storage["date_removed"].unique() if d])
-            if rm_dates:
-                rm_min_d = datetime.strptime(rm_dates[0], "%Y-%m-%d").date()
-                rm_max_d = datetime.strptime(rm_dates[-1], "%Y-%m-%d").date()
+            if cs_removed.min_date is not None:
+                rm_min_d = cs_removed.min_date
+                rm_max_d = cs_removed.max_date
                 cs_rm_date_range = st.date_input(LABELS["filter_cs_date_removed"],
                                                  value=(rm_min_d, rm_max_d),
                                                  min_value=rm_min_d, max_value=rm_max_d,
@@ -917,43 +1148,35 @@ elif page == LABELS["cold_storage"]:
                 cs_rm_date_range = None
                 st.text_input(LABELS["filter_cs_date_removed"], value="—", disabled=True)
         with fc3:
-            serial_opts = [LABELS["all"]] + sorted([str(s) for s in cold_storage["serial_number"].unique() if s])
+            serial_opts = [LABELS["all"]] + [s for s in cs_stored.values("serial_number") if s]
             sel_serial = st.selectbox(LABELS["filter_serial"], serial_opts, key="cs_serial_filter")
         with fc4:
             cs_type_opts = [LABELS["all"]] + sorted([str(t) for t in cold_storage["type"].unique() if t])
             sel_cs_type = st.selectbox(LABELS["filter_cs_type"], cs_type_opts, key="cs_type_filter")
 
-        filtered_cs = cold_storage.copy()
+        d_start = d_end = None
         if isinstance(cs_date_range, tuple) and len(cs_date_range) == 2:
             d_start, d_end = cs_date_range
-            filtered_cs = filtered_cs[
-                (filtered_cs["date_stored"] >= d_start.strftime("%Y-%m-%d")) &
-                (filtered_cs["date_stored"] <= d_end.strftime("%Y-%m-%d"))
-            ]
+        where = {} if sel_serial == LABELS["all"] else {"serial_number": sel_serial}
+        positions = cs_stored.positions(d_start, d_end, where)
         if cs_rm_date_range is not None and isinstance(cs_rm_date_range, tuple) and len(cs_rm_date_range) == 2:
             r_start, r_end = cs_rm_date_range
-            filtered_cs = filtered_cs[
-                (filtered_cs["date_removed"] >= r_start.strftime("%Y-%m-%d")) &
-                (filtered_cs["date_removed"] <= r_end.strftime("%Y-%m-%d"))
-            ]
-        if sel_serial != LABELS["all"]:
-            filtered_cs = filtered_cs[filtered_cs["serial_number"].astype(str) == sel_serial]
+            positions = np.intersect1d(positions, cs_removed.positions(r_start, r_end))
+        filtered_cs = rows_at(cold_storage, positions)
         if sel_cs_type != LABELS["all"]:
             filtered_cs = filtered_cs[filtered_cs["type"] == sel_cs_type]
 
-        display_cs = filtered_cs[["cold_storage_id", "date_stored", "count",
-                                   "weight", "serial_number", "type",
-                                   "date_removed"]].copy()
         # Build serial_number display: serial / count of rows with same serial
-        serial_counts = cold_storage["serial_number"].value_counts()
-        display_cs["serial_number"] = display_cs["serial_number"].apply(
-            lambda s: f"{s} / {serial_counts[s]}" if s else ""
-        )
-        display_cs.columns = [LABELS["cold_storage_id"], LABELS["date_stored"],
-                              LABELS["count"], LABELS["weight"],
-                              LABELS["serial_number"], LABELS["cs_type"],
-                              LABELS["date_removed"]]
-        st.dataframe(display_cs, hide_index=True, use_container_width=True)
+        paged_table(filtered_cs,
+                    ["cold_storage_id", "date_stored", "count",
+                     "weight", "serial_number", "type", "date_removed"],
+                    [LABELS["cold_storage_id"], LABELS["date_stored"],
+                     LABELS["count"], LABELS["weight"],
+                     LABELS["serial_number"], LABELS["cs_type"],
+                     LABELS["date_removed"]],
+                    key="cs_table",
+                    formats={"serial_number": lambda col: col.map(
+                        lambda s: f"{s} / {cs_stored.count('serial_number', s)}" if s else "")})
     else:
         st.info("కోల్డ్ స్టోరేజ్ రికార్డులు లేవు.")
 
@@ -969,7 +1192,7 @@ elif page == LABELS["cold_storage"]:
             cs_submit = st.form_submit_button(LABELS["save"])
 
         if cs_submit:
-            new_cs_id = next_id(cold_storage, "cold_storage_id", "CS", 6)
+            new_cs_id = next_id(SHEET_NAMES["cold_storage"], cold_storage, "cold_storage_id", "CS", 6)
             new_cs = pd.DataFrame([{
                 "cold_storage_id": new_cs_id,
                 "date_stored": cs_date.strftime("%Y-%m-%d"),
@@ -979,32 +1202,56 @@ elif page == LABELS["cold_storage"]:
                 "type": cs_type.strip(),
                 "date_removed": "",
             }])
-            cold_storage = pd.concat([cold_storage, new_cs], ignore_index=True)
-            save_sheet(cold_storage, SHEET_NAMES["cold_storage"])
-            st.session_state["cold_storage"] = cold_storage
-            st.success(f"ఐటమ్ {new_cs_id} చేర్చబడింది!")
-            st.rerun()
+            try:
+                cold_storage = append_rows(cold_storage, new_cs, SHEET_NAMES["cold_storage"])
+            except WriteConflict as exc:
+                show_conflict(exc)
+            else:
+                st.session_state["cold_storage"] = cold_storage
+                st.success(f"ఐటమ్ {new_cs_id} చేర్చబడింది!")
+                st.rerun()
 
     # --- Mark as removed ---
     with st.expander(LABELS["mark_removed"], expanded=False):
-        active_items = cold_storage[cold_storage["date_removed"] == ""].copy()
-        if active_items.empty:
+        item_opts = options(SHEET_NAMES["cold_storage"], cold_storage,
+                            "{cold_storage_id} | {serial_number} | బరువు: {weight}",
+                            where={"date_removed": [None]})
+        if not item_opts.ids:
             st.info("తీయవలసిన ఐటమ్‌లు లేవు.")
         else:
-            item_opts = [
-                f"{r.cold_storage_id} | {r.serial_number} | బరువు: {r.weight}"
-                for _, r in active_items.iterrows()
-            ]
             with st.form("mark_removed_form"):
-                sel_item = st.selectbox("ఐటమ్ ఎంచుకోండి", item_opts)
-                sel_cs_id = sel_item.split(" | ")[0]
+                sel_cs_id = st.selectbox("ఐటమ్ ఎంచుకోండి", item_opts.ids,
+                                         format_func=item_opts.label)
                 rm_date = st.date_input(LABELS["date_removed"], value=date.today())
                 rm_submit = st.form_submit_button(LABELS["save"])
 
             if rm_submit:
-                idx = cold_storage.index[cold_storage["cold_storage_id"] == sel_cs_id][0]
-                cold_storage.at[idx, "date_removed"] = rm_date.strftime("%Y-%m-%d")
-                save_sheet(cold_storage, SHEET_NAMES["cold_storage"])
-                st.session_state["cold_storage"] = cold_storage
-                st.success(f"ఐటమ్ {sel_cs_id} తీసినట్టు నమోదు చేయబడింది!")
-                st.rerun()
+                idx = find_row(SHEET_NAMES["cold_storage"], cold_storage, sel_cs_id)
+                if idx is None:
+                    show_missing_row(sel_cs_id)
+                else:
+                    try:
+                        cold_storage = update_rows(cold_storage, SHEET_NAMES["cold_storage"], {idx: {
+                            "date_removed": rm_date.strftime("%Y-%m-%d"),
+                        }})
+                    except WriteConflict as exc:
+                        show_conflict(exc)
+                    else:
+                        st.session_state["cold_storage"] = cold_storage
+                        st.success(f"ఐటమ్ {sel_cs_id} తీసినట్టు నమోదు చేయబడింది!")
+                        st.rerun()
+
+# ---------------------------------------------------------------------------
+# Background prefetch
+# ---------------------------------------------------------------------------
+# Runs once per session, after the current page has rendered, so the other
+# pages open from the shared cache.
+if not st.session_state.get("prefetch_started"):
+    st.session_state["prefetch_started"] = True
+    prefetch_sheets(list(SHEET_NAMES.values()))
+
+# ---------------------------------------------------------------------------
+# Global search results
+# ---------------------------------------------------------------------------
+with search_area:
+    global_search()
@@ -0,0 +1,309 @@
+"""
+Export every farm sheet from Google Sheets to CSV or Parquet.
+
+Sheets are read and written a chunk of rows at a time, so even multi-year
+work_logs and chekkulu histories never sit in memory whole. Values are
+exported exactly as stored in the sheet (text), one file per sheet.
+
+With --incremental only rows added or changed since the previous
+incremental export are written; rows are told apart by their ID column and
+compared by a hash kept in a small SQLite state file. IDs that disappeared
+are listed in "<sheet>.deleted.csv". The state only advances when the whole
+export succeeds.
+
+Parquet needs pyarrow (pip install pyarrow); CSV has no extra dependencies.
+The app offers the same export as a zip download on the dashboard. As it
+cannot tell whether a download arrived, its incremental exports work on a
+staged copy of the state, which takes over once the user confirms.
+
+Usage:
+  python export_sheets.py                       # CSV into exports/<timestamp>/
+  python export_sheets.py --format parquet --out /backups/farm
+  python export_sheets.py --incremental         # nightly backup of changes
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+
+import gspread
+import sheet_config
+import sheets_client
+from google.oauth2.service_account import Credentials
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_ACCOUNT_FILE = os.path.join(HERE, "service_account.json")
+EXPORT_DIR = os.path.join(HERE, "exports")
+STATE_FILE = os.path.join(HERE, "farm_export.db")
+
+# Sheet -> ID column
+SHEETS = sheet_config.PRIMARY_KEYS
+
+FORMATS = ["csv", "parquet"] if pa is not None else ["csv"]
+# Rows read per request and written per batch
+CHUNK_ROWS = 5000
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+def sheet_chunks(spreadsheet, sheet_name: str, chunk_rows: int = CHUNK_ROWS, row_count: int = None):
+    """Yield a worksheet's raw values chunk_rows rows at a time, header row first.
+
+    row_count is the worksheet's grid height; it is looked up when not given.
+    Reading stops at the grid's end or at the first chunk that is all blank,
+    as rows are only ever added right after the last one.
+    """
+    if row_count is None:
+        row_count = spreadsheet.worksheet(sheet_name).row_count
+    for start in range(1, row_count + 1, chunk_rows):
+        end = min(start + chunk_rows - 1, row_count)
+        values = spreadsheet.values_get(
+            gspread.utils.absolute_range_name(sheet_name, f"{start}:{end}")).get("values", [])
+        if not values:
+            return
+        yield values
+
+
+# ---------------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------------
+class SheetWriter:
+    """Writes one sheet's rows to a binary file, one batch at a time."""
+
+    def __init__(self, fileobj, fmt: str, header: list):
+        self.fmt = fmt
+        self.header = header
+        if fmt == "parquet":
+            if pa is None:
+                raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+            self._schema = pa.schema([(col, pa.string()) for col in header])
+            self._writer = pq.ParquetWriter(fileobj, self._schema)
+        else:
+            self._text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+            self._writer = csv.writer(self._text)
+            self._writer.writerow(header)
+
+    def write(self, rows: list):
+        if not rows:
+            return
+        if self.fmt == "parquet":
+            columns = [pa.array(col, type=pa.string()) for col in zip(*rows)]
+            self._writer.write_table(pa.Table.from_arrays(columns, schema=self._schema))
+        else:
+            self._writer.writerows(rows)
+
+    def close(self):
+        if self.fmt == "parquet":
+            self._writer.close()
+        else:
+            # Leave the underlying file to its owner
+            self._text.flush()
+            self._text.detach()
+
+
+class SnapshotState:
+    """Hash of every exported row, by sheet and ID, in a SQLite file.
+
+    changed() and deleted() work inside one transaction that commit() ends;
+    an export that fails part way rolls back and leaves the state as it was.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS export_rows ("
+            "sheet TEXT NOT NULL, key TEXT NOT NULL, hash TEXT NOT NULL, "
+            "run INTEGER NOT NULL, PRIMARY KEY (sheet, key))")
+        self._conn.commit()
+        self.run = self._conn.execute("SELECT COALESCE(MAX(run), 0) + 1 FROM export_rows").fetchone()[0]
+
+    def changed(self, sheet_name: str, key_index: int, rows: list) -> list:
+        """The rows whose ID is new or whose values differ from the last export."""
+        if key_index is None:
+            return rows
+        hashes = [hashlib.sha1("\x1f".join(row).encode("utf-8")).hexdigest() for row in rows]
+        keys = [row[key_index] for row in rows]
+        known = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            known.update(self._conn.execute(
+                f"SELECT key, hash FROM export_rows WHERE sheet = ? AND key IN "
+                f"({', '.join('?' * len(batch))})", [sheet_name, *batch]).fetchall())
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO export_rows (sheet, key, hash, run) VALUES (?, ?, ?, ?)",
+            [(sheet_name, key, h, self.run) for key, h in zip(keys, hashes) if key])
+        # Rows without an ID cannot be tracked, so they are always exported
+        return [row for row, key, h in zip(rows, keys, hashes) if not key or known.get(key) != h]
+
+    def deleted(self, sheet_name: str) -> list:
+        """IDs exported before that this run did not see; forgets them."""
+        keys = [r[0] for r in self._conn.execute(
+            "SELECT key FROM export_rows WHERE sheet = ? AND run < ? ORDER BY key",
+            (sheet_name, self.run))]
+        self._conn.execute("DELETE FROM export_rows WHERE sheet = ? AND run < ?", (sheet_name, self.run))
+        return keys
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def staged(path: str) -> "SnapshotState":
+        """A state on a fresh copy of the one at path, kept in "<path>.pending".
+
+        For exports that may not reach their reader; confirm() makes the copy
+        the state at path once they have.
+        """
+        pending = path + ".pending"
+        src, dst = sqlite3.connect(path), sqlite3.connect(pending)
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+        return SnapshotState(pending)
+
+    @staticmethod
+    def confirm(path: str) -> bool:
+        """Replace the state at path with the staged one; False if none is staged."""
+        try:
+            os.replace(path + ".pending", path)
+        except FileNotFoundError:
+            return False
+        return True
+
+
+def export_sheet(chunks, fileobj, fmt: str = "csv", key_col: str = None,
+                 snapshot: SnapshotState = None, sheet_name: str = None) -> int:
+    """Write one sheet's chunks (header row first) to fileobj; returns rows written."""
+    writer = None
+    key_index = None
+    written = 0
+    for chunk in chunks:
+        if writer is None:
+            header, chunk = chunk[0], chunk[1:]
+            writer = SheetWriter(fileobj, fmt, header)
+            key_index = header.index(key_col) if key_col in header else None
+        width = len(writer.header)
+        # Pad rows trimmed of trailing blanks, so every row has every column
+        rows = [(row + [""] * (width - len(row)))[:width] for row in chunk]
+        if snapshot is not None:
+            rows = snapshot.changed(sheet_name, key_index, rows)
+        writer.write(rows)
+        written += len(rows)
+    if writer is None:
+        writer = SheetWriter(fileobj, fmt, [])
+    writer.close()
+    return written
+
+
+def export_all(sources: dict, open_file, fmt: str = "csv", snapshot: SnapshotState = None) -> dict:
+    """Export each sheet to "<sheet>.<fmt>" and return sheet -> rows written.
+
+    sources maps a sheet name to (ID column, chunk iterable). open_file(name)
+    is a context manager giving a writable binary file. With a snapshot
+    only changed rows are written, and IDs no longer in a sheet go to
+    "<sheet>.deleted.csv".
+    """
+    counts = {}
+    try:
+        for sheet_name, (key_col, chunks) in sources.items():
+            with open_file(f"{sheet_name}.{fmt}") as f:
+                counts[sheet_name] = export_sheet(chunks, f, fmt, key_col, snapshot, sheet_name)
+            deleted = snapshot.deleted(sheet_name) if snapshot is not None else []
+            if deleted:
+                with open_file(f"{sheet_name}.deleted.csv") as f:
+                    export_sheet([[[key_col]] + [[key] for key in deleted]], f, "csv")
+    except BaseException:
+        if snapshot is not None:
+            snapshot.rollback()
+        raise
+    if snapshot is not None:
+        snapshot.commit()
+    return counts
+
+
+def directory_files(path: str):
+    """open_file for export_all that writes into a directory."""
+    os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def open_file(name):
+        with open(os.path.join(path, name), "wb") as f:
+            yield f
+    return open_file
+
+
+def zip_files(archive: zipfile.ZipFile):
+    """open_file for export_all that writes members of a zip archive."""
+    def open_file(name):
+        return archive.open(name, "w", force_zip64=True)
+    return open_file
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the farm sheets to CSV or Parquet.")
+    parser.add_argument("--sheets", nargs="+", choices=list(SHEETS), default=list(SHEETS),
+                        help="sheets to export (default: all)")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--out", help="output directory (default: exports/<timestamp>)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only rows added or changed since the last incremental export")
+    parser.add_argument("--state", default=STATE_FILE, help="incremental export state file")
+    parser.add_argument("--credentials", default=SERVICE_ACCOUNT_FILE,
+                        help="service account JSON file")
+    parser.add_argument("--spreadsheet-id", default=sheet_config.SPREADSHEET_ID)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    out = args.out or os.path.join(EXPORT_DIR, datetime.now().strftime("%Y%m%d-%H%M%S"))
+
+    creds = Credentials.from_service_account_file(args.credentials, scopes=sheet_config.SCOPES)
+    spreadsheet = sheets_client.authorize(creds).open_by_key(args.spreadsheet_id)
+    row_counts = {ws.title: ws.row_count for ws in spreadsheet.worksheets()}
+    missing = [name for name in args.sheets if name not in row_counts]
+    if missing:
+        print(f"Not in the spreadsheet: {', '.join(missing)}", file=sys.stderr)
+    sources = {
+        name: (SHEETS[name], sheet_chunks(spreadsheet, name, args.chunk_rows, row_counts[name]))
+        for name in args.sheets if name in row_counts
+    }
+    snapshot = SnapshotState(args.state) if args.incremental else None
+    try:
+        counts = export_all(sources, directory_files(out), args.format, snapshot)
+    finally:
+        if snapshot is not None:
+            snapshot.close()
+    for name, n in counts.items():
+        print(f"  {name}: {n} rows")
+    print(f"\nExported to {out}")
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""
+Spreadsheet settings shared by the app, the import script and the export script.
+"""
+
+# Paste your Google Spreadsheet ID here (from the URL); the app reads it from
+# secrets.toml instead
+SPREADSHEET_ID = "1JPhIKXqMMJJU8x-UotNjSRfVLblkhwHJ7MuYIR_77nI"
+
+# Sheet -> ID column
+PRIMARY_KEYS = {
+    "workers": "worker_id",
+    "work_types": "work_type_id",
+    "work_logs": "work_log_id",
+    "tools": "tool_id",
+    "tool_moves": "tool_move_id",
+    "storage_places": "place_id",
+    "chekkulu": "chekkulu_id",
+    "cold_storage": "cold_storage_id",
+}
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
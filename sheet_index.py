@@ -0,0 +1,654 @@
+"""
+Indexes and summaries derived from the cached sheets.
+
+Each structure is built once from a sheet's cached DataFrame and then kept
+up to date through on_append/on_update as rows are added or edited, so a
+lookup or filter does not scan the sheet. The cache patches a copy() for
+each new version; sessions still on the previous one keep the original. Positions are 0-based rows of the
+cached frame. The helpers below get them from the shared SheetCache.
+"""
+
+import copy
+import logging
+import string
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from sheet_store import (PRIMARY_KEYS, SHEET_NAMES, cell_str, column_text, get_backend,
+                         get_sheet_cache, sheet_values, values_to_df)
+
+# ---------------------------------------------------------------------------
+# Row lookup
+# ---------------------------------------------------------------------------
+
+class KeyIndex:
+    """Position of the first row holding each ID of a sheet."""
+
+    def __init__(self, df: pd.DataFrame, col: str):
+        self.col = col
+        self._lock = threading.Lock()
+        self._keys = []        # position -> ID
+        self._positions = {}   # ID -> position
+        self.on_append(df, 0)
+
+    def on_append(self, df: pd.DataFrame, start: int):
+        with self._lock:
+            for key in self._keys[start:]:
+                if self._positions.get(key, -1) >= start:
+                    del self._positions[key]
+            del self._keys[start:]
+            new = column_text(df[self.col].iloc[start:]).tolist() if self.col in df.columns else []
+            for offset, key in enumerate(new):
+                self._positions.setdefault(key, start + offset)
+            self._keys.extend(new)
+
+    def copy(self) -> "KeyIndex":
+        with self._lock:
+            other = copy.copy(self)
+            other._keys, other._positions = list(self._keys), dict(self._positions)
+        other._lock = threading.Lock()
+        return other
+
+    def on_update(self, df: pd.DataFrame, positions: list):
+        if self.col not in df.columns:
+            return
+        new = column_text(df[self.col].iloc[positions]).tolist()
+        if any(self._keys[pos] != key for pos, key in zip(positions, new)):
+            # An ID itself was edited; which row now comes first is easiest
+            # to settle by indexing the sheet again.
+            self.on_append(df, 0)
+
+    def position(self, key):
+        """Position of the row with ID key, or None."""
+        return self._positions.get(cell_str(key))
+
+
+def key_index(sheet_name: str) -> KeyIndex:
+    """The KeyIndex of the cached sheet_name's primary key."""
+    col = PRIMARY_KEYS[sheet_name]
+    return get_sheet_cache().derived(sheet_name, ("key", col), lambda df: KeyIndex(df, col))
+
+
+def find_row(sheet_name: str, df: pd.DataFrame, key):
+    """Index label of the row of df whose ID is key, or None.
+
+    df is normally the shared copy of the sheet, answered from its KeyIndex;
+    any other frame is scanned. None means the row is gone, e.g. removed
+    in the sheet since the page offered it; callers report it with
+    show_missing_row.
+    """
+    entry = get_sheet_cache().peek(sheet_name)
+    if entry is not None and entry.df is df:
+        pos = key_index(sheet_name).position(key)
+    else:
+        hits = np.flatnonzero(column_text(df[PRIMARY_KEYS[sheet_name]]) == cell_str(key))
+        pos = hits[0] if len(hits) else None
+    return None if pos is None or pos >= len(df) else df.index[pos]
+
+
+# ---------------------------------------------------------------------------
+# Search index
+# ---------------------------------------------------------------------------
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFC", text).lower()
+
+
+class SearchIndex:
+    """Substring index over some columns of a sheet.
+
+    Each distinct normalised cell value is stored once with the positions
+    of the rows holding it, and every 1-3 character gram of a value points
+    back at that value. A query looks up its grams, then checks the few
+    candidate values it gets, so the cost follows the number of matches
+    rather than the number of rows. Positions are 0-based row numbers of
+    the cached DataFrame.
+    """
+
+    GRAM = 3
+
+    def __init__(self, df: pd.DataFrame, cols: list):
+        self.cols = [c for c in cols if c in df.columns]
+        self._lock = threading.Lock()
+        self._rows = []        # position -> tuple of indexed values
+        self._postings = {}    # value -> set of positions
+        self._grams = {}       # gram -> set of values
+        self._add(df, 0)
+
+    def _add(self, df: pd.DataFrame, start: int):
+        if not self.cols:
+            return
+        for pos, values in enumerate(sheet_values(df[self.cols].iloc[start:]), start):
+            values = tuple(_normalize(v) for v in values)
+            self._rows.append(values)
+            for value in values:
+                self._post(value, pos)
+
+    def _post(self, value: str, pos: int):
+        positions = self._postings.get(value)
+        if positions is None:
+            positions = self._postings[value] = set()
+            for n in range(1, self.GRAM + 1):
+                for i in range(len(value) - n + 1):
+                    self._grams.setdefault(value[i:i + n], set()).add(value)
+        positions.add(pos)
+
+    def copy(self) -> "SearchIndex":
+        with self._lock:
+            other = copy.copy(self)
+            other._rows = list(self._rows)
+            other._postings = {value: set(positions) for value, positions in self._postings.items()}
+            other._grams = {gram: set(values) for gram, values in self._grams.items()}
+        other._lock = threading.Lock()
+        return other
+
+    def on_append(self, df: pd.DataFrame, start: int):
+        with self._lock:
+            del self._rows[start:]
+            self._add(df, start)
+
+    def on_update(self, df: pd.DataFrame, positions: list):
+        with self._lock:
+            if not self.cols:
+                return
+            for pos in positions:
+                for value in self._rows[pos]:
+                    self._postings.get(value, set()).discard(pos)
+                values = tuple(_normalize(v) for v in sheet_values(df[self.cols].iloc[[pos]])[0])
+                self._rows[pos] = values
+                for value in values:
+                    self._post(value, pos)
+
+    def search(self, query: str) -> list:
+        """Sorted positions of rows where some column contains query."""
+        q = _normalize(query)
+        if not q:
+            return []
+        with self._lock:
+            grams = {q[i:i + self.GRAM] for i in range(max(len(q) - self.GRAM, 0) + 1)}
+            candidates = None
+            for gram in sorted(grams, key=lambda g: len(self._grams.get(g, ()))):
+                values = self._grams.get(gram, set())
+                candidates = values if candidates is None else candidates & values
+                if not candidates:
+                    return []
+            hits = set()
+            for value in candidates:
+                if q in value:
+                    hits |= self._postings[value]
+        return sorted(hits)
+
+
+def search_sheet(sheet_name: str, cols: list, query: str, entry=None) -> list:
+    """Positions of the rows of entry (default: the cached sheet) matching query in cols."""
+    index = get_sheet_cache().derived(
+        sheet_name, ("search", tuple(cols)), lambda df: SearchIndex(df, cols), entry)
+    return index.search(query)
+
+
+def _search_entry(sheet_name: str, cols: list):
+    """The cached entry search can use for sheet_name, or None.
+
+    A full sheet is preferred, including an expired one with queued writes;
+    otherwise a projection to cols.
+    """
+    cache = get_sheet_cache()
+    entry = cache.get(sheet_name)
+    if entry is None and cache.peek(sheet_name) is not None and get_backend().pending(sheet_name):
+        entry = cache.peek(sheet_name)
+    return entry if entry is not None else cache.projection(sheet_name, cols)
+
+
+def search_entries(groups: list) -> dict:
+    """Return sheet name -> entry to search for (label, sheet, cols) groups.
+
+    Sheets with neither a full copy nor a projection cached get a projection
+    to the searched columns, all fetched in one request. Full rows are only
+    loaded when the user asks for them.
+    """
+    entries = {}
+    missing = {}
+    for _, sheet_name, cols in groups:
+        entry = _search_entry(sheet_name, cols)
+        if entry is None:
+            missing[sheet_name] = cols
+        else:
+            entries[sheet_name] = entry
+    if missing:
+        cache = get_sheet_cache()
+        for name, values in get_backend().fetch_columns(missing).items():
+            entries[name] = cache.put_projection(name, missing[name],
+                                                 values_to_df(values, name))
+    return entries
+
+
+class SearchJob:
+    """One global search query running on a worker thread.
+
+    Results arrive one group at a time as (label, df, cols, positions).
+    cancel() makes the worker stop before its next group. versions records
+    the cached sheet versions the job was started against.
+    """
+
+    def __init__(self, query: str, versions: tuple):
+        self.query = query
+        self.versions = versions
+        self.results = []
+        self.done = False
+        self._cancelled = threading.Event()
+        self._changed = threading.Condition()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def add(self, result: tuple):
+        with self._changed:
+            self.results.append(result)
+            self._changed.notify_all()
+
+    def finish(self):
+        with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    def wait(self, timeout: float):
+        """Block until the next result arrives, the job ends or timeout passes."""
+        with self._changed:
+            if not self.done:
+                self._changed.wait(timeout)
+            return list(self.results), self.done
+
+
+@st.cache_resource
+def _search_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+
+
+def _run_search(job: SearchJob, groups: list):
+    """Match job.query against each (label, sheet, cols) group in order."""
+    try:
+        entries = search_entries(groups)
+        for label, sheet_name, cols in groups:
+            if job.cancelled:
+                return
+            entry = entries[sheet_name]
+            available_cols = [c for c in cols if c in entry.df.columns]
+            if entry.df.empty or not available_cols:
+                continue
+            job.add((label, entry.df, available_cols,
+                     search_sheet(sheet_name, available_cols, job.query, entry)))
+    except Exception:
+        logging.getLogger(__name__).exception("Search for %r failed", job.query)
+    finally:
+        job.finish()
+
+
+def start_search(query: str, groups: list) -> SearchJob:
+    """Return the session's search job for query, replacing a stale one.
+
+    A job is reused while the query and the cached sheets are unchanged.
+    """
+    versions = tuple(getattr(_search_entry(sheet_name, cols), "version", None)
+                     for _, sheet_name, cols in groups)
+    job = st.session_state.get("search_job")
+    if job is not None and (job.query, job.versions) == (query, versions):
+        return job
+    if job is not None:
+        job.cancel()
+    job = SearchJob(query, versions)
+    st.session_state["search_job"] = job
+    _search_executor().submit(_run_search, job, groups)
+    return job
+
+
+# ---------------------------------------------------------------------------
+# Date index
+# ---------------------------------------------------------------------------
+
+class DateIndex:
+    """Row positions of a sheet sorted by one date column.
+
+    Positions are kept for the whole sheet and for each value of the key
+    columns, so a date range combined with key equality filters is answered
+    by binary search on a sorted array. Rows with a blank date only match
+    when no range is given. Positions are 0-based rows of the cached frame.
+    """
+
+    def __init__(self, df: pd.DataFrame, date_col: str, keys=()):
+        self.date_col = date_col
+        self.keys = [k for k in keys if k in df.columns]
+        self._lock = threading.Lock()
+        self._groups = {}   # None or (col, value) -> [sorted dates, positions, blank positions]
+        self._rows = []     # position -> (date, key values)
+        self._insert(df, np.arange(len(df)))
+
+    def _insert(self, df: pd.DataFrame, positions: np.ndarray):
+        part = df.iloc[positions]
+        dates = part[self.date_col].to_numpy(dtype="datetime64[ns]")
+        key_values = [part[col].tolist() for col in self.keys]
+        for i, pos in enumerate(positions):
+            row = (dates[i], tuple(values[i] for values in key_values))
+            if pos < len(self._rows):
+                self._rows[pos] = row
+            else:
+                self._rows.append(row)
+        self._merge(None, dates, positions)
+        for col, values in zip(self.keys, key_values):
+            codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            for i, value in enumerate(uniques):
+                rows = order[bounds[i]:bounds[i + 1]]
+                self._merge((col, value), dates[rows], positions[rows])
+
+    def _merge(self, key, dates: np.ndarray, positions: np.ndarray):
+        group = self._groups.setdefault(
+            key, [np.array([], dtype="datetime64[ns]"), np.array([], dtype=int), set()])
+        blank = np.isnat(dates)
+        group[2].update(positions[blank].tolist())
+        all_dates = np.concatenate([group[0], dates[~blank]])
+        all_positions = np.concatenate([group[1], positions[~blank]])
+        order = np.argsort(all_dates, kind="stable")
+        group[0], group[1] = all_dates[order], all_positions[order]
+
+    def _remove(self, pos: int):
+        day, values = self._rows[pos]
+        for key in [None] + list(zip(self.keys, values)):
+            group = self._groups[key]
+            if np.isnat(day):
+                group[2].discard(pos)
+            else:
+                keep = group[1] != pos
+                group[0], group[1] = group[0][keep], group[1][keep]
+
+    def copy(self) -> "DateIndex":
+        with self._lock:
+            other = copy.copy(self)
+            other._rows = list(self._rows)
+            # The arrays are replaced rather than changed, so only the sets are copied
+            other._groups = {key: [dates, positions, set(blank)]
+                             for key, (dates, positions, blank) in self._groups.items()}
+        other._lock = threading.Lock()
+        return other
+
+    def on_append(self, df: pd.DataFrame, start: int):
+        with self._lock:
+            for pos in range(start, len(self._rows)):
+                self._remove(pos)
+            del self._rows[start:]
+            self._insert(df, np.arange(start, len(df)))
+
+    def on_update(self, df: pd.DataFrame, positions: list):
+        with self._lock:
+            for pos in positions:
+                self._remove(pos)
+            self._insert(df, np.array(positions, dtype=int))
+
+    def _bound(self, which: int):
+        dates = self._groups[None][0] if None in self._groups else []
+        return pd.Timestamp(dates[which]).date() if len(dates) else None
+
+    @property
+    def min_date(self):
+        """Earliest date in the column, or None if it has none."""
+        return self._bound(0)
+
+    @property
+    def max_date(self):
+        """Latest date in the column, or None if it has none."""
+        return self._bound(-1)
+
+    def values(self, col: str) -> list:
+        """Sorted distinct values of key column col."""
+        with self._lock:
+            return sorted(key[1] for key, group in self._groups.items()
+                          if key is not None and key[0] == col and (len(group[1]) or group[2]))
+
+    def count(self, col: str, value) -> int:
+        """Number of rows whose key column col equals value."""
+        with self._lock:
+            group = self._groups.get((col, value))
+            return 0 if group is None else len(group[1]) + len(group[2])
+
+    def positions(self, start=None, end=None, where=None) -> np.ndarray:
+        """Sorted positions of rows dated start..end (inclusive) matching where.
+
+        start and end are dates, None for an open end; where maps key
+        columns to the value they must equal.
+        """
+        empty = [np.array([], dtype="datetime64[ns]"), np.array([], dtype=int), set()]
+        with self._lock:
+            keys = list((where or {}).items()) or [None]
+            groups = [self._groups.get(key, empty) for key in keys]
+            result = None
+            for group in sorted(groups, key=lambda g: len(g[1]) + len(g[2])):
+                if start is None and end is None:
+                    found = np.concatenate([group[1], np.fromiter(group[2], dtype=int)])
+                else:
+                    lo = 0 if start is None else np.searchsorted(
+                        group[0], np.datetime64(pd.Timestamp(start), "ns"), "left")
+                    hi = len(group[0]) if end is None else np.searchsorted(
+                        group[0], np.datetime64(pd.Timestamp(end), "ns"), "right")
+                    found = group[1][lo:hi]
+                result = found if result is None else np.intersect1d(result, found)
+        return np.sort(result)
+
+
+def date_index(sheet_name: str, date_col: str, keys=()) -> DateIndex:
+    """The DateIndex of the cached sheet_name on date_col with key columns keys."""
+    return get_sheet_cache().derived(
+        sheet_name, ("dates", date_col, tuple(keys)),
+        lambda df: DateIndex(df, date_col, keys))
+
+
+def rows_at(df: pd.DataFrame, positions: np.ndarray) -> pd.DataFrame:
+    """The rows of df at positions from an index built on the cached sheet."""
+    # The index can be a write ahead of this copy; drop rows it lacks
+    return df.iloc[positions[positions < len(df)]]
+
+
+# ---------------------------------------------------------------------------
+# Summaries
+# ---------------------------------------------------------------------------
+
+class ValueTally:
+    """How many rows hold each value of one column."""
+
+    def __init__(self, df: pd.DataFrame, col: str):
+        self.col = col
+        self._lock = threading.Lock()
+        self._values = []   # position -> value
+        self._counts = {}
+        self.on_append(df, 0)
+
+    def _add(self, value, step: int):
+        self._counts[value] = self._counts.get(value, 0) + step
+
+    def copy(self) -> "ValueTally":
+        with self._lock:
+            other = copy.copy(self)
+            other._values, other._counts = list(self._values), dict(self._counts)
+        other._lock = threading.Lock()
+        return other
+
+    def on_append(self, df: pd.DataFrame, start: int):
+        with self._lock:
+            for value in self._values[start:]:
+                self._add(value, -1)
+            del self._values[start:]
+            new = df[self.col].iloc[start:].tolist() if self.col in df.columns else []
+            for value in new:
+                self._add(value, 1)
+            self._values.extend(new)
+
+    def on_update(self, df: pd.DataFrame, positions: list):
+        with self._lock:
+            for pos in positions:
+                self._add(self._values[pos], -1)
+                self._values[pos] = df[self.col].iloc[pos]
+                self._add(self._values[pos], 1)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def count(self, value) -> int:
+        return self._counts.get(value, 0)
+
+
+class UnpaidLedger:
+    """Outstanding amounts of UNPAID and PARTIAL work logs.
+
+    Keeps the total and each worker's balance, updated per changed row so
+    adding a log or recording a payment does not rescan the sheet.
+    """
+
+    STATUSES = ("UNPAID", "PARTIAL")
+
+    def __init__(self, df: pd.DataFrame):
+        self._lock = threading.Lock()
+        self._owed = {}     # position -> (worker_id, amount)
+        self.total = 0.0
+        self.balances = {}  # worker_id -> amount
+        self._add(df, np.arange(len(df)))
+
+    def _add(self, df: pd.DataFrame, positions: np.ndarray):
+        part = df.iloc[positions]
+        unpaid = part["pay_status"].isin(self.STATUSES).to_numpy()
+        owed = (part["amount_due"].astype("float64").fillna(0)
+                - part["amount_paid"].astype("float64").fillna(0)).to_numpy()
+        for pos, worker_id, amount in zip(positions[unpaid], part["worker_id"].to_numpy()[unpaid],
+                                          owed[unpaid]):
+            self._owed[int(pos)] = (worker_id, float(amount))
+            self._move(worker_id, float(amount))
+
+    def _remove(self, pos: int):
+        if pos in self._owed:
+            worker_id, amount = self._owed.pop(pos)
+            self._move(worker_id, -amount)
+
+    def _move(self, worker_id, amount: float):
+        self.total += amount
+        self.balances[worker_id] = self.balances.get(worker_id, 0.0) + amount
+
+    def copy(self) -> "UnpaidLedger":
+        with self._lock:
+            other = copy.copy(self)
+            other._owed, other.balances = dict(self._owed), dict(self.balances)
+        other._lock = threading.Lock()
+        return other
+
+    def on_append(self, df: pd.DataFrame, start: int):
+        with self._lock:
+            for pos in [p for p in self._owed if p >= start]:
+                self._remove(pos)
+            self._add(df, np.arange(start, len(df)))
+
+    def on_update(self, df: pd.DataFrame, positions: list):
+        with self._lock:
+            for pos in positions:
+                self._remove(pos)
+            self._add(df, np.array(positions, dtype=int))
+
+    def positions(self) -> np.ndarray:
+        """Sorted positions of the unpaid and partly paid logs."""
+        with self._lock:
+            return np.array(sorted(self._owed), dtype=int)
+
+    def worker_positions(self, worker_id) -> np.ndarray:
+        """Sorted positions of one worker's unpaid and partly paid logs."""
+        with self._lock:
+            return np.array(sorted(pos for pos, (owner, _) in self._owed.items()
+                                   if owner == worker_id), dtype=int)
+
+
+def settle_oldest_first(logs: pd.DataFrame, amount: float, pay_method: str) -> dict:
+    """update_rows changes that spend amount on logs, oldest first.
+
+    Each log is paid up to what it still owes; the last one reached may be
+    left PARTIAL. Amounts are kept to the paisa, and whole amounts stay ints.
+    """
+    logs = logs.sort_values("date", kind="stable", na_position="last")
+    owed = (logs["amount_due"].astype("float64").fillna(0)
+            - logs["amount_paid"].astype("float64").fillna(0))
+    changes = {}
+    for idx, paid, due, left in zip(logs.index, logs["amount_paid"].fillna(0),
+                                    logs["amount_due"].fillna(0), owed):
+        if amount <= 0:
+            break
+        pay = round(float(min(amount, left)), 2)
+        if pay <= 0:
+            continue
+        amount -= pay
+        new_paid = round(float(paid) + pay, 2)
+        if new_paid.is_integer():
+            new_paid = int(new_paid)
+        changes[idx] = {
+            "amount_paid": new_paid,
+            "pay_status": "PAID" if new_paid >= due else "PARTIAL",
+            "pay_method": pay_method,
+        }
+    return changes
+
+
+def value_tally(sheet_name: str, col: str) -> ValueTally:
+    """The ValueTally of col on the cached sheet_name."""
+    return get_sheet_cache().derived(
+        sheet_name, ("tally", col), lambda df: ValueTally(df, col))
+
+
+def unpaid_ledger() -> UnpaidLedger:
+    """The UnpaidLedger of the cached work logs."""
+    return get_sheet_cache().derived(SHEET_NAMES["work_logs"], ("unpaid",), UnpaidLedger)
+
+
+# ---------------------------------------------------------------------------
+# Option lists
+# ---------------------------------------------------------------------------
+
+class Options:
+    """Choices for a selectbox: row IDs and the label shown for each."""
+
+    def __init__(self, df: pd.DataFrame, id_col: str, template: str, where: dict = None):
+        mask = np.ones(len(df), dtype=bool)
+        for col, allowed in (where or {}).items():
+            values = [v for v in allowed if v is not None]
+            keep = df[col].isin(values)
+            if None in allowed:
+                keep |= column_text(df[col]) == ""
+            mask &= keep.to_numpy()
+        rows = df[mask]
+        labels = np.full(len(rows), "", dtype=object)
+        for literal, field, _, _ in string.Formatter().parse(template):
+            labels = labels + literal
+            if field:
+                labels = labels + column_text(rows[field]).to_numpy()
+        self.ids = column_text(rows[id_col]).tolist()
+        self._labels = dict(zip(self.ids, labels.tolist()))
+
+    def label(self, option_id: str) -> str:
+        return self._labels.get(option_id, option_id)
+
+
+def options(sheet_name: str, df: pd.DataFrame, template: str, where: dict = None) -> Options:
+    """Options over the rows of df, labelled by filling template's {col} fields.
+
+    where maps a column to its allowed values, None standing for a blank cell.
+    Lists over the cached sheet are built once per version and shared.
+    """
+    key = ("options", template,
+           tuple((col, tuple(allowed)) for col, allowed in (where or {}).items()))
+    id_col = PRIMARY_KEYS[sheet_name]
+    entry = get_sheet_cache().peek(sheet_name)
+    if entry is None or entry.df is not df:
+        return Options(df, id_col, template, where)
+    return get_sheet_cache().derived(
+        sheet_name, key, lambda d: Options(d, id_col, template, where), entry=entry)
@@ -0,0 +1,2172 @@
+"""
+Sheet storage shared by every session of the app.
+
+Sheets are read and written through a StorageBackend: Google Sheets, a
+local SQLite file, or either behind a write-behind queue. Loaded sheets are
+kept as typed DataFrames in one SheetCache per process, which also holds
+structures derived from them (see sheet_index). Writes are checked against
+the stored rows first and can be grouped into all-or-nothing transactions.
+
+Settings come from st.secrets, and the shared objects are created once per
+process with st.cache_resource, so the module is meant to run under
+Streamlit; tests replace get_backend() and friends.
+"""
+
+import json
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime
+
+import gspread
+import pandas as pd
+import streamlit as st
+from google.oauth2.service_account import Credentials
+
+import export_sheets
+import sheet_config
+import sheets_client
+
+# ---------------------------------------------------------------------------
+# Config
+# ---------------------------------------------------------------------------
+SHEET_NAMES = {
+    "workers": "workers",
+    "work_types": "work_types",
+    "work_logs": "work_logs",
+    "tools": "tools",
+    "tool_moves": "tool_moves",
+    "storage_places": "storage_places",
+    "chekkulu": "chekkulu",
+    "cold_storage": "cold_storage",
+}
+
+# Seconds a sheet stays in the shared cache before it is fetched again.
+# Override with cache_ttl_seconds in secrets.toml.
+CACHE_TTL_SECONDS = 300
+
+# Sheets that only grow at the bottom outside the app. When their cache
+# entry expires only the rows below the cached ones are fetched, together
+# with a few earlier rows picked at random to catch edits higher up.
+APPEND_ONLY_SHEETS = {"work_logs", "tool_moves", "chekkulu"}
+TAIL_SAMPLE_ROWS = 3
+# Seconds after which an append-only sheet is reloaded in full anyway, so
+# edits the sampled rows missed still show up. Override with
+# full_reload_seconds in secrets.toml.
+FULL_RELOAD_SECONDS = 1800
+
+# ---------------------------------------------------------------------------
+# Google Sheets connection
+# ---------------------------------------------------------------------------
+# Shared resources that prefetch and search threads may create first are
+# cached without a spinner, which only works on the script thread.
+
+
+@st.cache_resource(show_spinner=False)
+def get_gspread_client():
+    creds_dict = st.secrets["gcp_service_account"]
+    # st.secrets returns an AttrDict; convert to plain dict for google-auth
+    creds_dict = dict(creds_dict)
+    creds = Credentials.from_service_account_info(creds_dict, scopes=sheet_config.SCOPES)
+    # One client per process, so every session shares its quota and in-flight reads
+    return sheets_client.authorize(
+        creds,
+        reads_per_minute=float(st.secrets.get("sheets_reads_per_minute", sheets_client.READS_PER_MINUTE)),
+        writes_per_minute=float(st.secrets.get("sheets_writes_per_minute", sheets_client.WRITES_PER_MINUTE)),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_spreadsheet():
+    client = get_gspread_client()
+    return client.open_by_key(st.secrets["spreadsheet_id"])
+
+
+@st.cache_resource(show_spinner=False)
+def _worksheet_index() -> dict:
+    """Worksheet title -> Worksheet, built from a single metadata fetch."""
+    return {ws.title: ws for ws in get_spreadsheet().worksheets()}
+
+
+# ---------------------------------------------------------------------------
+# Data helpers
+# ---------------------------------------------------------------------------
+
+# Column types of each sheet, in sheet column order. "str" is free text and
+# IDs, "category" short text that repeats across rows, "date" a YYYY-MM-DD
+# date, "int" and "float" numbers. Blank dates and numbers load as NaT/NA;
+# cells that do not parse are logged and treated as blank.
+SHEET_SCHEMAS = {
+    "workers": {
+        "worker_id": "str", "name_te": "str", "phone": "str",
+        "default_daily_wage": "int", "active": "category", "notes": "str",
+    },
+    "work_types": {"work_type_id": "str", "name_te": "str"},
+    "work_logs": {
+        "work_log_id": "str", "date": "date", "worker_id": "category",
+        "worker_name_te": "category", "work_type_id": "category",
+        "work_type_te": "category", "day_unit": "category", "rate_daily": "int",
+        "amount_due": "int", "pay_status": "category", "amount_paid": "int",
+        "pay_method": "category", "notes": "str",
+    },
+    "tools": {
+        "tool_id": "str", "name_te": "str", "tool_type": "category", "quantity": "int",
+        "status_te": "category", "current_place_id": "category",
+        "current_place_te": "category", "last_updated": "date", "notes": "str",
+    },
+    "tool_moves": {
+        "tool_move_id": "str", "date": "date", "tool_id": "category",
+        "tool_name_te": "category", "from_place_id": "category",
+        "from_place_te": "category", "to_place_id": "category",
+        "to_place_te": "category", "moved_by": "category", "notes": "str",
+    },
+    "storage_places": {"place_id": "str", "name_te": "str"},
+    "chekkulu": {
+        "chekkulu_id": "str", "date": "date", "rate": "float", "weight": "float",
+        "tbgr_number": "str", "type": "category",
+    },
+    "cold_storage": {
+        "cold_storage_id": "str", "date_stored": "date", "count": "int",
+        "weight": "float", "serial_number": "str", "type": "category",
+        "date_removed": "date",
+    },
+}
+
+SHEET_HEADERS = {name: list(schema) for name, schema in SHEET_SCHEMAS.items()}
+
+# ID column of each sheet
+PRIMARY_KEYS = sheet_config.PRIMARY_KEYS
+
+
+def _typed_column(values: pd.Series, kind: str, label: str = "") -> pd.Series:
+    """Convert a column to the dtype of a SHEET_SCHEMAS kind."""
+    if kind == "category":
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values
+        return values.map(cell_str).astype("category")
+    if kind == "date":
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        text = values.map(cell_str)
+        typed = pd.to_datetime(text, format="%Y-%m-%d", errors="coerce")
+    elif kind in ("int", "float"):
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            typed = values
+        else:
+            text = values.map(cell_str)
+            # Numbers are taken as they are; only text goes through parsing
+            numeric = values.map(lambda v: pd.api.types.is_number(v) and not pd.api.types.is_bool(v))
+            typed = pd.to_numeric(values.where(numeric, text.where(text != "")), errors="coerce")
+        if kind == "int":
+            whole = typed.dropna()
+            if (whole == whole.round()).all():
+                return typed.astype("Int64")
+        return typed.astype("float64")
+    else:
+        return values.map(cell_str).astype(object)
+    bad = int(((text != "") & typed.isna()).sum())
+    if bad:
+        logging.getLogger(__name__).warning(
+            "%d cells of %s are not valid %s values; treating them as blank", bad, label, kind)
+    return typed
+
+
+def _apply_schema(df: pd.DataFrame, sheet_name: str) -> pd.DataFrame:
+    """Give each column of df its SHEET_SCHEMAS type; unknown columns are text."""
+    schema = SHEET_SCHEMAS.get(sheet_name, {})
+    for col in df.columns:
+        df[col] = _typed_column(df[col], schema.get(col, "str"), f"{sheet_name}.{col}")
+    return df
+
+
+def cell_str(value) -> str:
+    """A typed cell as the text stored in the sheet."""
+    if isinstance(value, str):
+        return value
+    if value is None or pd.isna(value):
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def column_text(values: pd.Series) -> pd.Series:
+    """A typed column as the text stored in the sheet."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime("%Y-%m-%d").fillna("").astype(object)
+    return values.astype(object).map(cell_str)
+
+
+def sheet_values(df: pd.DataFrame) -> list:
+    """Rows of df as lists of strings, the way they are written to the sheet."""
+    cols = [column_text(df[col]).tolist() for col in df.columns]
+    return [list(row) for row in zip(*cols)] if cols else [[] for _ in range(len(df))]
+
+
+def values_to_df(values: list, sheet_name: str) -> pd.DataFrame:
+    """Build a typed DataFrame from raw sheet values (header row first)."""
+    if not values:
+        return pd.DataFrame()
+    header, rows = values[0], values[1:]
+    width = len(header)
+    rows = [(r + [""] * width)[:width] for r in rows]
+    return _apply_schema(pd.DataFrame(rows, columns=header, dtype=object), sheet_name)
+
+
+def _normalized_rows(rows: list, header: list, sheet_name: str) -> list:
+    """Raw rows as sheet_values would write them after parsing.
+
+    Compare these with sheet_values of the cached frame, so text like
+    "12.0" matches the 12 it was parsed into.
+    """
+    if not rows:
+        return []
+    return sheet_values(values_to_df([list(header)] + [list(row) for row in rows], sheet_name))
+
+
+def _concat_rows(df: pd.DataFrame, new_rows: pd.DataFrame, sheet_name: str) -> pd.DataFrame:
+    """df with new_rows added below, keeping the schema types.
+
+    Only new_rows are converted, so appending costs the same however long
+    df is. Category columns take the sorted union of both sides' categories.
+    """
+    cols = list(df.columns) + [c for c in new_rows.columns if c not in df.columns]
+    new_rows = _apply_schema(new_rows.reindex(columns=cols), sheet_name)
+    left = df.copy(deep=False)
+    for col in df.columns:
+        ours, theirs = df[col], new_rows[col]
+        if isinstance(ours.dtype, pd.CategoricalDtype) and isinstance(theirs.dtype, pd.CategoricalDtype):
+            categories = ours.cat.categories.union(theirs.cat.categories)
+            if not categories.equals(ours.cat.categories):
+                left[col] = ours.cat.set_categories(categories)
+            new_rows[col] = theirs.cat.set_categories(categories)
+    combined = pd.concat([left, new_rows], ignore_index=True)
+    schema = SHEET_SCHEMAS.get(sheet_name, {})
+    for col in combined.columns:
+        # New columns, and those the new rows widened (a fraction in an int
+        # column), are converted in full
+        if col not in left.columns or combined[col].dtype != left[col].dtype:
+            combined[col] = _typed_column(combined[col], schema.get(col, "str"), f"{sheet_name}.{col}")
+    return combined
+
+
+def _set_cell(df: pd.DataFrame, idx, col: str, value):
+    """Assign value to one cell of df, converting it to the column's type."""
+    if isinstance(df[col].dtype, pd.CategoricalDtype):
+        value = cell_str(value)
+        if value not in df[col].cat.categories:
+            # Keep the categories sorted; sorting by the column follows their order
+            df[col] = df[col].cat.set_categories(df[col].cat.categories.union([value]))
+    else:
+        kind = ("date" if pd.api.types.is_datetime64_any_dtype(df[col])
+                else "float" if pd.api.types.is_float_dtype(df[col])
+                else "int" if pd.api.types.is_integer_dtype(df[col])
+                else "str")
+        typed = _typed_column(pd.Series([value], dtype=object), kind, col)
+        if kind == "int" and not pd.api.types.is_integer_dtype(typed):
+            # A fraction in an integer column widens it to float
+            df[col] = df[col].astype("float64")
+        value = typed.iloc[0]
+    df.at[idx, col] = value
+
+
+def _tail_marker(values: list):
+    """(header, last row) of raw sheet values, padded to the header width.
+
+    Kept with the cache entry so a later sync can check that the rows it
+    already has are unchanged. The last row is None for an empty sheet.
+    """
+    if not values:
+        return None
+    header = list(values[0])
+    width = len(header)
+    last_row = (list(values[-1]) + [""] * width)[:width] if len(values) > 1 else None
+    return header, last_row
+
+
+def _project(values: list, cols: list) -> list:
+    """Keep only cols, in that order, from raw values (header row first)."""
+    header = values[0] if values else []
+    keep = [header.index(c) for c in cols if c in header]
+    if not keep:
+        return []
+    return [[row[i] if i < len(row) else "" for i in keep] for row in values]
+
+
+def _cell_at(row: list, i: int) -> str:
+    """Cell i of a raw row, which omits trailing blanks."""
+    return row[i] if i < len(row) else ""
+
+
+def _trim_row(row: list) -> list:
+    """Drop trailing blank cells, which the Sheets API leaves out."""
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+# ---------------------------------------------------------------------------
+# Storage backends
+# ---------------------------------------------------------------------------
+# All reads and writes of sheet data go through get_backend(). Values cross
+# this boundary as lists of strings with the header row first, the same
+# shape the Sheets API uses, so both backends parse into identical frames.
+
+class StorageBackend(ABC):
+    """Interface implemented by the storage backends."""
+
+    @abstractmethod
+    def ensure(self, sheet_name: str):
+        """Create the sheet with SHEET_HEADERS if it does not exist yet."""
+
+    @abstractmethod
+    def fetch(self, sheet_names: list) -> dict:
+        """Return sheet name -> raw values (header row first)."""
+
+    def fetch_columns(self, columns: dict) -> dict:
+        """Return sheet name -> raw values of only some columns (header first).
+
+        columns maps a sheet name to the column names wanted; columns the
+        sheet does not have are left out.
+        """
+        return {name: _project(values, columns[name])
+                for name, values in self.fetch(list(columns)).items()}
+
+    def fetch_rows(self, plans: dict) -> dict:
+        """Read what a write needs to check the rows it was planned on.
+
+        plans maps a sheet name to (data row positions, since). Returns
+        sheet name -> (header row, values of the PRIMARY_KEYS column from
+        data row since on, position -> raw row), all sheets in one request.
+        Sheets left out are taken to be exactly as cached.
+        """
+        out = {}
+        for name, values in self.fetch(list(plans)).items():
+            positions, since = plans[name]
+            header, rows = (values[0], values[1:]) if values else ([], [])
+            pk = PRIMARY_KEYS.get(name)
+            i = header.index(pk) if pk in header else None
+            keys = [_cell_at(row, i) for row in rows[since:]] if i is not None else []
+            out[name] = (header, keys, {pos: rows[pos] for pos in positions if pos < len(rows)})
+        return out
+
+    def fetch_chunks(self, sheet_name: str, chunk_rows: int):
+        """Yield the sheet's raw values chunk_rows rows at a time, header row first.
+
+        For exports; unlike fetch() the whole sheet is never held at once.
+        This default slices a full fetch.
+        """
+        values = self.fetch([sheet_name])[sheet_name]
+        for start in range(0, len(values), chunk_rows):
+            yield values[start:start + chunk_rows]
+
+    def refresh_sizes(self):
+        """Forget cached sheet sizes, so fetch_chunks() sees rows added since.
+
+        Called once before an export. This default caches none.
+        """
+
+    @abstractmethod
+    def fetch_tails(self, plans: list) -> dict:
+        """Read what _sync_tails needs to extend cached sheets.
+
+        plans is a list of (sheet name, header width, cached row count,
+        positions of earlier rows to sample). Returns sheet name -> (header
+        row, last cached row, rows after it, position -> sampled raw row);
+        sheets that could not be read are left out.
+        """
+
+    @abstractmethod
+    def write_all(self, sheet_name: str, values: list):
+        """Replace the whole sheet with values (header row first)."""
+
+    @abstractmethod
+    def append(self, sheet_name: str, header: list, rows: list):
+        """Add rows, ordered like header, after the last row of the sheet."""
+
+    @abstractmethod
+    def update(self, sheet_name: str, header: list, cells: list):
+        """Write single cells in one batch.
+
+        Each cell is a dict with "row" (0-based data row), "key" (the row's
+        ID), "col" (column name) and "value" (string), and may carry "old",
+        the text it replaces, for _verify_writes.
+        """
+
+    def commit(self, writes: list):
+        """Apply writes, possibly to several sheets, as one unit.
+
+        Each write is a dict with "sheet", "kind" ("append" or "update"),
+        "header" and the "rows" or "cells" that append() or update() take.
+        This default applies them one at a time; backends that can send them
+        together, all-or-nothing, override it.
+        """
+        for write in writes:
+            if write["kind"] == "append":
+                self.append(write["sheet"], write["header"], write["rows"])
+            else:
+                self.update(write["sheet"], write["header"], write["cells"])
+
+    def max_id(self, sheet_name: str, id_col: str, prefix: str):
+        """Highest numeric part of the IDs in id_col, or None to scan the frame."""
+        return None
+
+    def pending(self, sheet_name: str) -> bool:
+        """True while writes to the sheet are accepted but not stored yet."""
+        return False
+
+    def dead_letters(self) -> list:
+        """Accepted writes that were later refused and will not be stored.
+
+        Each is a dict with "id", "sheet", "kind", "count" (rows or cells),
+        "error" and "failed_at".
+        """
+        return []
+
+    def dropped_sheets(self) -> list:
+        """Sheets that lost accepted writes since the last call.
+
+        Their cached copies still show the writes and need reloading.
+        """
+        return []
+
+
+class GoogleSheetsBackend(StorageBackend):
+    """Each sheet is a worksheet of the spreadsheet in secrets.toml."""
+
+    def ensure(self, sheet_name: str):
+        ws = _worksheet_index().get(sheet_name)
+        if ws is not None:
+            return ws
+        # Another process may have created it since the index was built
+        _worksheet_index.clear()
+        index = _worksheet_index()
+        if sheet_name not in index:
+            ws = get_spreadsheet().add_worksheet(title=sheet_name, rows=1000, cols=20)
+            if sheet_name in SHEET_HEADERS:
+                ws.update(range_name="A1", values=[SHEET_HEADERS[sheet_name]])
+            index[sheet_name] = ws
+        return index[sheet_name]
+
+    def fetch(self, sheet_names: list) -> dict:
+        for sheet_name in sheet_names:
+            self.ensure(sheet_name)
+        ranges = [gspread.utils.absolute_range_name(name) for name in sheet_names]
+        resp = get_spreadsheet().values_batch_get(ranges)
+        return {
+            name: vr.get("values", [])
+            for name, vr in zip(sheet_names, resp["valueRanges"])
+        }
+
+    def fetch_columns(self, columns: dict) -> dict:
+        # Read each wanted column on its own, at its SHEET_HEADERS position.
+        # Sheets whose header row turns out different are fetched in full.
+        ranges = []
+        plans = []
+        for name, cols in columns.items():
+            self.ensure(name)
+            layout = SHEET_HEADERS.get(name, [])
+            wanted = [c for c in cols if c in layout]
+            for col in wanted:
+                letter = gspread.utils.rowcol_to_a1(1, layout.index(col) + 1).rstrip("0123456789")
+                ranges.append(gspread.utils.absolute_range_name(name, f"{letter}:{letter}"))
+            plans.append((name, wanted))
+        resp = get_spreadsheet().values_batch_get(ranges) if ranges else {"valueRanges": []}
+        value_ranges = iter(resp["valueRanges"])
+        out = {}
+        misfits = []
+        for name, wanted in plans:
+            cells = [[row[0] if row else "" for row in next(value_ranges).get("values", [])]
+                     for _ in wanted]
+            if not wanted or any(not col_values or col_values[0] != col
+                                 for col_values, col in zip(cells, wanted)):
+                misfits.append(name)
+                continue
+            n_rows = max(len(col_values) for col_values in cells)
+            out[name] = [[col_values[i] if i < len(col_values) else "" for col_values in cells]
+                         for i in range(n_rows)]
+        if misfits:
+            out.update(super().fetch_columns({name: columns[name] for name in misfits}))
+        return out
+
+    def fetch_rows(self, plans: dict) -> dict:
+        # Read the header, the key column at its SHEET_HEADERS position from
+        # row since on, and each wanted row. Sheets whose header turns out
+        # different are fetched in full.
+        ranges = []
+        layout = []
+        for name, (positions, since) in plans.items():
+            self.ensure(name)
+            header = SHEET_HEADERS.get(name, [])
+            pk = PRIMARY_KEYS.get(name)
+            if pk not in header:
+                layout.append((name, None, (positions, since)))
+                continue
+            key_col = gspread.utils.rowcol_to_a1(1, header.index(pk) + 1).rstrip("0123456789")
+            last_col = gspread.utils.rowcol_to_a1(1, len(header)).rstrip("0123456789")
+            ranges.append(gspread.utils.absolute_range_name(name, "1:1"))
+            ranges.append(gspread.utils.absolute_range_name(
+                name, f"{key_col}{since + 2}:{key_col}"))
+            ranges += [gspread.utils.absolute_range_name(name, f"A{pos + 2}:{last_col}{pos + 2}")
+                       for pos in positions]
+            layout.append((name, header, (positions, since)))
+        value_ranges = iter(get_spreadsheet().values_batch_get(ranges)["valueRanges"]
+                            if ranges else [])
+        out = {}
+        misfits = {}
+        for name, header, plan in layout:
+            if header is None:
+                misfits[name] = plan
+                continue
+            positions, since = plan
+            stored_header = (next(value_ranges).get("values") or [[]])[0]
+            keys = [_cell_at(row, 0) for row in next(value_ranges).get("values", [])]
+            rows = {pos: (next(value_ranges).get("values") or [[]])[0] for pos in positions}
+            if _trim_row(stored_header) != _trim_row(header):
+                misfits[name] = plan
+                continue
+            # Rows past the end of the sheet come back blank
+            out[name] = (stored_header, keys, {pos: row for pos, row in rows.items()
+                                               if pos < since + len(keys) or row})
+        if misfits:
+            out.update(super().fetch_rows(misfits))
+        return out
+
+    def refresh_sizes(self):
+        # Grids grow as rows are appended; the index is rebuilt on next use
+        _worksheet_index.clear()
+
+    def fetch_chunks(self, sheet_name: str, chunk_rows: int):
+        # The grid size comes from the worksheet index, not a metadata call per sheet
+        ws = self.ensure(sheet_name)
+        return export_sheets.sheet_chunks(get_spreadsheet(), sheet_name, chunk_rows, ws.row_count)
+
+    def fetch_tails(self, plans: list) -> dict:
+        ranges = []
+        for name, width, n_rows, samples in plans:
+            last_col = gspread.utils.rowcol_to_a1(1, max(width, 1)).rstrip("0123456789")
+            # Row 1 is the header, so the last cached row is sheet row n_rows + 1
+            last = n_rows + 1
+            ranges += [
+                gspread.utils.absolute_range_name(name, "1:1"),
+                gspread.utils.absolute_range_name(name, f"A{last}:{last_col}{last}"),
+                gspread.utils.absolute_range_name(name, f"A{last + 1}:{last_col}"),
+            ]
+            ranges += [gspread.utils.absolute_range_name(name, f"A{pos + 2}:{last_col}{pos + 2}")
+                       for pos in samples]
+        try:
+            resp = get_spreadsheet().values_batch_get(ranges)
+        except gspread.exceptions.APIError:
+            return {}
+        value_ranges = iter(resp["valueRanges"])
+        tails = {}
+        for name, _, _, samples in plans:
+            header_vr, anchor_vr, tail_vr = next(value_ranges), next(value_ranges), next(value_ranges)
+            tails[name] = (
+                (header_vr.get("values") or [[]])[0],
+                (anchor_vr.get("values") or [[]])[0],
+                tail_vr.get("values", []),
+                {pos: (next(value_ranges).get("values") or [[]])[0] for pos in samples},
+            )
+        return tails
+
+    def write_all(self, sheet_name: str, values: list):
+        ws = self.ensure(sheet_name)
+        ws.clear()
+        ws.update(range_name="A1", values=values)
+
+    def append(self, sheet_name: str, header: list, rows: list):
+        ws = self.ensure(sheet_name)
+        ws.append_rows(rows, value_input_option="RAW", table_range="A1")
+
+    def update(self, sheet_name: str, header: list, cells: list):
+        ws = self.ensure(sheet_name)
+        data = [{
+            # +1 for the 1-based sheet rows, +1 for the header row
+            "range": gspread.utils.rowcol_to_a1(cell["row"] + 2, header.index(cell["col"]) + 1),
+            "values": [[cell["value"]]],
+        } for cell in cells]
+        ws.batch_update(data, value_input_option="RAW")
+
+    def commit(self, writes: list):
+        # A spreadsheets.batchUpdate is applied all-or-nothing, and
+        # appendCells adds grid rows as needed.
+        requests = []
+        for write in writes:
+            sheet_id = self.ensure(write["sheet"]).id
+            if write["kind"] == "append":
+                requests.append({"appendCells": {
+                    "sheetId": sheet_id,
+                    "rows": [_grid_row(row) for row in write["rows"]],
+                    "fields": "userEnteredValue",
+                }})
+                continue
+            for cell in write["cells"]:
+                requests.append({"updateCells": {
+                    # +1 for the header row; grid coordinates are 0-based
+                    "start": {"sheetId": sheet_id, "rowIndex": cell["row"] + 1,
+                              "columnIndex": write["header"].index(cell["col"])},
+                    "rows": [_grid_row([cell["value"]])],
+                    "fields": "userEnteredValue",
+                }})
+        if requests:
+            get_spreadsheet().batch_update({"requests": requests})
+
+
+def _grid_row(values: list) -> dict:
+    """A row of text cells in the form spreadsheets.batchUpdate takes."""
+    return {"values": [{"userEnteredValue": {"stringValue": value}} for value in values]}
+
+
+def _quote_ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SQLiteBackend(StorageBackend):
+    """Each sheet is a table of TEXT columns in a local SQLite file.
+
+    Row order is insertion order (rowid), matching the sheet layout. The ID
+    column from PRIMARY_KEYS has a unique index (blank IDs aside), so no ID
+    is stored twice. Cell updates find their row by position, as in the sheet.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+
+    def _columns(self, sheet_name: str) -> list:
+        rows = self._conn.execute(f"PRAGMA table_info({_quote_ident(sheet_name)})").fetchall()
+        return [r[1] for r in rows]
+
+    def _create(self, sheet_name: str, header: list):
+        table = _quote_ident(sheet_name)
+        cols = ", ".join(f"{_quote_ident(c)} TEXT NOT NULL DEFAULT ''" for c in header)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+        # Columns added to the sheet later become new table columns
+        existing = self._columns(sheet_name)
+        for col in header:
+            if col not in existing:
+                self._conn.execute(
+                    f"ALTER TABLE {table} ADD COLUMN {_quote_ident(col)} TEXT NOT NULL DEFAULT ''")
+        pk = PRIMARY_KEYS.get(sheet_name)
+        if pk in header:
+            unique = _quote_ident(f"uq_{sheet_name}_{pk}")
+            try:
+                self._conn.execute(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {unique} ON {table} ({_quote_ident(pk)}) "
+                    f"WHERE {_quote_ident(pk)} != ''")
+            except sqlite3.IntegrityError:
+                # Tables filled outside the app may already repeat an ID
+                logging.getLogger(__name__).warning(
+                    "%s has duplicate %s values; its ID index is not unique", sheet_name, pk)
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_quote_ident(f'idx_{sheet_name}_{pk}')} "
+                    f"ON {table} ({_quote_ident(pk)})")
+            else:
+                self._conn.execute(f"DROP INDEX IF EXISTS {_quote_ident(f'idx_{sheet_name}_{pk}')}")
+
+    def _rows(self, sheet_name: str, cols: list, offset: int = 0) -> list:
+        select = ", ".join(_quote_ident(c) for c in cols)
+        return [list(r) for r in self._conn.execute(
+            f"SELECT {select} FROM {_quote_ident(sheet_name)} ORDER BY rowid "
+            f"LIMIT -1 OFFSET ?", (offset,))]
+
+    def _row_at(self, sheet_name: str, cols: list, pos: int):
+        select = ", ".join(_quote_ident(c) for c in cols)
+        row = self._conn.execute(
+            f"SELECT {select} FROM {_quote_ident(sheet_name)} ORDER BY rowid LIMIT 1 OFFSET ?",
+            (pos,)).fetchone()
+        return list(row) if row is not None else None
+
+    def ensure(self, sheet_name: str):
+        with self._lock, self._conn:
+            # Also adds the ID index to tables created outside the app
+            header = self._columns(sheet_name) or SHEET_HEADERS.get(sheet_name)
+            if header:
+                self._create(sheet_name, header)
+
+    def fetch(self, sheet_names: list) -> dict:
+        out = {}
+        for sheet_name in sheet_names:
+            self.ensure(sheet_name)
+            with self._lock:
+                cols = self._columns(sheet_name)
+                out[sheet_name] = [cols] + self._rows(sheet_name, cols) if cols else []
+        return out
+
+    def fetch_columns(self, columns: dict) -> dict:
+        out = {}
+        for sheet_name, wanted in columns.items():
+            self.ensure(sheet_name)
+            with self._lock:
+                cols = [c for c in wanted if c in self._columns(sheet_name)]
+                out[sheet_name] = [cols] + self._rows(sheet_name, cols) if cols else []
+        return out
+
+    def fetch_rows(self, plans: dict) -> dict:
+        out = {}
+        with self._lock:
+            for name, (positions, since) in plans.items():
+                cols = self._columns(name)
+                if not cols:
+                    out[name] = ([], [], {})
+                    continue
+                table = _quote_ident(name)
+                pk = PRIMARY_KEYS.get(name)
+                keys = [r[0] for r in self._conn.execute(
+                    f"SELECT {_quote_ident(pk)} FROM {table} ORDER BY rowid LIMIT -1 OFFSET ?",
+                    (since,))] if pk in cols else []
+                rows = {}
+                for pos in positions:
+                    row = self._row_at(name, cols, pos)
+                    if row is not None:
+                        rows[pos] = row
+                out[name] = (cols, keys, rows)
+        return out
+
+    def fetch_chunks(self, sheet_name: str, chunk_rows: int):
+        self.ensure(sheet_name)
+        with self._lock:
+            cols = self._columns(sheet_name)
+        if not cols:
+            return
+        select = ", ".join(_quote_ident(c) for c in cols)
+        # Page by rowid, holding the lock for one chunk at a time
+        chunk, last = [cols], 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, {select} FROM {_quote_ident(sheet_name)} "
+                    f"WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, chunk_rows)).fetchall()
+            chunk += [list(r[1:]) for r in rows]
+            if chunk:
+                yield chunk
+            if len(rows) < chunk_rows:
+                return
+            chunk, last = [], rows[-1][0]
+
+    def fetch_tails(self, plans: list) -> dict:
+        tails = {}
+        with self._lock:
+            for name, _, n_rows, samples in plans:
+                cols = self._columns(name)
+                if not cols:
+                    continue
+                rows = self._rows(name, cols, offset=max(n_rows - 1, 0))
+                sampled = {pos: self._row_at(name, cols, pos) or [] for pos in samples}
+                if n_rows == 0:
+                    tails[name] = (cols, cols, rows, sampled)
+                else:
+                    tails[name] = (cols, rows[0] if rows else [], rows[1:], sampled)
+        return tails
+
+    def write_all(self, sheet_name: str, values: list):
+        header, rows = (values[0], values[1:]) if values else ([], [])
+        with self._lock, self._conn:
+            self._conn.execute(f"DROP TABLE IF EXISTS {_quote_ident(sheet_name)}")
+            if header:
+                self._create(sheet_name, header)
+                self._insert(sheet_name, header, rows)
+
+    def _insert(self, sheet_name: str, header: list, rows: list):
+        cols = ", ".join(_quote_ident(c) for c in header)
+        marks = ", ".join("?" for _ in header)
+        self._conn.executemany(
+            f"INSERT INTO {_quote_ident(sheet_name)} ({cols}) VALUES ({marks})", rows)
+
+    def append(self, sheet_name: str, header: list, rows: list):
+        with self._lock, self._conn:
+            self._create(sheet_name, header)
+            self._insert(sheet_name, header, rows)
+
+    def _update(self, sheet_name: str, header: list, cells: list):
+        # Cells are placed by row position, as in the sheet, so a table that
+        # repeats an ID still has only the edited row changed
+        table = _quote_ident(sheet_name)
+        rowids = {}
+        for cell in cells:
+            if cell["row"] not in rowids:
+                found = self._conn.execute(
+                    f"SELECT rowid FROM {table} ORDER BY rowid LIMIT 1 OFFSET ?",
+                    (cell["row"],)).fetchone()
+                rowids[cell["row"]] = found[0] if found is not None else None
+            rowid = rowids[cell["row"]]
+            if rowid is not None:
+                col = _quote_ident(cell["col"])
+                self._conn.execute(f"UPDATE {table} SET {col} = ? WHERE rowid = ?", (cell["value"], rowid))
+
+    def update(self, sheet_name: str, header: list, cells: list):
+        with self._lock, self._conn:
+            self._update(sheet_name, header, cells)
+
+    def commit(self, writes: list):
+        # One SQLite transaction covers every sheet
+        with self._lock, self._conn:
+            for write in writes:
+                if write["kind"] == "append":
+                    self._create(write["sheet"], write["header"])
+                    self._insert(write["sheet"], write["header"], write["rows"])
+                else:
+                    self._update(write["sheet"], write["header"], write["cells"])
+
+    def max_id(self, sheet_name: str, id_col: str, prefix: str):
+        # Compare the numeric parts, since IDs that outgrow their padding
+        # (W999, W1000) no longer sort as text. Malformed IDs are skipped.
+        col = _quote_ident(id_col)
+        with self._lock:
+            if id_col not in self._columns(sheet_name):
+                return None
+            top = self._conn.execute(
+                f"SELECT MAX(CAST(substr({col}, ?) AS INTEGER)) FROM {_quote_ident(sheet_name)} "
+                f"WHERE substr({col}, 1, ?) = ? AND length({col}) > ? "
+                f"AND substr({col}, ?) NOT GLOB '*[^0-9]*'",
+                (len(prefix) + 1, len(prefix), prefix, len(prefix), len(prefix) + 1)).fetchone()[0]
+        return top or 0
+
+
+def _apply_write(values: list, write: dict) -> list:
+    """Raw values (header row first) with an append or update write applied.
+
+    Rows and cells are placed by position, as GoogleSheetsBackend stores them.
+    """
+    values = values or [list(write["header"])]
+    header = values[0]
+    if write["kind"] == "append":
+        return values + [list(row) for row in write["rows"]]
+    for cell in write["cells"]:
+        pos = cell["row"] + 1
+        if pos >= len(values) or cell["col"] not in header:
+            continue
+        i = header.index(cell["col"])
+        row = values[pos] + [""] * (i + 1 - len(values[pos]))
+        row[i] = cell["value"]
+        values[pos] = row
+    return values
+
+
+class WriteBehindBackend(StorageBackend):
+    """Queues writes in a local journal and flushes them to another backend.
+
+    A write returns once it is committed to the journal (a local SQLite
+    file); a background thread sends queued writes on to the wrapped
+    backend, merging consecutive appends or updates of a sheet into one
+    request. Writes to one sheet are flushed strictly in order, and a sheet
+    whose flush fails is retried with backoff without holding up the others.
+    A write the wrapped backend refuses outright (see rejected) would fail
+    the same way forever, so it moves to a dead_letters table instead and
+    the sheet's queue carries on; the app lists those writes. Queuing a
+    write does not read the wrapped backend: each batch is checked against
+    it just before it is sent (see _verify_writes), and a write that now
+    conflicts with changes made elsewhere is dead-lettered the same way.
+    Writes still queued when the app stops are flushed on the next start.
+    Reads of a sheet with queued writes have them applied on top, so a
+    reload after a restart still shows them. A per-sheet flush lock is held
+    from sending a write until it leaves the queue, and by reads around the
+    wrapped read and the queue read, so a read never sees a write in both
+    places or in neither.
+    """
+
+    RETRY_MIN_SECONDS = 2
+    RETRY_MAX_SECONDS = 300
+
+    def __init__(self, inner: StorageBackend, path: str):
+        self.inner = inner
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS write_queue ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, sheet TEXT NOT NULL, "
+            "kind TEXT NOT NULL, payload TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            "id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, error TEXT NOT NULL, failed_at TEXT NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._retry_delay = 0
+        self._dropped = set()
+        self._flush_locks = {}
+        # Replay anything left over from a previous run
+        self._wake.set()
+        threading.Thread(target=self._run, name="sheet-write-behind", daemon=True).start()
+
+    def _enqueue(self, sheet_name: str, kind: str, payload: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO write_queue (sheet, kind, payload) VALUES (?, ?, ?)",
+                (sheet_name, kind, json.dumps(payload, ensure_ascii=False)))
+        self._wake.set()
+
+    def ensure(self, sheet_name: str):
+        return self.inner.ensure(sheet_name)
+
+    @contextmanager
+    def _flushing(self, sheet_names):
+        """Hold the flush locks of sheet_names, so none of their writes changes place."""
+        with self._lock:
+            locks = [self._flush_locks.setdefault(name, threading.RLock())
+                     for name in sorted(set(sheet_names))]
+        with ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+
+    def _queued(self, sheet_name: str) -> list:
+        """(kind, payload) of the sheet's queued writes, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, payload FROM write_queue WHERE sheet = ? ORDER BY id",
+                (sheet_name,)).fetchall()
+        return [(kind, json.loads(payload)) for kind, payload in rows]
+
+    def _overlay(self, sheet_name: str, values: list) -> list:
+        """values with the sheet's queued writes applied, as they will be stored."""
+        for kind, payload in self._queued(sheet_name):
+            if kind == "write_all":
+                values = payload["values"]
+            elif kind == "commit":
+                for write in payload["writes"]:
+                    if write["sheet"] == sheet_name:
+                        values = _apply_write(values, write)
+            else:
+                values = _apply_write(values, dict(payload, kind=kind))
+        return values
+
+    def fetch(self, sheet_names: list) -> dict:
+        with self._flushing(sheet_names):
+            return {name: self._overlay(name, values)
+                    for name, values in self.inner.fetch(sheet_names).items()}
+
+    def fetch_columns(self, columns: dict) -> dict:
+        with self._flushing(columns):
+            queued = [name for name in columns if self.pending(name)]
+            out = self.inner.fetch_columns(
+                {name: cols for name, cols in columns.items() if name not in queued})
+            out.update({name: _project(values, columns[name])
+                        for name, values in self.fetch(queued).items()})
+        return out
+
+    def fetch_chunks(self, sheet_name: str, chunk_rows: int):
+        # The flush lock is held until the last chunk is read
+        with self._flushing([sheet_name]):
+            if self.pending(sheet_name):
+                # Slices fetch(), which has the queued rows
+                yield from super().fetch_chunks(sheet_name, chunk_rows)
+            else:
+                yield from self.inner.fetch_chunks(sheet_name, chunk_rows)
+
+    def refresh_sizes(self):
+        self.inner.refresh_sizes()
+
+    def fetch_tails(self, plans: list) -> dict:
+        # Sheets with queued writes are left out, for a full reload
+        return self.inner.fetch_tails([plan for plan in plans if not self.pending(plan[0])])
+
+    def fetch_rows(self, plans: dict) -> dict:
+        # Queuing a write never waits on the wrapped backend; the flusher
+        # checks each write against it just before sending (_verify_writes)
+        return {}
+
+    def max_id(self, sheet_name: str, id_col: str, prefix: str):
+        # The wrapped backend has not seen queued rows, so scan the frame,
+        # which was loaded through fetch() and has them
+        return None if self.pending(sheet_name) else self.inner.max_id(sheet_name, id_col, prefix)
+
+    def pending(self, sheet_name: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM write_queue WHERE sheet = ? LIMIT 1", (sheet_name,)).fetchone() is not None
+
+    def dead_letters(self) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, sheet, kind, payload, error, failed_at FROM dead_letters ORDER BY id"
+            ).fetchall()
+        out = []
+        for op_id, sheet_name, kind, payload, error, failed_at in rows:
+            payload = json.loads(payload)
+            writes = ([w for w in payload["writes"] if w["sheet"] == sheet_name]
+                      if kind == "commit" else [payload])
+            count = sum(len(w.get("rows") or w.get("cells") or w.get("values", [])[1:])
+                        for w in writes)
+            out.append({"id": op_id, "sheet": sheet_name, "kind": kind, "count": count,
+                        "error": error, "failed_at": failed_at})
+        return out
+
+    def discard_dead_letters(self, ids: list):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM dead_letters WHERE id = ?", [(i,) for i in ids])
+
+    def dropped_sheets(self) -> list:
+        with self._lock:
+            dropped, self._dropped = sorted(self._dropped), set()
+        return dropped
+
+    def _dead_letter(self, op_ids: list, exc: Exception):
+        """Move queued writes the wrapped backend refused to dead_letters."""
+        failed_at = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            marks = ", ".join("?" for _ in op_ids)
+            rows = self._conn.execute(
+                f"SELECT id, sheet, kind, payload FROM write_queue WHERE id IN ({marks})",
+                op_ids).fetchall()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dead_letters (id, sheet, kind, payload, error, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(*row, repr(exc), failed_at) for row in rows])
+            self._conn.execute(f"DELETE FROM write_queue WHERE id IN ({marks})", op_ids)
+            self._dropped.update(row[1] for row in rows)
+        logging.getLogger(__name__).error(
+            "Queued writes to %s were refused and moved to dead_letters",
+            ", ".join(sorted({row[1] for row in rows})), exc_info=exc)
+
+    def write_all(self, sheet_name: str, values: list):
+        self._enqueue(sheet_name, "write_all", {"values": values})
+
+    def append(self, sheet_name: str, header: list, rows: list):
+        self._enqueue(sheet_name, "append", {"header": header, "rows": rows})
+
+    def update(self, sheet_name: str, header: list, cells: list):
+        self._enqueue(sheet_name, "update", {"header": header, "cells": cells})
+
+    def commit(self, writes: list):
+        # The transaction is queued once per sheet it touches, in a single
+        # journal transaction, and sent when it reaches the head of each queue.
+        payload = json.dumps({"txn": uuid.uuid4().hex, "writes": writes}, ensure_ascii=False)
+        sheets = list(dict.fromkeys(write["sheet"] for write in writes))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO write_queue (sheet, kind, payload) VALUES (?, 'commit', ?)",
+                [(sheet_name, payload) for sheet_name in sheets])
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self._retry_delay or None)
+            self._wake.clear()
+            failed = self.flush()
+            if failed:
+                self._retry_delay = min(max(self._retry_delay * 2, self.RETRY_MIN_SECONDS),
+                                        self.RETRY_MAX_SECONDS)
+            else:
+                self._retry_delay = 0
+
+    def flush(self) -> bool:
+        """Send every queued write; returns True if some sheet failed."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, sheet, kind, payload FROM write_queue ORDER BY id").fetchall()
+        by_sheet = {}
+        for op_id, sheet_name, kind, payload in rows:
+            by_sheet.setdefault(sheet_name, []).append((op_id, kind, json.loads(payload)))
+        failed = False
+        waiting = {}  # sheet -> queued transaction at the head of its queue
+        for sheet_name, ops in by_sheet.items():
+            try:
+                rest = self._flush_sheet(sheet_name, ops)
+            except Exception:
+                logging.getLogger(__name__).warning(
+                    "Flushing queued writes to %s failed; will retry", sheet_name, exc_info=True)
+                failed = True
+                continue
+            if rest:
+                waiting[sheet_name] = rest[0]
+        sent = set()
+        for op_id, _, payload in waiting.values():
+            txn = payload["txn"]
+            sheets = {write["sheet"] for write in payload["writes"]}
+            if txn in sent or not all(
+                    name in waiting and waiting[name][2]["txn"] == txn for name in sheets):
+                continue
+            with self._flushing(sheets):
+                try:
+                    checked = _verify_writes(self.inner, payload["writes"])
+                    conflicts = [c for c in checked if isinstance(c, WriteConflict)]
+                    if conflicts:
+                        # All or nothing, like the commit itself
+                        raise conflicts[0]
+                    self.inner.commit(checked)
+                except Exception as exc:
+                    if isinstance(exc, WriteConflict) or rejected(exc):
+                        self._dead_letter([waiting[name][0] for name in sheets], exc)
+                        sent.add(txn)
+                        continue
+                    logging.getLogger(__name__).warning(
+                        "Flushing queued transaction on %s failed; will retry",
+                        ", ".join(sorted(sheets)), exc_info=True)
+                    failed = True
+                    continue
+                with self._lock, self._conn:
+                    self._conn.executemany("DELETE FROM write_queue WHERE id = ?",
+                                           [(waiting[name][0],) for name in sheets])
+            sent.add(txn)
+        if sent:
+            # Writes queued behind the transactions can go now
+            self._wake.set()
+        return failed
+
+    def _flush_sheet(self, sheet_name: str, ops: list) -> list:
+        """Send queued writes of one sheet up to its first queued transaction.
+
+        Returns the ops from that transaction on, which flush() sends once the
+        transaction heads the queues of all its sheets.
+        """
+        ops = list(ops)
+        i = 0
+        merge = True
+        while i < len(ops):
+            kind = ops[i][1]
+            if kind == "commit":
+                return ops[i:]
+            # Merge a run of appends or updates with the same header
+            j = i + 1
+            if kind != "write_all" and merge:
+                while (j < len(ops) and ops[j][1] == kind
+                       and ops[j][2]["header"] == ops[i][2]["header"]):
+                    j += 1
+            with self._flushing([sheet_name]):
+                if kind != "write_all":
+                    # Rows may have moved or been edited elsewhere since these were queued
+                    checked = _verify_writes(self.inner, [dict(payload, sheet=sheet_name, kind=kind)
+                                                          for _, _, payload in ops[i:j]])
+                    kept = []
+                    for (op_id, _, _), write in zip(ops[i:j], checked):
+                        if isinstance(write, WriteConflict):
+                            self._dead_letter([op_id], write)
+                        else:
+                            kept.append((op_id, kind, write))
+                    ops[i:j] = kept
+                    j = i + len(kept)
+                batch = ops[i:j]
+                if not batch:
+                    continue
+                try:
+                    if kind == "write_all":
+                        self.inner.write_all(sheet_name, batch[0][2]["values"])
+                    elif kind == "append":
+                        self.inner.append(sheet_name, batch[0][2]["header"],
+                                          [r for _, _, p in batch for r in p["rows"]])
+                    else:
+                        self.inner.update(sheet_name, batch[0][2]["header"],
+                                          [c for _, _, p in batch for c in p["cells"]])
+                except Exception as exc:
+                    if not rejected(exc):
+                        raise
+                    if len(batch) > 1:
+                        # Send the rest one at a time to find the write refused
+                        merge = False
+                        continue
+                    self._dead_letter([batch[0][0]], exc)
+                else:
+                    with self._lock, self._conn:
+                        self._conn.executemany("DELETE FROM write_queue WHERE id = ?",
+                                               [(op_id,) for op_id, _, _ in batch])
+            i = j
+        return []
+
+
+@st.cache_resource(show_spinner=False)
+def get_backend() -> StorageBackend:
+    """The backend chosen by storage_backend in secrets.toml ("sheets" or "sqlite").
+
+    With write_behind = true, writes are queued locally (write_queue_path)
+    and flushed to that backend in the background.
+    """
+    if st.secrets.get("storage_backend", "sheets") == "sqlite":
+        backend = SQLiteBackend(st.secrets.get("sqlite_path", "farm.db"))
+    else:
+        backend = GoogleSheetsBackend()
+    if st.secrets.get("write_behind", False):
+        backend = WriteBehindBackend(backend, st.secrets.get("write_queue_path", "farm_queue.db"))
+    return backend
+
+
+def ensure_worksheet(sheet_name: str):
+    """Create the sheet with headers if it does not exist yet."""
+    get_backend().ensure(sheet_name)
+
+
+def load_sheet(sheet_name: str) -> pd.DataFrame:
+    return load_sheets([sheet_name])[sheet_name]
+
+
+def load_sheets(sheet_names: list) -> dict:
+    """Load several sheets with one request to the backend.
+
+    Returns a dict of sheet name -> DataFrame.
+    """
+    return {name: values_to_df(values, name)
+            for name, values in get_backend().fetch(sheet_names).items()}
+
+
+def _sync_tails(sheet_names: list) -> list:
+    """Bring cached append-only sheets up to date by fetching only new rows.
+
+    For every sheet the header row, the last row already cached, all rows
+    below it and TAIL_SAMPLE_ROWS earlier rows picked at random are read,
+    all sheets in one request. If the header and the rows read are
+    unchanged the new rows are appended to the cached DataFrame; otherwise
+    the sheet is left for a full reload, as is a sheet last loaded in full
+    more than the cache's full_reload seconds ago. Returns the names synced.
+    """
+    cache = get_sheet_cache()
+    entries = {}
+    plans = []
+    for name in sheet_names:
+        entry = cache.peek(name)
+        if (entry is None or entry.tail is None
+                or time.monotonic() - entry.full_at > cache.full_reload):
+            continue
+        entries[name] = entry
+        earlier = max(len(entry.df) - 1, 0)
+        samples = sorted(random.sample(range(earlier), min(TAIL_SAMPLE_ROWS, earlier)))
+        plans.append((name, len(entry.tail[0]), len(entry.df), samples))
+    if not entries:
+        return []
+    tails = get_backend().fetch_tails(plans)
+    synced = []
+    for name, (remote_header, remote_anchor, new_values, sampled) in tails.items():
+        entry = entries[name]
+        header, last_row = entry.tail
+        if (_trim_row(remote_header) != _trim_row(header)
+                or _trim_row(remote_anchor) != _trim_row(last_row or header)):
+            continue
+        positions = sorted(sampled)
+        ours = sheet_values(entry.df.iloc[positions])
+        theirs = _normalized_rows([sampled[pos] for pos in positions], header, name)
+        if any(_trim_row(a) != _trim_row(b) for a, b in zip(ours, theirs)):
+            continue
+        if new_values:
+            new_rows = values_to_df([header] + new_values, name)
+            df = _concat_rows(entry.df, new_rows, name)
+            cache.put(name, df, tail=_tail_marker([header, new_values[-1]]),
+                      appended_from=len(entry.df))
+        else:
+            cache.touch(name)
+        synced.append(name)
+    return synced
+
+
+def save_sheet(df: pd.DataFrame, sheet_name: str):
+    with get_sheet_cache().lock(sheet_name):
+        # Build list-of-lists: header + rows
+        data = [df.columns.tolist()] + sheet_values(df)
+        get_backend().write_all(sheet_name, data)
+        get_sheet_cache().put(sheet_name, df, reloaded=False, tail=_tail_marker(data))
+
+
+class WriteConflict(Exception):
+    """A write would overwrite rows someone else changed since they were loaded."""
+
+    def __init__(self, sheet_name: str, keys: list):
+        super().__init__(f"{sheet_name}: {', '.join(keys) or 'header'} changed since loaded")
+        self.sheet_name = sheet_name
+        self.keys = keys
+
+
+def _conflict(sheet_name: str, keys: list) -> WriteConflict:
+    """Reload sheet_name, so the editor sees what changed, and describe the conflict."""
+    reload_sheets([sheet_name])
+    return WriteConflict(sheet_name, keys)
+
+
+def _check_writes(writes: list, frames: dict) -> dict:
+    """Check writes against the stored sheets before they are sent.
+
+    frames maps each sheet name to the DataFrame the writes were planned on.
+    Only the rows an update touches and the IDs from the last cached row on
+    are read. Touched rows are compared with the cached ones as parsed
+    values. Rows another editor changed are fine if the update leaves the
+    changed cells alone, and rows that moved are followed by ID. Appended
+    rows must not reuse an ID stored since the sheet was loaded. Otherwise
+    WriteConflict is raised, after reloading the sheet. Returns sheet name
+    -> "grown" or "changed" for sheets whose stored copy has rows the cache
+    lacks, or rows that differ from it; they need refreshing once the
+    writes are stored.
+    """
+    positions = {}
+    for write in writes:
+        rows = positions.setdefault(write["sheet"], set())
+        if write["kind"] == "update":
+            rows.update(cell["row"] for cell in write["cells"])
+    stored = get_backend().fetch_rows({name: (sorted(rows), max(len(frames[name]) - 1, 0))
+                                       for name, rows in positions.items()})
+    stale = {}
+    for write in writes:
+        name = write["sheet"]
+        if name not in stored:
+            continue
+        header, keys, rows = stored[name]
+        df = frames[name]
+        if _trim_row(header) != _trim_row(write["header"]):
+            raise _conflict(name, [])
+        pk = PRIMARY_KEYS.get(name)
+        i = write["header"].index(pk) if pk in write["header"] else None
+        if i is not None:
+            # keys start at the last cached row, which must still be there
+            last = column_text(df[pk].iloc[-1:]).tolist()
+            n_stored = max(len(df) - 1, 0) + len(keys)
+            if keys[:len(last)] != last or n_stored < len(df):
+                stale[name] = "changed"
+            elif n_stored > len(df):
+                stale.setdefault(name, "grown")
+        if write["kind"] == "append":
+            taken = set(keys) & {row[i] for row in write["rows"]} - {""} if i is not None else set()
+            if taken:
+                raise _conflict(name, sorted(taken))
+            continue
+        edited = {}
+        for cell in write["cells"]:
+            edited.setdefault(cell["row"], set()).add(header.index(cell["col"]))
+        # Compare parsed values, so "12.0" in the sheet matches a cached 12
+        theirs_at = dict(zip(rows, _normalized_rows(list(rows.values()), header, name)))
+        moved = {}
+        conflicts = []
+        all_keys = None
+        for pos, cols in edited.items():
+            ours = sheet_values(df.iloc[[pos]])[0]
+            theirs = theirs_at.get(pos)
+            if theirs is not None and _trim_row(theirs) == _trim_row(ours):
+                continue
+            stale[name] = "changed"
+            key = ours[i] if i is not None else ""
+            if theirs is not None and (i is None or _cell_at(theirs, i) == key):
+                if any(_cell_at(theirs, c) != ours[c] for c in cols):
+                    conflicts.append(key or str(pos + 2))
+                continue
+            if key and all_keys is None:
+                # Rows were removed or reordered; find where the IDs are now
+                all_keys = get_backend().fetch_rows({name: ([], 0)}).get(name, ([], [], {}))[1]
+            if key and all_keys.count(key) == 1:
+                moved[pos] = all_keys.index(key)
+            else:
+                conflicts.append(key or str(pos + 2))
+        if moved and not conflicts:
+            _, _, rows = get_backend().fetch_rows({name: (sorted(moved.values()), len(all_keys))})[name]
+            theirs_at = dict(zip(rows, _normalized_rows(list(rows.values()), header, name)))
+            for pos, new_pos in moved.items():
+                ours = sheet_values(df.iloc[[pos]])[0]
+                theirs = theirs_at.get(new_pos, [])
+                if any(_cell_at(theirs, c) != ours[c] for c in edited[pos]):
+                    conflicts.append(ours[i])
+            write["cells"] = [dict(cell, row=moved.get(cell["row"], cell["row"]))
+                              for cell in write["cells"]]
+        if conflicts:
+            raise _conflict(name, conflicts)
+    return stale
+
+
+def _verify_writes(backend: StorageBackend, writes: list) -> list:
+    """Check writes against what backend stores just before they are sent.
+
+    For writes checked when they were made but sent later: queued writes
+    and replayed transactions. Update cells follow their row's ID ("key")
+    if the row moved; a cell whose stored value is neither the text it
+    replaces ("old") nor its new value was changed elsewhere, while other
+    changes to the row are kept. Appended rows must not repeat a stored ID.
+    Earlier writes in the list count as stored for later ones. Sheets
+    without a PRIMARY_KEYS column are not checked. Returns, for each write,
+    the write to send (with its cells moved) or the WriteConflict that
+    refuses it.
+    """
+    wanted = {}
+    for write in writes:
+        if write["kind"] in ("append", "update") and PRIMARY_KEYS.get(write["sheet"]) in write["header"]:
+            rows = wanted.setdefault(write["sheet"], set())
+            if write["kind"] == "update":
+                rows.update(cell["row"] for cell in write["cells"])
+    if not wanted:
+        return list(writes)
+    stored = backend.fetch_rows({name: (sorted(rows), 0) for name, rows in wanted.items()})
+    headers = {name: header for name, (header, _, _) in stored.items()}
+    keys = {name: list(stored_keys) for name, (_, stored_keys, _) in stored.items()}
+    raw = {name: dict(rows) for name, (_, _, rows) in stored.items()}
+    n_stored = {name: len(stored_keys) for name, stored_keys in keys.items()}
+    # Find the rows by ID, taking appends into account in order
+    out = []
+    for write in writes:
+        name = write["sheet"]
+        if name not in wanted or name not in stored:
+            out.append(write)
+            continue
+        if _trim_row(headers[name]) != _trim_row(write["header"]):
+            out.append(WriteConflict(name, []))
+            continue
+        i = write["header"].index(PRIMARY_KEYS[name])
+        if write["kind"] == "append":
+            taken = set(keys[name]) & {row[i] for row in write["rows"]} - {""}
+            if taken:
+                out.append(WriteConflict(name, sorted(taken)))
+                continue
+            for row in write["rows"]:
+                raw[name][len(keys[name])] = row
+                keys[name].append(row[i])
+            out.append(write)
+            continue
+        cells = []
+        lost = []
+        for cell in write["cells"]:
+            pos, key = cell["row"], cell.get("key")
+            if key and (pos >= len(keys[name]) or keys[name][pos] != key):
+                # Rows were removed or reordered; follow the ID
+                pos = keys[name].index(key) if keys[name].count(key) == 1 else None
+            if pos is None:
+                lost.append(key)
+            else:
+                cells.append(dict(cell, row=pos))
+        out.append(WriteConflict(name, sorted(set(lost))) if lost else dict(write, cells=cells))
+    moved = {}
+    for write in out:
+        if not isinstance(write, WriteConflict) and write["kind"] == "update" and write["sheet"] in raw:
+            name = write["sheet"]
+            moved.setdefault(name, set()).update(
+                cell["row"] for cell in write["cells"]
+                if cell["row"] < n_stored[name] and cell["row"] not in raw[name])
+    moved = {name: rows for name, rows in moved.items() if rows}
+    if moved:
+        for name, (_, _, rows) in backend.fetch_rows(
+                {name: (sorted(rows), n_stored[name]) for name, rows in moved.items()}).items():
+            raw[name].update(rows)
+    # Compare parsed values, so "12.0" in the sheet matches a cached 12
+    seen = {name: dict(zip(rows, _normalized_rows(list(rows.values()), headers[name], name)))
+            for name, rows in raw.items()}
+    for n, write in enumerate(out):
+        if isinstance(write, WriteConflict) or write["kind"] != "update" or write["sheet"] not in seen:
+            continue
+        name = write["sheet"]
+        header = headers[name]
+        changed = [cell.get("key") or str(cell["row"] + 2) for cell in write["cells"]
+                   if "old" in cell and _cell_at(seen[name].get(cell["row"], []), header.index(cell["col"]))
+                   not in (cell["old"], cell["value"])]
+        if changed:
+            out[n] = WriteConflict(name, sorted(set(changed)))
+            continue
+        for cell in write["cells"]:
+            row = seen[name].setdefault(cell["row"], [])
+            c = header.index(cell["col"])
+            row.extend([""] * (c + 1 - len(row)))
+            row[c] = cell["value"]
+    return out
+
+
+def _refresh_stale(stale: dict):
+    """Bring cached sheets up to date after a write merged with changes made elsewhere.
+
+    Sheets that only grew take just the new rows when they can; the rest
+    are reloaded in full.
+    """
+    synced = _sync_tails([name for name, how in stale.items() if how == "grown"])
+    reload_sheets([name for name in stale if name not in synced])
+
+
+def _append_write(df: pd.DataFrame, new_rows: pd.DataFrame, sheet_name: str):
+    """The backend write that appends new_rows below df, or None.
+
+    None means the sheet has no header yet or new_rows carries a column the
+    sheet does not have, so only a full save can store them.
+    """
+    if df.columns.empty or not set(new_rows.columns) <= set(df.columns):
+        return None
+    # Order the values like the sheet header; columns missing from new_rows stay blank
+    return {
+        "sheet": sheet_name,
+        "kind": "append",
+        "header": df.columns.tolist(),
+        "rows": sheet_values(new_rows.reindex(columns=df.columns)),
+    }
+
+
+def append_rows(df: pd.DataFrame, new_rows: pd.DataFrame, sheet_name: str) -> pd.DataFrame:
+    """Append new_rows to the sheet and return df with the rows added.
+
+    Only the new rows are sent, so the cost of an insert does not grow with
+    the size of the sheet. Falls back to a full save when the sheet has no
+    header yet or new_rows carries a column the sheet does not have.
+    """
+    cache = get_sheet_cache()
+    with cache.lock(sheet_name):
+        # Build on the newest shared copy so rows added by other sessions are kept
+        df = _latest(sheet_name, df)
+        combined = _concat_rows(df, new_rows, sheet_name)
+        write = _append_write(df, new_rows, sheet_name)
+        if write is None:
+            _check_save(df, sheet_name)
+            save_sheet(combined, sheet_name)
+            return combined
+        stale = _check_writes([write], {sheet_name: df})
+        get_backend().append(sheet_name, write["header"], write["rows"])
+        if stale:
+            # Rows added elsewhere come before ours; take both from the sheet
+            _refresh_stale(stale)
+            return cache.peek(sheet_name).df
+        cache.put(sheet_name, combined, reloaded=False,
+                  tail=_tail_marker([write["header"], write["rows"][-1]]), appended_from=len(df))
+    return combined
+
+
+def _check_save(df: pd.DataFrame, sheet_name: str):
+    """Refuse to rewrite a sheet that gained or lost rows since df was loaded."""
+    pk = PRIMARY_KEYS.get(sheet_name)
+    stored = get_backend().fetch_rows({sheet_name: ([], 0)}).get(sheet_name)
+    if stored is None or pk not in df.columns:
+        return
+    ours = column_text(df[pk]).tolist()
+    if stored[1] != ours:
+        raise _conflict(sheet_name, sorted(set(stored[1]) ^ set(ours)))
+
+
+def _changed_cells(df: pd.DataFrame, sheet_name: str, changes: dict, tail,
+                   staged: dict = None, last_pos: int = None):
+    """The cells of changes that differ from df, in the form update() takes.
+
+    Each cell also carries the row's ID ("key") and the text it replaces
+    ("old"), for _verify_writes. Returns (cells, positions of the rows in changes, tail patched for cells
+    of the last row). staged maps (index label, column) to text already due
+    to be written over df, and is extended with these cells; last_pos is the
+    position of the sheet's last row if rows are due to be added after df.
+    """
+    staged = {} if staged is None else staged
+    last_pos = len(df) - 1 if last_pos is None else last_pos
+    pk = PRIMARY_KEYS.get(sheet_name)
+    header = df.columns.tolist()
+    cells = []
+    positions = []
+    for idx, row_changes in changes.items():
+        pos = df.index.get_loc(idx)
+        positions.append(pos)
+        for col, value in row_changes.items():
+            # Compare as sheet text, so "2024-01-05" equals a parsed date
+            text = cell_str(value)
+            old = staged.get((idx, col), cell_str(df.at[idx, col]))
+            if old == text:
+                continue
+            staged[(idx, col)] = text
+            cells.append({
+                "row": pos,
+                "key": str(df.at[idx, pk]) if pk in df.columns else None,
+                "col": col,
+                "value": text,
+                "old": old,
+            })
+            if tail is not None and tail[1] is not None and pos == last_pos:
+                i = header.index(col)
+                tail = (tail[0], tail[1][:i] + [text] + tail[1][i + 1:])
+    return cells, positions, tail
+
+
+def _apply_changes(df: pd.DataFrame, changes: dict) -> pd.DataFrame:
+    """A copy of df with changes applied.
+
+    The cached frame is shared by every session, so it is never edited in
+    place; the copy is put() as the sheet's next version.
+    """
+    df = df.copy()
+    for idx, row_changes in changes.items():
+        for col, value in row_changes.items():
+            _set_cell(df, idx, col, value)
+    return df
+
+
+def update_rows(df: pd.DataFrame, sheet_name: str, changes: dict) -> pd.DataFrame:
+    """Apply changes to df and write only the changed cells to the sheet.
+
+    changes maps a df index label to {column: new value}. Cells whose value
+    is already equal are skipped; the rest go out in one batched request.
+    """
+    cache = get_sheet_cache()
+    with cache.lock(sheet_name):
+        df = _latest(sheet_name, df)
+        entry = cache.peek(sheet_name)
+        cells, positions, tail = _changed_cells(
+            df, sheet_name, changes, entry.tail if entry is not None else None)
+        stale = {}
+        if cells:
+            write = {"sheet": sheet_name, "kind": "update",
+                     "header": df.columns.tolist(), "cells": cells}
+            stale = _check_writes([write], {sheet_name: df})
+            get_backend().update(sheet_name, write["header"], write["cells"])
+            if stale.get(sheet_name) == "changed":
+                _refresh_stale(stale)
+                return cache.peek(sheet_name).df
+        # Update the cached copy only once the backend has accepted the write
+        df = _apply_changes(df, changes)
+        cache.put(sheet_name, df, reloaded=False, tail=tail, updated=positions)
+        if stale:
+            _refresh_stale(stale)
+            return cache.peek(sheet_name).df
+    return df
+
+
+# ---------------------------------------------------------------------------
+# Transactions
+# ---------------------------------------------------------------------------
+
+class TransactionJournal:
+    """Transactions handed to the backend whose outcome is not settled yet.
+
+    Each commit is recorded in a local SQLite file before it is sent and
+    settled once the backend accepts or rejects it, so one cut short by a
+    failed request or a restart can be replayed. A replayed transaction
+    that is refused or now conflicts moves to a dead_letters table, which
+    the app lists alongside the backend's.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS txn_journal ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, writes TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            "id INTEGER PRIMARY KEY, writes TEXT NOT NULL, error TEXT NOT NULL, "
+            "failed_at TEXT NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def record(self, writes: list) -> int:
+        with self._lock, self._conn:
+            cur = self._conn.execute("INSERT INTO txn_journal (writes) VALUES (?)",
+                                     (json.dumps(writes, ensure_ascii=False),))
+        return cur.lastrowid
+
+    def settle(self, txn_id: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM txn_journal WHERE id = ?", (txn_id,))
+
+    def unsettled(self) -> list:
+        """(id, writes) of every unsettled transaction, oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, writes FROM txn_journal ORDER BY id").fetchall()
+        return [(txn_id, json.loads(writes)) for txn_id, writes in rows]
+
+    def dead_letter(self, txn_id: int, exc: Exception):
+        """Settle a transaction that will not be stored, keeping it in dead_letters."""
+        failed_at = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dead_letters (id, writes, error, failed_at) "
+                "SELECT id, writes, ?, ? FROM txn_journal WHERE id = ?",
+                (repr(exc), failed_at, txn_id))
+            self._conn.execute("DELETE FROM txn_journal WHERE id = ?", (txn_id,))
+
+    def dead_letters(self) -> list:
+        """Like StorageBackend.dead_letters, one entry per sheet of each transaction."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, writes, error, failed_at FROM dead_letters ORDER BY id").fetchall()
+        out = []
+        for txn_id, writes, error, failed_at in rows:
+            counts = {}
+            for write in json.loads(writes):
+                counts[write["sheet"]] = counts.get(write["sheet"], 0) + len(
+                    write.get("rows") or write.get("cells") or [])
+            out += [{"id": txn_id, "sheet": name, "kind": "commit", "count": count,
+                     "error": error, "failed_at": failed_at} for name, count in counts.items()]
+        return out
+
+    def discard_dead_letters(self, ids: list):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM dead_letters WHERE id = ?", [(i,) for i in ids])
+
+
+@st.cache_resource(show_spinner=False)
+def get_txn_journal() -> TransactionJournal:
+    return TransactionJournal(st.secrets.get("txn_journal_path", "farm_txn.db"))
+
+
+def rejected(exc: Exception) -> bool:
+    """True if the backend refused a request outright, so it never took effect."""
+    if isinstance(exc, sqlite3.IntegrityError):
+        # e.g. a repeated ID; the SQLite transaction was rolled back
+        return True
+    return (isinstance(exc, gspread.exceptions.APIError)
+            and 400 <= exc.code < 500 and exc.code != 429)
+
+
+def _unapplied(writes: list) -> list:
+    """writes without the appended rows whose IDs the sheets already hold.
+
+    A transaction is stored all-or-nothing, so rows that did get appended
+    mean it went through; its cell updates then already hold their new
+    values, which _verify_writes accepts.
+    """
+    pk_cols = {write["sheet"]: [PRIMARY_KEYS[write["sheet"]]] for write in writes
+               if write["kind"] == "append"
+               and PRIMARY_KEYS.get(write["sheet"]) in write["header"]}
+    stored = get_backend().fetch_columns(pk_cols) if pk_cols else {}
+    out = []
+    for write in writes:
+        values = stored.get(write["sheet"])
+        if write["kind"] == "append" and values:
+            have = {row[0] for row in values[1:] if row}
+            i = write["header"].index(pk_cols[write["sheet"]][0])
+            write = dict(write, rows=[row for row in write["rows"] if row[i] not in have])
+            if not write["rows"]:
+                continue
+        out.append(write)
+    return out
+
+
+class UnsettledTransactions(Exception):
+    """Earlier transactions could not be replayed, so a new one must wait."""
+
+
+def replay_transactions() -> bool:
+    """Send unsettled transactions from the journal again, oldest first.
+
+    The cached copies of their sheets are reloaded afterwards, since they
+    were never updated with the transaction's writes. Update cells are
+    checked by _verify_writes first, as rows may have moved or been edited
+    since. A transaction that now conflicts, or that the backend refuses,
+    moves to the journal's dead letters. Any other failure is logged and
+    leaves it, and those after it, in the journal; returns False in that
+    case.
+    """
+    journal = get_txn_journal()
+    cache = get_sheet_cache()
+    for txn_id, writes in journal.unsettled():
+        sheets = sorted({write["sheet"] for write in writes})
+        with ExitStack() as stack:
+            for name in sheets:
+                stack.enter_context(cache.lock(name))
+            try:
+                remaining = _unapplied(writes)
+                if remaining:
+                    checked = _verify_writes(get_backend(), remaining)
+                    conflicts = [c for c in checked if isinstance(c, WriteConflict)]
+                    if conflicts:
+                        raise conflicts[0]
+                    get_backend().commit(checked)
+            except Exception as exc:
+                if not isinstance(exc, WriteConflict) and not rejected(exc):
+                    logging.getLogger(__name__).warning(
+                        "Replaying transaction %d failed; it stays in the journal",
+                        txn_id, exc_info=True)
+                    return False
+                logging.getLogger(__name__).error(
+                    "Transaction %d was refused and moved to dead_letters", txn_id, exc_info=True)
+                journal.dead_letter(txn_id, exc)
+            else:
+                journal.settle(txn_id)
+            reload_sheets(sheets)
+    return True
+
+
+class Transaction:
+    """Appends and cell edits to several sheets that are stored together.
+
+    Stage writes with append_rows() and update_rows(), which take the same
+    arguments as the module functions, then call commit(). The writes go to
+    the backend as one commit, which Google Sheets and SQLite apply
+    all-or-nothing, in a single request. The shared cache is updated only
+    after the backend accepts it. Unsettled transactions in the journal are
+    replayed before a new one is sent; if that fails, commit() raises
+    UnsettledTransactions rather than store the new one ahead of them.
+    """
+
+    def __init__(self):
+        self._staged = []   # (kind, sheet_name, df, new_rows or changes)
+
+    def append_rows(self, df: pd.DataFrame, new_rows: pd.DataFrame, sheet_name: str):
+        self._staged.append(("append", sheet_name, df, new_rows))
+
+    def update_rows(self, df: pd.DataFrame, sheet_name: str, changes: dict):
+        self._staged.append(("update", sheet_name, df, changes))
+
+    def commit(self) -> dict:
+        """Store the staged writes; returns sheet name -> updated DataFrame."""
+        if not replay_transactions():
+            raise UnsettledTransactions()
+        cache = get_sheet_cache()
+        sheets = sorted({name for _, name, _, _ in self._staged})
+        with ExitStack() as stack:
+            for name in sheets:
+                stack.enter_context(cache.lock(name))
+            frames, writes, puts = self._plan()
+            stale = _check_writes(writes, frames) if writes else {}
+            appended = {write["sheet"] for write in writes if write["kind"] == "append"}
+            for name in appended & set(stale):
+                if any(w["sheet"] == name and w["kind"] == "update" for w in writes):
+                    # Our edits would be missed by taking only the new rows
+                    stale[name] = "changed"
+            if writes:
+                journal = get_txn_journal()
+                txn_id = journal.record(writes)
+                try:
+                    get_backend().commit(writes)
+                except Exception as exc:
+                    if rejected(exc):
+                        journal.settle(txn_id)
+                    raise
+                journal.settle(txn_id)
+            # Update the cached copies in the order the writes were staged
+            for kind, name, arg, tail, where in puts:
+                # Sheets with rows added elsewhere get ours after theirs, and
+                # sheets changed elsewhere are reloaded, so both skip the patch
+                if stale.get(name) == "changed" or (name in stale and name in appended):
+                    continue
+                if kind == "append":
+                    prev = frames[name]
+                    frames[name] = _concat_rows(prev, arg, name)
+                    cache.put(name, frames[name], reloaded=False, tail=tail,
+                              appended_from=len(prev))
+                else:
+                    frames[name] = _apply_changes(frames[name], arg)
+                    cache.put(name, frames[name], reloaded=False, tail=tail, updated=where)
+            if stale:
+                _refresh_stale(stale)
+                for name in stale:
+                    frames[name] = cache.peek(name).df
+        return frames
+
+    def _plan(self):
+        """Work out the backend writes from the newest shared copies."""
+        frames = {}
+        tails = {}
+        added = {}
+        staged = {}
+        writes = []
+        puts = []
+        for kind, name, df, arg in self._staged:
+            if name not in frames:
+                frames[name] = _latest(name, df)
+                entry = get_sheet_cache().peek(name)
+                tails[name] = entry.tail if entry is not None else None
+                added[name] = 0
+                staged[name] = {}
+            base = frames[name]
+            if kind == "append":
+                write = _append_write(base, arg, name)
+                if write is None:
+                    raise ValueError(f"Rows for {name} do not fit its header; save the sheet first")
+                writes.append(write)
+                tails[name] = _tail_marker([write["header"], write["rows"][-1]])
+                added[name] += len(arg)
+                puts.append((kind, name, arg, tails[name], None))
+            else:
+                cells, positions, tails[name] = _changed_cells(
+                    base, name, arg, tails[name], staged[name],
+                    last_pos=len(base) + added[name] - 1)
+                if cells:
+                    writes.append({"sheet": name, "kind": "update",
+                                   "header": base.columns.tolist(), "cells": cells})
+                puts.append((kind, name, arg, tails[name], positions))
+        return frames, writes, puts
+
+
+# ---------------------------------------------------------------------------
+# Shared data cache
+# ---------------------------------------------------------------------------
+
+class SheetEntry:
+    """One cached sheet: its DataFrame, version stamp and load time.
+
+    tail is the raw (header, last row) of the sheet as last seen, or None
+    when unknown; _sync_tails uses it to fetch only rows added since, until
+    the frame was last loaded in full (full_at) too long ago. derived holds
+    structures built from df, such as search indexes; see SheetCache.derived.
+    """
+
+    def __init__(self, df: pd.DataFrame, version: int, loaded_at: float, tail=None,
+                 full_at: float = None):
+        self.df = df
+        self.version = version
+        self.loaded_at = loaded_at
+        self.tail = tail
+        self.full_at = loaded_at if full_at is None else full_at
+        self.derived = {}
+
+
+class SheetCache:
+    """Process-wide cache of loaded sheets, shared by every browser session.
+
+    Each put() gives the entry a new version stamp, so a session can tell
+    its copy is stale without refetching. Entries loaded more than ttl
+    seconds ago are fetched again on the next read; full_reload is how old
+    a full load may get before a tail sync is no longer trusted.
+
+    Projections, holding only some columns of a sheet, are cached beside the
+    full entries for search; they are dropped whenever the full sheet is put.
+    """
+
+    def __init__(self, ttl: float, full_reload: float = FULL_RELOAD_SECONDS):
+        self.ttl = ttl
+        self.full_reload = full_reload
+        self._entries = {}
+        self._projections = {}
+        self._locks = {}
+        self._version = 0
+        self._mutex = threading.Lock()
+
+    def lock(self, sheet_name: str):
+        """Lock that serialises loads and writes of one sheet."""
+        with self._mutex:
+            return self._locks.setdefault(sheet_name, threading.RLock())
+
+    def peek(self, sheet_name: str):
+        """Return the entry even if it has expired, or None."""
+        return self._entries.get(sheet_name)
+
+    def get(self, sheet_name: str):
+        """Return the entry, or None if it is missing or expired."""
+        entry = self._entries.get(sheet_name)
+        if entry is None or time.monotonic() - entry.loaded_at > self.ttl:
+            return None
+        return entry
+
+    def put(self, sheet_name: str, df: pd.DataFrame, reloaded: bool = True,
+            tail=None, appended_from=None, updated=()) -> SheetEntry:
+        """Store df under a new version.
+
+        reloaded=False marks a write-through update, which keeps the load
+        time of the previous entry so the TTL still picks up outside edits.
+        Only a reloaded put without appended_from or updated counts as a
+        full load.
+        When df is the previous frame with rows appended from position
+        appended_from, or with the rows at positions updated changed, copies
+        of the previous entry's derived structures are patched for the new
+        entry instead of being rebuilt on next use. The originals stay as
+        they were, since sessions still reading the previous version use
+        them with its frame. Callers must hold lock(sheet_name).
+        """
+        old = self._entries.get(sheet_name)
+        derived = {}
+        if old is not None and (appended_from is not None or updated):
+            hook = "on_append" if appended_from is not None else "on_update"
+            arg = appended_from if appended_from is not None else updated
+            for key, item in old.derived.items():
+                if not hasattr(item, hook):
+                    continue
+                try:
+                    item = item.copy()
+                    getattr(item, hook)(df, arg)
+                except Exception:
+                    # Dropped structures are rebuilt from df on next use
+                    logging.getLogger(__name__).exception(
+                        "Could not patch %r of sheet %s", key, sheet_name)
+                    continue
+                derived[key] = item
+        with self._mutex:
+            self._version += 1
+            now = time.monotonic()
+            loaded_at = now if reloaded or old is None else old.loaded_at
+            full = old is None or (reloaded and appended_from is None and not updated)
+            entry = SheetEntry(df, self._version, loaded_at, tail, now if full else old.full_at)
+            entry.derived = derived
+            self._entries[sheet_name] = entry
+            self._projections = {key: value for key, value in self._projections.items()
+                                 if key[0] != sheet_name}
+        return entry
+
+    def projection(self, sheet_name: str, cols: list):
+        """Return the projection of sheet_name to cols, or None if missing or expired."""
+        entry = self._projections.get((sheet_name, tuple(cols)))
+        if entry is None or time.monotonic() - entry.loaded_at > self.ttl:
+            return None
+        return entry
+
+    def put_projection(self, sheet_name: str, cols: list, df: pd.DataFrame) -> SheetEntry:
+        with self._mutex:
+            self._version += 1
+            entry = SheetEntry(df, self._version, time.monotonic())
+            self._projections[(sheet_name, tuple(cols))] = entry
+        return entry
+
+    def derived(self, sheet_name: str, key, build, entry=None):
+        """Return the structure stored under key for an entry of sheet_name.
+
+        entry defaults to the sheet's current full entry. build(df) creates
+        the structure the first time it is asked for on an entry. Structures
+        may define on_append(df, start) and on_update(df, positions) to be
+        carried over to the next version by put(), which calls them on a
+        copy() the structure must then also define.
+        """
+        current = entry if entry is not None else self._entries.get(sheet_name)
+        if current is not None and key in current.derived:
+            return current.derived[key]
+        with self.lock(sheet_name):
+            if entry is None:
+                entry = self._entries[sheet_name]
+            if key not in entry.derived:
+                entry.derived[key] = build(entry.df)
+            return entry.derived[key]
+
+    def touch(self, sheet_name: str):
+        """Mark an entry as just checked against the sheet, keeping its version."""
+        with self._mutex:
+            entry = self._entries.get(sheet_name)
+            if entry is not None:
+                entry.loaded_at = time.monotonic()
+
+
+@st.cache_resource(show_spinner=False)
+def get_sheet_cache() -> SheetCache:
+    ttl = float(st.secrets.get("cache_ttl_seconds", CACHE_TTL_SECONDS))
+    full_reload = float(st.secrets.get("full_reload_seconds", FULL_RELOAD_SECONDS))
+    return SheetCache(ttl, full_reload)
+
+
+def _latest(sheet_name: str, df: pd.DataFrame) -> pd.DataFrame:
+    """The newest shared copy of a sheet, falling back to df."""
+    entry = get_sheet_cache().peek(sheet_name)
+    return df if entry is None else entry.df
+
+
+def _cached_entries(sheet_names: list) -> dict:
+    """Return sheet name -> SheetEntry, loading missing or expired sheets.
+
+    Sheets that need loading are fetched together in one request while
+    holding their locks, so concurrent sessions do not load them twice.
+    Expired append-only sheets first try an incremental sync.
+    """
+    cache = get_sheet_cache()
+    entries = {name: cache.get(name) for name in sheet_names}
+    missing = sorted(name for name, entry in entries.items() if entry is None)
+    if missing:
+        with ExitStack() as stack:
+            for name in missing:
+                stack.enter_context(cache.lock(name))
+            # Another session may have loaded them while we waited. Sheets
+            # with queued writes keep their cached copy, which already has them.
+            backend = get_backend()
+            stale = [name for name in missing if cache.get(name) is None
+                     and not (cache.peek(name) is not None and backend.pending(name))]
+            synced = _sync_tails([name for name in stale if name in APPEND_ONLY_SHEETS])
+            reload_sheets([name for name in stale if name not in synced])
+            for name in missing:
+                entries[name] = cache.peek(name)
+    return entries
+
+
+@st.cache_resource
+def _prefetch_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="sheet-prefetch")
+
+
+def prefetch_sheets(sheet_names: list):
+    """Warm the shared cache for sheet_names on a background thread.
+
+    Sheets already cached are skipped; the rest load in one request. A page
+    that needs one of them meanwhile waits on the sheet lock instead of
+    loading it a second time.
+    """
+    cache = get_sheet_cache()
+    missing = [name for name in sheet_names if cache.get(name) is None]
+    if missing:
+        future = _prefetch_executor().submit(_cached_entries, missing)
+        future.add_done_callback(_log_prefetch_error)
+
+
+def _log_prefetch_error(future):
+    # Nothing waits on the prefetch, so its errors would otherwise vanish
+    exc = None if future.cancelled() else future.exception()
+    if exc is not None:
+        logging.getLogger(__name__).error("Prefetching sheets failed", exc_info=exc)
+
+
+def reload_sheets(sheet_names: list):
+    """Fully reload sheet_names into the shared cache with one request."""
+    if not sheet_names:
+        return
+    cache = get_sheet_cache()
+    for name, values in get_backend().fetch(sheet_names).items():
+        cache.put(name, values_to_df(values, name), tail=_tail_marker(values))
+
+
+def _session_copy(key: str, entry: SheetEntry) -> pd.DataFrame:
+    """Point the session at the shared DataFrame if its version changed."""
+    versions = st.session_state.setdefault("sheet_versions", {})
+    if key not in st.session_state or versions.get(key) != entry.version:
+        st.session_state[key] = entry.df
+        versions[key] = entry.version
+    return st.session_state[key]
+
+
+def get_data(key: str, sheet_name: str) -> pd.DataFrame:
+    return get_data_many([(key, sheet_name)])[0]
+
+
+def get_data_many(items: list) -> list:
+    """Like get_data for several (key, sheet_name) pairs.
+
+    Sheets missing from the shared cache are fetched together in one request.
+    """
+    entries = _cached_entries([sheet_name for _, sheet_name in items])
+    return [_session_copy(key, entries[sheet_name]) for key, sheet_name in items]
+
+
+# ---------------------------------------------------------------------------
+# ID allocation
+# ---------------------------------------------------------------------------
+
+class IdAllocator:
+    """Hands out sequential IDs per sheet without scanning the sheet.
+
+    Each sheet's high-water mark is seeded once and then only moves up,
+    under a lock, so sessions adding rows at the same moment never get the
+    same ID.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._marks = {}
+
+    def reserve(self, sheet_name: str, seed, floor: int = 0) -> int:
+        """Return the next number for sheet_name.
+
+        seed() gives the current highest number and is only called the first
+        time; floor is a number known to be taken, e.g. the ID of the last
+        row, which covers rows added outside this process.
+        """
+        with self._lock:
+            mark = self._marks.get(sheet_name)
+            if mark is None:
+                mark = seed()
+            mark = max(mark, floor) + 1
+            self._marks[sheet_name] = mark
+            return mark
+
+
+@st.cache_resource
+def get_id_allocator() -> IdAllocator:
+    return IdAllocator()
+
+
+def _id_number(value, prefix: str):
+    """Numeric part of an ID like W012, or None if it is malformed."""
+    match = re.fullmatch(re.escape(prefix) + r"(\d+)", str(value))
+    return int(match.group(1)) if match else None
+
+
+def _scan_max_id(df: pd.DataFrame, id_col: str, prefix: str) -> int:
+    if df.empty or id_col not in df.columns:
+        return 0
+    nums = pd.to_numeric(
+        df[id_col].astype(str).str.extract(f"^{re.escape(prefix)}(\\d+)$", expand=False),
+        errors="coerce")
+    return int(nums.max()) if nums.notna().any() else 0
+
+
+def next_id(sheet_name: str, df: pd.DataFrame, id_col: str, prefix: str, width: int) -> str:
+    df = _latest(sheet_name, df)
+
+    def seed():
+        top = get_backend().max_id(sheet_name, id_col, prefix)
+        return _scan_max_id(df, id_col, prefix) if top is None else top
+
+    last = _id_number(df[id_col].iloc[-1], prefix) if len(df) and id_col in df.columns else None
+    num = get_id_allocator().reserve(sheet_name, seed, last or 0)
+    return f"{prefix}{num:0{width}d}"
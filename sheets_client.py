@@ -0,0 +1,179 @@
+"""
+Rate-limited HTTP client for gspread, shared by the app and the upload script.
+
+Every request takes a token from a bucket sized to the Sheets API per-user
+quota (reads and writes are metered separately, as Google meters them), so
+bursts are smoothed out before they turn into 429 errors. Requests that are
+still refused with 429, and reads that fail with a 5xx or a dropped
+connection, are retried with exponential backoff and full jitter, honouring
+Retry-After when the response carries one. Writes are not retried on 5xx:
+the request may have taken effect, and the callers decide how to recover.
+
+Identical GET requests that are in flight at the same time are coalesced:
+the first one goes to the API and the others wait for its response, so
+sessions that open the same page together share one HTTP call. A GET only
+joins one sent after the last write finished, so a caller always reads its
+own writes.
+
+Usage:
+  client = sheets_client.authorize(creds, reads_per_minute=60, writes_per_minute=60)
+"""
+
+import functools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import gspread
+import requests
+from gspread.http_client import HTTPClient
+
+# Default Sheets API quota: 60 read and 60 write requests per minute per user
+READS_PER_MINUTE = 60
+WRITES_PER_MINUTE = 60
+# Requests that may go out back to back before the bucket starts pacing them
+BURST = 10
+
+MAX_RETRIES = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 64.0
+
+RETRY_READ_CODES = {408, 429, 500, 502, 503, 504}
+RETRY_WRITE_CODES = {429}
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """Empty the bucket, e.g. after the API reported the quota exceeded."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0)
+            self._stamp = time.monotonic()
+
+
+class RateLimitedHTTPClient(HTTPClient):
+    """gspread HTTP client with quota pacing, retries and read coalescing."""
+
+    def __init__(self, auth, session=None, *, reads: TokenBucket, writes: TokenBucket,
+                 max_retries: int = MAX_RETRIES):
+        super().__init__(auth, session)
+        self.reads = reads
+        self.writes = writes
+        self.max_retries = max_retries
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # Bumped when a write finishes; GETs sent before that are not joined
+        self._writes_done = 0
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        if method.upper() != "GET" or data is not None or json is not None or files is not None:
+            try:
+                return self._send(method, endpoint, params, data, json, files, headers)
+            finally:
+                with self._inflight_lock:
+                    self._writes_done += 1
+
+        key = (endpoint, _freeze(params), _freeze(headers))
+        with self._inflight_lock:
+            stamp, call = self._inflight.get(key, (None, None))
+            leader = stamp != self._writes_done
+            if leader:
+                call = Future()
+                self._inflight[key] = (self._writes_done, call)
+        if not leader:
+            return call.result()
+        try:
+            response = self._send(method, endpoint, params, data, json, files, headers)
+        except BaseException as exc:
+            call.set_exception(exc)
+            raise
+        else:
+            call.set_result(response)
+            return response
+        finally:
+            with self._inflight_lock:
+                # A newer GET may have taken the slot after a write
+                if self._inflight.get(key, (None, None))[1] is call:
+                    del self._inflight[key]
+
+    def _send(self, method, endpoint, params, data, json, files, headers):
+        read = method.upper() == "GET"
+        bucket = self.reads if read else self.writes
+        retry_codes = RETRY_READ_CODES if read else RETRY_WRITE_CODES
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                return super().request(method, endpoint, params=params, data=data, json=json,
+                                       files=files, headers=headers)
+            except gspread.exceptions.APIError as exc:
+                if exc.code not in retry_codes or attempt >= self.max_retries:
+                    raise
+                if exc.code == 429:
+                    bucket.drain()
+                delay = _retry_after(exc.response)
+            except (requests.ConnectionError, requests.Timeout):
+                if not read or attempt >= self.max_retries:
+                    raise
+                delay = None
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            attempt += 1
+            log.warning("Sheets %s %s failed; retry %d in %.1fs", method.upper(), endpoint, attempt, delay)
+            time.sleep(delay)
+
+
+def _freeze(value):
+    """Hashable form of request params or headers."""
+    if value is None:
+        return None
+    if hasattr(value, "items"):
+        value = sorted(value.items())
+    # Repeated keys (e.g. batchGet ranges) keep their order
+    return tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in value)
+
+
+def _retry_after(response):
+    """Seconds from a Retry-After header, or None."""
+    try:
+        return max(float(response.headers.get("Retry-After")), 0.0)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def authorize(credentials, reads_per_minute: float = READS_PER_MINUTE,
+              writes_per_minute: float = WRITES_PER_MINUTE, burst: float = BURST,
+              max_retries: int = MAX_RETRIES) -> gspread.Client:
+    """gspread.authorize() with a RateLimitedHTTPClient sized to the given quota."""
+    http_client = functools.partial(
+        RateLimitedHTTPClient,
+        reads=TokenBucket(reads_per_minute / 60, burst),
+        writes=TokenBucket(writes_per_minute / 60, burst),
+        max_retries=max_retries,
+    )
+    return gspread.authorize(credentials, http_client=http_client)
@@ -0,0 +1,18 @@
+"""Shared fixtures."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sheet_store  # noqa: E402
+
+
+@pytest.fixture
+def frame():
+    """frame(sheet_name, header, *rows): a typed DataFrame as loaded from the sheet."""
+    def make(sheet_name, header, *rows):
+        return sheet_store.values_to_df([list(header)] + [list(row) for row in rows], sheet_name)
+    return make
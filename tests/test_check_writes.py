@@ -0,0 +1,124 @@
+import pytest
+
+import sheet_store
+from sheet_store import SQLiteBackend, WriteConflict, _check_writes, _verify_writes
+
+HEADER = ["worker_id", "name_te", "phone", "default_daily_wage", "active", "notes"]
+ROWS = [["W001", "Ramu", "", "500", "Y", ""], ["W002", "Sita", "", "550", "Y", ""]]
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    backend = SQLiteBackend(str(tmp_path / "farm.db"))
+    backend.append("workers", HEADER, ROWS)
+    monkeypatch.setattr(sheet_store, "get_backend", lambda: backend)
+    reloaded = []
+    monkeypatch.setattr(sheet_store, "reload_sheets", reloaded.extend)
+    backend.reloaded = reloaded
+    return backend
+
+
+@pytest.fixture
+def df(frame):
+    return frame("workers", HEADER, *ROWS)
+
+
+def update(*cells):
+    return {"sheet": "workers", "kind": "update", "header": HEADER,
+            "cells": [dict(zip(("row", "key", "col", "value", "old"), cell)) for cell in cells]}
+
+
+def append(*rows):
+    return {"sheet": "workers", "kind": "append", "header": HEADER, "rows": [list(r) for r in rows]}
+
+
+def test_unchanged_sheet_passes(backend, df):
+    assert _check_writes([update((1, "W002", "notes", "x", ""))], {"workers": df}) == {}
+    assert backend.reloaded == []
+
+
+def test_edit_elsewhere_to_other_cells_is_merged(backend, df):
+    backend.update("workers", HEADER, [{"row": 1, "key": "W002", "col": "phone", "value": "999"}])
+    assert _check_writes([update((1, "W002", "notes", "x", ""))], {"workers": df}) == {"workers": "changed"}
+
+
+def test_edit_elsewhere_to_the_same_cell_conflicts(backend, df):
+    backend.update("workers", HEADER, [{"row": 1, "key": "W002", "col": "notes", "value": "theirs"}])
+    with pytest.raises(WriteConflict) as info:
+        _check_writes([update((1, "W002", "notes", "ours", ""))], {"workers": df})
+    assert info.value.keys == ["W002"]
+    assert backend.reloaded == ["workers"]
+
+
+def test_parsed_values_compare_equal(backend, df):
+    backend.update("workers", HEADER, [{"row": 1, "key": "W002", "col": "default_daily_wage",
+                                        "value": "550.0"}])
+    assert _check_writes([update((1, "W002", "notes", "x", ""))], {"workers": df}) == {}
+
+
+def test_moved_row_is_followed_by_id(backend, df):
+    backend.write_all("workers", [HEADER, ["W000", "New", "", "", "", ""]] + ROWS)
+    write = update((1, "W002", "notes", "x", ""))
+    assert _check_writes([write], {"workers": df}) == {"workers": "changed"}
+    assert write["cells"][0]["row"] == 2
+
+
+def test_removed_row_conflicts(backend, df):
+    backend.write_all("workers", [HEADER, ROWS[0]])
+    with pytest.raises(WriteConflict):
+        _check_writes([update((1, "W002", "notes", "x", ""))], {"workers": df})
+
+
+def test_append_after_rows_added_elsewhere(backend, df):
+    backend.append("workers", HEADER, [["W003", "Ravi", "", "", "", ""]])
+    assert _check_writes([append(["W004", "Gopi", "", "", "", ""])], {"workers": df}) == {"workers": "grown"}
+    with pytest.raises(WriteConflict) as info:
+        _check_writes([append(["W003", "Gopi", "", "", "", ""])], {"workers": df})
+    assert info.value.keys == ["W003"]
+
+
+def test_changed_header_conflicts(backend, df):
+    backend.write_all("workers", [HEADER[:-1] + ["remarks"]] + ROWS)
+    with pytest.raises(WriteConflict) as info:
+        _check_writes([update((1, "W002", "notes", "x", ""))], {"workers": df})
+    assert info.value.keys == []
+
+
+def test_verify_keeps_edits_made_elsewhere(backend):
+    backend.update("workers", HEADER, [{"row": 1, "key": "W002", "col": "phone", "value": "999"}])
+    write = update((1, "W002", "notes", "x", ""))
+    assert _verify_writes(backend, [write]) == [write]
+
+
+def test_verify_refuses_cells_changed_elsewhere(backend):
+    backend.update("workers", HEADER, [{"row": 1, "key": "W002", "col": "notes", "value": "theirs"}])
+    checked = _verify_writes(backend, [update((1, "W002", "notes", "ours", "")),
+                                       update((0, "W001", "notes", "ok", ""))])
+    assert isinstance(checked[0], WriteConflict) and checked[0].keys == ["W002"]
+    assert checked[1]["cells"][0]["value"] == "ok"
+    # A cell already holding the new value was sent before
+    assert _verify_writes(backend, [update((1, "W002", "notes", "theirs", ""))])[0]["cells"]
+
+
+def test_verify_follows_moved_rows(backend):
+    backend.write_all("workers", [HEADER, ROWS[1], ["W000", "New", "", "", "", ""], ROWS[0]])
+    checked = _verify_writes(backend, [update((0, "W001", "notes", "x", ""),
+                                              (1, "W002", "notes", "y", ""))])
+    assert [cell["row"] for cell in checked[0]["cells"]] == [2, 0]
+
+
+def test_verify_counts_earlier_writes(backend):
+    checked = _verify_writes(backend, [
+        append(["W003", "Ravi", "", "", "", ""]),
+        update((2, "W003", "notes", "new", "")),
+        update((2, "W003", "notes", "newer", "new")),
+        append(["W003", "Again", "", "", "", ""]),
+    ])
+    assert [isinstance(w, WriteConflict) for w in checked] == [False, False, False, True]
+    assert checked[3].keys == ["W003"]
+
+
+def test_verify_skips_sheets_without_ids(backend):
+    write = {"sheet": "notes", "kind": "update", "header": ["text"],
+             "cells": [{"row": 0, "key": None, "col": "text", "value": "x", "old": ""}]}
+    assert _verify_writes(backend, [write]) == [write]
@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytest
+
+import sheet_index
+import sheet_store
+
+HEADER = ["work_log_id", "date", "worker_id", "pay_status"]
+
+
+@pytest.fixture
+def logs(frame):
+    return frame("work_logs", HEADER,
+                 ["WL1", "2024-01-03", "W1", "PAID"],
+                 ["WL2", "2024-01-01", "W2", "UNPAID"],
+                 ["WL3", "", "W1", "UNPAID"],
+                 ["WL4", "2024-01-02", "W1", "UNPAID"],
+                 ["WL5", "2024-01-05", "W2", "PAID"])
+
+
+@pytest.fixture
+def index(logs):
+    return sheet_index.DateIndex(logs, "date", ["worker_id", "pay_status"])
+
+
+def test_range(index):
+    assert index.positions(date(2024, 1, 2), date(2024, 1, 3)).tolist() == [0, 3]
+    assert index.positions(start=date(2024, 1, 3)).tolist() == [0, 4]
+    assert index.positions(end=date(2024, 1, 1)).tolist() == [1]
+
+
+def test_blank_dates_only_without_range(index):
+    assert index.positions().tolist() == [0, 1, 2, 3, 4]
+    assert 2 not in index.positions(date(2000, 1, 1), date(2100, 1, 1)).tolist()
+
+
+def test_where(index):
+    assert index.positions(where={"worker_id": "W1"}).tolist() == [0, 2, 3]
+    assert index.positions(date(2024, 1, 1), date(2024, 1, 4),
+                           where={"worker_id": "W1", "pay_status": "UNPAID"}).tolist() == [3]
+    assert index.positions(where={"worker_id": "W9"}).tolist() == []
+
+
+def test_bounds_values_and_counts(frame, index):
+    assert index.min_date == date(2024, 1, 1)
+    assert index.max_date == date(2024, 1, 5)
+    assert index.values("worker_id") == ["W1", "W2"]
+    assert index.count("worker_id", "W1") == 3
+    assert index.count("pay_status", "REFUNDED") == 0
+    empty = sheet_index.DateIndex(frame("work_logs", HEADER), "date")
+    assert empty.min_date is None and empty.max_date is None
+
+
+def test_on_append(frame, logs, index):
+    rows = sheet_store.sheet_values(logs) + [["WL6", "2023-12-31", "W3", "UNPAID"]]
+    index.on_append(frame("work_logs", HEADER, *rows), len(logs))
+    assert index.min_date == date(2023, 12, 31)
+    assert index.positions(end=date(2024, 1, 1)).tolist() == [1, 5]
+    assert index.values("worker_id") == ["W1", "W2", "W3"]
+
+
+def test_on_update_moves_row(frame, logs, index):
+    rows = sheet_store.sheet_values(logs)
+    rows[0] = ["WL1", "2024-02-01", "W2", "PAID"]
+    index.on_update(frame("work_logs", HEADER, *rows), [0])
+    assert index.positions(where={"worker_id": "W1"}).tolist() == [2, 3]
+    assert index.positions(start=date(2024, 1, 6)).tolist() == [0]
+    assert index.max_date == date(2024, 2, 1)
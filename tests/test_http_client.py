@@ -0,0 +1,143 @@
+import threading
+import time
+
+import gspread
+import pytest
+import requests
+
+import sheets_client
+from sheets_client import RateLimitedHTTPClient, TokenBucket
+
+URL = "https://sheets.googleapis.com/v4/spreadsheets/abc/values/workers"
+
+
+class FakeResponse:
+    def __init__(self, code=200, headers=None):
+        self.status_code = code
+        self.ok = code < 400
+        self.headers = headers or {}
+        self.text = ""
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": "", "status": ""}}
+
+
+class FakeSession:
+    """Answers requests from a script of responses or exceptions, in order.
+
+    When gate is set, GETs wait on it before answering.
+    """
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+        self.gate = None
+        self.entered = threading.Event()
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        with self._lock:
+            self.calls.append(method)
+            result = self.script.pop(0) if self.script else FakeResponse()
+        if method == "GET" and self.gate is not None:
+            self.entered.set()
+            self.gate.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    slept = []
+    monkeypatch.setattr(sheets_client.time, "sleep", slept.append)
+    return slept
+
+
+def client(session, max_retries=3):
+    return RateLimitedHTTPClient(None, session, reads=TokenBucket(100, 100),
+                                 writes=TokenBucket(100, 100), max_retries=max_retries)
+
+
+def test_concurrent_identical_gets_share_one_call():
+    session = FakeSession()
+    session.gate = threading.Event()
+    http = client(session)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(http.request("GET", URL)))
+               for _ in range(3)]
+    threads[0].start()
+    assert session.entered.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # Let the followers reach the in-flight call before it is answered
+    time.sleep(0.1)
+    session.gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert session.calls == ["GET"]
+    assert len(results) == 3 and all(r is results[0] for r in results)
+
+
+def test_get_after_a_write_is_sent_again():
+    session = FakeSession()
+    session.gate = threading.Event()
+    http = client(session)
+    first = threading.Thread(target=http.request, args=("GET", URL))
+    first.start()
+    assert session.entered.wait(5)
+    http.request("POST", URL, json={"values": [["x"]]})
+    second = threading.Thread(target=http.request, args=("GET", URL))
+    second.start()
+    time.sleep(0.1)
+    session.gate.set()
+    first.join(5)
+    second.join(5)
+    # The second read started after the write, so it may not reuse the first
+    assert session.calls == ["GET", "POST", "GET"]
+
+
+def test_failed_get_frees_its_slot():
+    session = FakeSession(FakeResponse(400))
+    http = client(session)
+    with pytest.raises(gspread.exceptions.APIError):
+        http.request("GET", URL)
+    assert http.request("GET", URL).status_code == 200
+    assert http._inflight == {}
+
+
+def test_reads_retry_server_errors_with_retry_after(slept):
+    session = FakeSession(FakeResponse(503, {"Retry-After": "7"}), FakeResponse(500), FakeResponse())
+    assert client(session).request("GET", URL).status_code == 200
+    assert len(session.calls) == 3
+    assert slept[0] == 7.0
+    assert 0 <= slept[1] <= sheets_client.BACKOFF_BASE_SECONDS * 2
+
+
+def test_reads_retry_dropped_connections(slept):
+    session = FakeSession(requests.ConnectionError(), FakeResponse())
+    assert client(session).request("GET", URL).status_code == 200
+    assert len(slept) == 1
+
+
+def test_writes_retry_only_quota_errors(slept):
+    session = FakeSession(FakeResponse(429), FakeResponse())
+    http = client(session)
+    assert http.request("POST", URL, json={}).status_code == 200
+    # The quota error empties the write bucket
+    assert http.writes._tokens < 1
+    session = FakeSession(FakeResponse(503))
+    with pytest.raises(gspread.exceptions.APIError):
+        client(session).request("POST", URL, json={})
+    session = FakeSession(requests.ConnectionError())
+    with pytest.raises(requests.ConnectionError):
+        client(session).request("POST", URL, json={})
+    assert len(session.calls) == 1
+
+
+def test_retries_give_up_after_max_retries(slept):
+    session = FakeSession(*[FakeResponse(503)] * 5)
+    with pytest.raises(gspread.exceptions.APIError) as info:
+        client(session, max_retries=2).request("GET", URL)
+    assert info.value.code == 503
+    assert len(session.calls) == 3 and len(slept) == 2
@@ -0,0 +1,47 @@
+import threading
+
+import sheet_store
+
+
+def test_seed_is_called_once():
+    allocator = sheet_store.IdAllocator()
+    calls = []
+
+    def seed():
+        calls.append(1)
+        return 41
+    assert allocator.reserve("workers", seed) == 42
+    assert allocator.reserve("workers", seed) == 43
+    assert len(calls) == 1
+
+
+def test_floor_covers_rows_added_elsewhere():
+    allocator = sheet_store.IdAllocator()
+    assert allocator.reserve("workers", lambda: 5) == 6
+    assert allocator.reserve("workers", lambda: 0, floor=20) == 21
+    # A floor below the mark never moves it back
+    assert allocator.reserve("workers", lambda: 0, floor=3) == 22
+
+
+def test_sheets_are_independent():
+    allocator = sheet_store.IdAllocator()
+    assert allocator.reserve("workers", lambda: 9) == 10
+    assert allocator.reserve("tools", lambda: 0) == 1
+
+
+def test_concurrent_reservations_are_unique():
+    allocator = sheet_store.IdAllocator()
+    results = []
+    lock = threading.Lock()
+
+    def take():
+        for _ in range(200):
+            num = allocator.reserve("work_logs", lambda: 0)
+            with lock:
+                results.append(num)
+    threads = [threading.Thread(target=take) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == list(range(1, 1601))
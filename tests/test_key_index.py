@@ -0,0 +1,70 @@
+import pytest
+
+import sheet_index
+import sheet_store
+from sheet_index import KeyIndex, find_row
+from sheet_store import SheetCache
+
+HEADER = ["worker_id", "name_te", "phone", "default_daily_wage", "active", "notes"]
+
+
+@pytest.fixture
+def workers(frame):
+    return frame("workers", HEADER, ["W001", "Ramu", "", "500", "Y", ""],
+                 ["W002", "Sita", "", "550", "Y", ""], ["W001", "Copy", "", "", "", ""])
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SheetCache(60)
+    monkeypatch.setattr(sheet_index, "get_sheet_cache", lambda: cache)
+    monkeypatch.setattr(sheet_store, "get_sheet_cache", lambda: cache)
+    return cache
+
+
+def test_first_row_of_each_id(workers):
+    index = KeyIndex(workers, "worker_id")
+    assert index.position("W001") == 0
+    assert index.position("W002") == 1
+    assert index.position("W404") is None
+
+
+def test_appended_and_edited_ids(frame, workers):
+    index = KeyIndex(workers, "worker_id")
+    grown = sheet_store._concat_rows(workers, frame("workers", HEADER, ["W003", "Ravi", "", "", "", ""]),
+                                     "workers")
+    index.on_append(grown, 3)
+    assert index.position("W003") == 3
+    # Editing another column leaves the index alone
+    grown.loc[1, "name_te"] = "Gita"
+    index.on_update(grown, [1])
+    assert index.position("W002") == 1
+    # Editing the first W001's ID hands W001 to the copy below it
+    grown.loc[0, "worker_id"] = "W009"
+    index.on_update(grown, [0])
+    assert (index.position("W009"), index.position("W001")) == (0, 2)
+
+
+def test_find_row_uses_the_index_of_the_shared_copy(cache, workers):
+    cache.put("workers", workers)
+    assert find_row("workers", workers, "W002") == workers.index[1]
+    assert ("key", "worker_id") in cache.peek("workers").derived
+    assert find_row("workers", workers, "W404") is None
+
+
+def test_find_row_scans_other_frames(cache, frame, workers):
+    cache.put("workers", workers)
+    mine = frame("workers", HEADER, ["W002", "Sita", "", "550", "Y", ""])
+    assert find_row("workers", mine, "W002") == mine.index[0]
+    assert find_row("workers", mine, "W001") is None
+
+
+def test_find_row_ignores_rows_past_an_older_copy(cache, frame, workers):
+    cache.put("workers", workers)
+    find_row("workers", workers, "W001")
+    grown = sheet_store._concat_rows(workers, frame("workers", HEADER, ["W003", "Ravi", "", "", "", ""]),
+                                     "workers")
+    cache.put("workers", grown, reloaded=False, appended_from=3)
+    assert find_row("workers", grown, "W003") == grown.index[3]
+    # The previous version's index never learned about W003
+    assert find_row("workers", workers, "W003") is None
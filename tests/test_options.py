@@ -0,0 +1,45 @@
+import pytest
+
+import sheet_index
+from sheet_index import Options, options
+from sheet_store import SheetCache
+
+HEADER = ["tool_id", "name_te", "tool_type", "status_te", "current_place_id", "current_place_te"]
+
+
+@pytest.fixture
+def tools(frame):
+    return frame("tools", HEADER, ["T001", "గొడ్డలి", "hand", "బాగుంది", "P1", "షెడ్"],
+                 ["T002", "నాగలి", "plough", "రిపేర్", "", ""],
+                 ["T003", "పార", "hand", "బాగుంది", "P2", "పొలం"])
+
+
+def test_ids_and_labels_from_template(tools):
+    opts = Options(tools, "tool_id", "{name_te} ({tool_id}) - {current_place_te}")
+    assert opts.ids == ["T001", "T002", "T003"]
+    assert opts.label("T001") == "గొడ్డలి (T001) - షెడ్"
+    assert opts.label("T002") == "నాగలి (T002) - "
+    # Unknown IDs are shown as they are
+    assert opts.label("T404") == "T404"
+
+
+def test_where_filters_rows(tools):
+    assert Options(tools, "tool_id", "{tool_id}", {"tool_type": ["hand"]}).ids == ["T001", "T003"]
+    # None stands for a blank cell
+    assert Options(tools, "tool_id", "{tool_id}", {"current_place_id": ["P2", None]}).ids == [
+        "T002", "T003"]
+    assert Options(tools.iloc[:0], "tool_id", "{tool_id}").ids == []
+
+
+def test_shared_copy_builds_once_per_version(monkeypatch, tools):
+    cache = SheetCache(60)
+    monkeypatch.setattr(sheet_index, "get_sheet_cache", lambda: cache)
+    cache.put("tools", tools)
+    first = options("tools", tools, "{tool_id}")
+    assert options("tools", tools, "{tool_id}") is first
+    assert options("tools", tools, "{name_te}") is not first
+    # Another frame, e.g. a session's filtered copy, gets its own list
+    assert options("tools", tools.iloc[:1], "{tool_id}").ids == ["T001"]
+    # Options are not patched, so a new version builds them again
+    cache.put("tools", tools.copy(), reloaded=False, updated=[0])
+    assert options("tools", cache.peek("tools").df, "{tool_id}") is not first
@@ -0,0 +1,63 @@
+import unicodedata
+
+import pytest
+
+import sheet_index
+import sheet_store
+
+COLS = ["worker_id", "name_te", "phone"]
+
+
+@pytest.fixture
+def workers(frame):
+    return frame("workers", COLS,
+                 ["W001", "Ramu", "9876543210"],
+                 ["W002", "Sita", "9123456789"],
+                 ["W003", "Ramesh", ""])
+
+
+def test_substring_in_any_column(workers):
+    index = sheet_index.SearchIndex(workers, COLS)
+    assert index.search("ram") == [0, 2]
+    assert index.search("W002") == [1]
+    assert index.search("5432") == [0]
+
+
+def test_short_queries_and_no_match(workers):
+    index = sheet_index.SearchIndex(workers, COLS)
+    assert index.search("s") == [1, 2]
+    assert index.search("ta") == [1]
+    assert index.search("xyz") == []
+    assert index.search("") == []
+
+
+def test_case_and_unicode_normalisation(frame):
+    decomposed = unicodedata.normalize("NFD", "José")
+    index = sheet_index.SearchIndex(frame("workers", COLS, ["W001", decomposed, ""]), COLS)
+    assert index.search("JOSÉ") == [0]
+
+
+def test_missing_columns_are_skipped(workers):
+    index = sheet_index.SearchIndex(workers, ["name_te", "notes"])
+    assert index.cols == ["name_te"]
+    assert index.search("W001") == []
+    assert sheet_index.SearchIndex(workers, ["notes"]).search("ramu") == []
+
+
+def test_on_append(frame, workers):
+    index = sheet_index.SearchIndex(workers, COLS)
+    grown = frame("workers", COLS, *[list(r) for r in sheet_store.sheet_values(workers)],
+                  ["W004", "Raman", ""])
+    index.on_append(grown, len(workers))
+    assert index.search("rama") == [3]
+    assert index.search("ram") == [0, 2, 3]
+
+
+def test_on_update_replaces_old_values(workers):
+    index = sheet_index.SearchIndex(workers, COLS)
+    edited = workers.copy()
+    edited.loc[1, "name_te"] = "Gita"
+    index.on_update(edited, [1])
+    assert index.search("sita") == []
+    assert index.search("gita") == [1]
+    assert index.search("W002") == [1]
@@ -0,0 +1,48 @@
+import pytest
+
+import sheet_index
+
+HEADER = ["work_log_id", "date", "amount_due", "amount_paid", "pay_status", "pay_method"]
+
+
+@pytest.fixture
+def logs(frame):
+    return frame("work_logs", HEADER,
+                 ["WL1", "2024-01-03", "500", "0", "UNPAID", ""],
+                 ["WL2", "2024-01-01", "400", "100", "PARTIAL", "నగదు"],
+                 ["WL3", "2024-01-02", "300", "", "UNPAID", ""])
+
+
+def test_oldest_first_with_partial_last(logs):
+    changes = sheet_index.settle_oldest_first(logs, 500, "UPI")
+    assert list(changes) == [1, 2]
+    assert changes[1] == {"amount_paid": 400, "pay_status": "PAID", "pay_method": "UPI"}
+    assert changes[2] == {"amount_paid": 200, "pay_status": "PARTIAL", "pay_method": "UPI"}
+
+
+def test_exact_and_surplus_amounts(logs):
+    assert sheet_index.settle_oldest_first(logs, 300, "UPI") == {
+        1: {"amount_paid": 400, "pay_status": "PAID", "pay_method": "UPI"}}
+    changes = sheet_index.settle_oldest_first(logs, 10_000, "UPI")
+    assert [c["amount_paid"] for c in changes.values()] == [400, 300, 500]
+    assert all(c["pay_status"] == "PAID" for c in changes.values())
+
+
+def test_paid_logs_and_nothing_to_spend(frame, logs):
+    assert sheet_index.settle_oldest_first(logs, 0, "UPI") == {}
+    paid = frame("work_logs", HEADER, ["WL1", "2024-01-01", "500", "500", "PAID", "UPI"],
+                 ["WL2", "", "200", "0", "UNPAID", ""])
+    # Fully paid logs are skipped; undated logs come last
+    assert sheet_index.settle_oldest_first(paid, 50, "UPI") == {
+        1: {"amount_paid": 50, "pay_status": "PARTIAL", "pay_method": "UPI"}}
+
+
+def test_fractional_amounts_are_kept(frame):
+    logs = frame("work_logs", HEADER, ["WL1", "2024-01-01", "100", "0", "UNPAID", ""],
+                 ["WL2", "2024-01-02", "100", "0", "UNPAID", ""])
+    changes = sheet_index.settle_oldest_first(logs, 150.75, "UPI")
+    assert changes[0] == {"amount_paid": 100, "pay_status": "PAID", "pay_method": "UPI"}
+    assert changes[1] == {"amount_paid": 50.75, "pay_status": "PARTIAL", "pay_method": "UPI"}
+    assert type(changes[0]["amount_paid"]) is int
+    # Less than a rupee still counts
+    assert sheet_index.settle_oldest_first(logs, 0.5, "UPI")[0]["amount_paid"] == 0.5
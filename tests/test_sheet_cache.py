@@ -0,0 +1,112 @@
+import pandas as pd
+
+from sheet_index import KeyIndex
+from sheet_store import SheetCache
+
+
+class Counter:
+    """Derived structure counting rows, with the hooks put() patches."""
+
+    def __init__(self, df):
+        self.rows = len(df)
+        self.updated = []
+
+    def copy(self):
+        other = Counter.__new__(Counter)
+        other.rows, other.updated = self.rows, list(self.updated)
+        return other
+
+    def on_append(self, df, start):
+        self.rows = len(df)
+
+    def on_update(self, df, positions):
+        self.updated.extend(positions)
+
+
+def frame(*ids):
+    return pd.DataFrame({"worker_id": list(ids)})
+
+
+def test_every_put_gets_a_new_version():
+    cache = SheetCache(60)
+    first = cache.put("workers", frame("W1"))
+    second = cache.put("workers", frame("W1", "W2"), reloaded=False, appended_from=1)
+    assert second.version > first.version
+    assert cache.peek("workers") is second
+    # A write-through put keeps the load time, so the TTL still applies
+    assert second.loaded_at == first.loaded_at
+    assert second.full_at == first.full_at
+
+
+def test_expired_entries_are_only_peeked():
+    cache = SheetCache(60)
+    entry = cache.put("workers", frame("W1"))
+    entry.loaded_at -= 120
+    assert cache.get("workers") is None
+    assert cache.peek("workers") is entry
+    cache.touch("workers")
+    assert cache.get("workers") is entry
+
+
+def test_derived_is_built_once_per_entry():
+    cache = SheetCache(60)
+    cache.put("workers", frame("W1"))
+    built = []
+    make = lambda df: built.append(df) or object()  # noqa: E731
+    assert cache.derived("workers", "x", make) is cache.derived("workers", "x", make)
+    assert len(built) == 1
+
+
+def test_append_patches_a_copy_for_the_new_version():
+    cache = SheetCache(60)
+    old = cache.put("workers", frame("W1"))
+    before = cache.derived("workers", "count", Counter)
+    new = cache.put("workers", frame("W1", "W2"), reloaded=False, appended_from=1)
+    after = cache.derived("workers", "count", lambda df: None)
+    assert after is not before
+    assert (before.rows, after.rows) == (1, 2)
+    # Sessions on the previous version still see structures matching its frame
+    assert cache.derived("workers", "count", Counter, entry=old) is before
+    assert new.derived["count"] is after
+
+
+def test_update_patches_and_reload_drops():
+    cache = SheetCache(60)
+    cache.put("workers", frame("W1", "W2"))
+    cache.derived("workers", "count", Counter)
+    cache.put("workers", frame("W1", "W3"), reloaded=False, updated=[1])
+    assert cache.peek("workers").derived["count"].updated == [1]
+    cache.put("workers", frame("W1", "W3"))
+    assert cache.peek("workers").derived == {}
+
+
+def test_structures_that_fail_to_patch_are_rebuilt():
+    class Broken(Counter):
+        def on_append(self, df, start):
+            raise ValueError("no")
+
+    cache = SheetCache(60)
+    cache.put("workers", frame("W1"))
+    cache.derived("workers", "count", Broken)
+    cache.put("workers", frame("W1", "W2"), reloaded=False, appended_from=1)
+    assert cache.derived("workers", "count", Counter).rows == 2
+
+
+def test_key_index_of_previous_version_is_untouched():
+    cache = SheetCache(60)
+    old = cache.put("workers", frame("W1", "W2"))
+    index = cache.derived("workers", "key", lambda df: KeyIndex(df, "worker_id"))
+    cache.put("workers", frame("W2", "W1", "W3"), reloaded=False, updated=[0, 1])
+    new_index = cache.derived("workers", "key", lambda df: None)
+    assert (index.position("W1"), index.position("W3")) == (0, None)
+    assert (new_index.position("W1"), new_index.position("W2")) == (1, 0)
+    assert old.derived["key"] is index
+
+
+def test_projections_are_dropped_on_put():
+    cache = SheetCache(60)
+    cache.put("workers", frame("W1"))
+    cache.put_projection("workers", ["worker_id"], frame("W1"))
+    assert cache.projection("workers", ["worker_id"]) is not None
+    cache.put("workers", frame("W1", "W2"), reloaded=False, appended_from=1)
+    assert cache.projection("workers", ["worker_id"]) is None
@@ -0,0 +1,79 @@
+import pytest
+
+from export_sheets import SnapshotState
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "export.db")
+
+
+def export(path, sheets):
+    """One incremental run: sheet -> rows; returns (changed, deleted) per sheet."""
+    state = SnapshotState(path)
+    try:
+        out = {name: (state.changed(name, 0, rows), state.deleted(name))
+               for name, rows in sheets.items()}
+        state.commit()
+    finally:
+        state.close()
+    return out
+
+
+def test_first_run_exports_everything(state_path):
+    rows = [["W1", "Ramu"], ["W2", "Sita"]]
+    assert export(state_path, {"workers": rows}) == {"workers": (rows, [])}
+
+
+def test_only_new_and_changed_rows(state_path):
+    export(state_path, {"workers": [["W1", "Ramu"], ["W2", "Sita"]]})
+    out = export(state_path, {"workers": [["W1", "Ramu"], ["W2", "Gita"], ["W3", "Ravi"]]})
+    assert out == {"workers": ([["W2", "Gita"], ["W3", "Ravi"]], [])}
+    assert export(state_path, {"workers": [["W1", "Ramu"], ["W2", "Gita"], ["W3", "Ravi"]]}) == {
+        "workers": ([], [])}
+
+
+def test_deleted_ids_are_reported_once(state_path):
+    export(state_path, {"workers": [["W1", "Ramu"], ["W2", "Sita"]]})
+    assert export(state_path, {"workers": [["W2", "Sita"]]}) == {"workers": ([], ["W1"])}
+    assert export(state_path, {"workers": [["W2", "Sita"]]}) == {"workers": ([], [])}
+
+
+def test_rows_without_id_are_always_exported(state_path):
+    export(state_path, {"workers": [["", "Ramu"]]})
+    assert export(state_path, {"workers": [["", "Ramu"]]}) == {"workers": ([["", "Ramu"]], [])}
+
+
+def test_sheets_are_tracked_separately(state_path):
+    export(state_path, {"workers": [["X1", "a"]]})
+    assert export(state_path, {"tools": [["X1", "a"]]})["tools"] == ([["X1", "a"]], [])
+
+
+def test_without_id_column_every_row_is_changed(state_path):
+    state = SnapshotState(state_path)
+    rows = [["a"], ["b"]]
+    assert state.changed("notes", None, rows) == rows
+    state.close()
+
+
+def test_rollback_leaves_state_as_it_was(state_path):
+    export(state_path, {"workers": [["W1", "Ramu"]]})
+    state = SnapshotState(state_path)
+    state.changed("workers", 0, [["W1", "Gita"]])
+    state.rollback()
+    state.close()
+    assert export(state_path, {"workers": [["W1", "Gita"]]}) == {"workers": ([["W1", "Gita"]], [])}
+
+
+def test_staged_state_takes_over_only_when_confirmed(state_path):
+    export(state_path, {"workers": [["W1", "Ramu"]]})
+    rows = [["W1", "Ramu"], ["W2", "Sita"]]
+    for _ in range(2):
+        # An unconfirmed export leaves the next one the same changes
+        state = SnapshotState.staged(state_path)
+        assert state.changed("workers", 0, rows) == [["W2", "Sita"]]
+        state.commit()
+        state.close()
+    assert SnapshotState.confirm(state_path)
+    assert not SnapshotState.confirm(state_path)
+    assert export(state_path, {"workers": rows}) == {"workers": ([], [])}
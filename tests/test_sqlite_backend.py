@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+import sheet_store
+from sheet_store import SQLiteBackend
+
+HEADER = ["worker_id", "name_te", "phone", "default_daily_wage", "active", "notes"]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "farm.db")
+
+
+@pytest.fixture
+def backend(path):
+    backend = SQLiteBackend(path)
+    backend.append("workers", HEADER, [["W001", "Ramu", "", "500", "Y", ""],
+                                       ["W002", "Sita", "", "550", "Y", ""]])
+    return backend
+
+
+def test_fetch_in_insertion_order(backend):
+    values = backend.fetch(["workers"])["workers"]
+    assert values[0] == HEADER
+    assert [row[0] for row in values[1:]] == ["W001", "W002"]
+
+
+def test_new_sheet_gets_its_schema_header(path):
+    assert SQLiteBackend(path).fetch(["tools"])["tools"] == [sheet_store.SHEET_HEADERS["tools"]]
+
+
+def test_update_by_position(backend):
+    backend.update("workers", HEADER, [{"row": 1, "key": "W002", "col": "notes", "value": "x"},
+                                       {"row": 5, "key": "W009", "col": "notes", "value": "y"}])
+    rows = backend.fetch(["workers"])["workers"][1:]
+    assert [row[5] for row in rows] == ["", "x"]
+
+
+def test_update_touches_only_one_of_repeated_ids(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE workers (" + ", ".join(f"{c} TEXT NOT NULL DEFAULT ''" for c in HEADER) + ")")
+    conn.executemany("INSERT INTO workers VALUES (?, ?, ?, ?, ?, ?)",
+                     [["W001", "Ramu", "", "500", "Y", ""], ["W001", "Copy", "", "500", "Y", ""]])
+    conn.commit()
+    backend = SQLiteBackend(path)
+    backend.update("workers", HEADER, [{"row": 1, "key": "W001", "col": "active", "value": "N"}])
+    assert [row[4] for row in backend.fetch(["workers"])["workers"][1:]] == ["Y", "N"]
+
+
+def test_repeated_id_is_refused(backend):
+    with pytest.raises(sqlite3.IntegrityError) as info:
+        backend.append("workers", HEADER, [["W001", "Again", "", "", "", ""]])
+    assert sheet_store.rejected(info.value)
+    # Blank IDs may repeat
+    backend.append("workers", HEADER, [["", "a", "", "", "", ""], ["", "b", "", "", "", ""]])
+
+
+def test_commit_is_all_or_nothing(backend):
+    writes = [
+        {"sheet": "workers", "kind": "update", "header": HEADER,
+         "cells": [{"row": 0, "key": "W001", "col": "notes", "value": "paid"}]},
+        {"sheet": "workers", "kind": "append", "header": HEADER,
+         "rows": [["W002", "Twice", "", "", "", ""]]},
+    ]
+    with pytest.raises(sqlite3.IntegrityError):
+        backend.commit(writes)
+    rows = backend.fetch(["workers"])["workers"][1:]
+    assert len(rows) == 2 and rows[0][5] == ""
+
+
+def test_max_id_compares_numbers(backend):
+    backend.append("workers", HEADER, [["W999", "", "", "", "", ""], ["W1000", "", "", "", "", ""],
+                                       ["W12x", "", "", "", "", ""], ["X5000", "", "", "", "", ""]])
+    assert backend.max_id("workers", "worker_id", "W") == 1000
+    assert backend.max_id("workers", "place", "W") is None
+    backend.write_all("workers", [HEADER])
+    assert backend.max_id("workers", "worker_id", "W") == 0
+
+
+def test_fetch_rows_and_tails(backend):
+    backend.append("workers", HEADER, [["W003", "Ravi", "", "600", "Y", ""]])
+    header, keys, rows = backend.fetch_rows({"workers": ([0, 7], 1)})["workers"]
+    assert header == HEADER
+    assert keys == ["W002", "W003"]
+    assert rows == {0: ["W001", "Ramu", "", "500", "Y", ""]}
+    header, last, new_rows, sampled = backend.fetch_tails([("workers", 6, 2, [0])])["workers"]
+    assert last[0] == "W002"
+    assert [row[0] for row in new_rows] == ["W003"]
+    assert sampled[0][0] == "W001"
+
+
+def test_write_all_replaces_the_table(backend):
+    backend.write_all("workers", [HEADER, ["W005", "Only", "", "", "", ""]])
+    assert backend.fetch(["workers"])["workers"][1:] == [["W005", "Only", "", "", "", ""]]
+
+
+def test_fetch_chunks(backend):
+    backend.append("workers", HEADER, [["W003", "Ravi", "", "600", "Y", ""]])
+    chunks = list(backend.fetch_chunks("workers", 2))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    assert chunks[0][0] == HEADER
@@ -0,0 +1,76 @@
+import pytest
+
+import sheet_store
+from sheet_store import SheetCache, SQLiteBackend, _sync_tails
+
+HEADER = ["tool_move_id", "tool_id", "to_place_id"]
+ROWS = [["TM1", "T1", "P1"], ["TM2", "T2", "P1"], ["TM3", "T1", "P2"]]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    backend = SQLiteBackend(str(tmp_path / "farm.db"))
+    backend.append("tool_moves", HEADER, ROWS)
+    cache = SheetCache(60, 600)
+    monkeypatch.setattr(sheet_store, "get_backend", lambda: backend)
+    monkeypatch.setattr(sheet_store, "get_sheet_cache", lambda: cache)
+    # Check every earlier row, so a changed one is always seen
+    monkeypatch.setattr(sheet_store, "TAIL_SAMPLE_ROWS", len(ROWS))
+    sheet_store.reload_sheets(["tool_moves"])
+    return backend, cache
+
+
+def cached_ids(cache):
+    return cache.peek("tool_moves").df["tool_move_id"].tolist()
+
+
+def test_new_rows_are_appended(store):
+    backend, cache = store
+    before = cache.peek("tool_moves")
+    backend.append("tool_moves", HEADER, [["TM4", "T2", "P2"], ["TM5", "T1", "P1"]])
+    assert _sync_tails(["tool_moves"]) == ["tool_moves"]
+    after = cache.peek("tool_moves")
+    assert cached_ids(cache) == ["TM1", "TM2", "TM3", "TM4", "TM5"]
+    assert after.version > before.version
+    assert after.tail == (HEADER, ["TM5", "T1", "P1"])
+    # Only a full load resets the full reload clock
+    assert after.full_at == before.full_at
+
+
+def test_nothing_new_keeps_the_version(store):
+    _, cache = store
+    before = cache.peek("tool_moves")
+    before.loaded_at -= 30
+    assert _sync_tails(["tool_moves"]) == ["tool_moves"]
+    assert cache.peek("tool_moves") is before
+    assert cache.get("tool_moves") is before
+
+
+@pytest.mark.parametrize("edit", [
+    # The last cached row was changed
+    lambda b: b.update("tool_moves", HEADER, [{"row": 2, "key": "TM3", "col": "to_place_id", "value": "P9"}]),
+    # An earlier row was changed
+    lambda b: b.update("tool_moves", HEADER, [{"row": 0, "key": "TM1", "col": "tool_id", "value": "T9"}]),
+    # A row was removed
+    lambda b: b.write_all("tool_moves", [HEADER] + ROWS[1:]),
+    # The header changed
+    lambda b: b.write_all("tool_moves", [HEADER + ["notes"]] + [r + [""] for r in ROWS]),
+])
+def test_edited_sheets_are_left_for_a_full_reload(store, edit):
+    backend, cache = store
+    before = cache.peek("tool_moves")
+    edit(backend)
+    backend.append("tool_moves", HEADER, [["TM4", "T2", "P2"]])
+    assert _sync_tails(["tool_moves"]) == []
+    assert cache.peek("tool_moves") is before
+
+
+def test_old_full_loads_and_unknown_tails_are_skipped(store):
+    backend, cache = store
+    entry = cache.peek("tool_moves")
+    entry.full_at -= 601
+    backend.append("tool_moves", HEADER, [["TM4", "T2", "P2"]])
+    assert _sync_tails(["tool_moves"]) == []
+    entry.full_at += 601
+    entry.tail = None
+    assert _sync_tails(["tool_moves", "work_logs"]) == []
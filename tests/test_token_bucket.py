@@ -0,0 +1,56 @@
+import pytest
+
+import sheets_client
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sheets_client.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(sheets_client.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_burst_goes_out_without_waiting(clock):
+    bucket = sheets_client.TokenBucket(rate=1.0, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == []
+
+
+def test_paces_at_rate_once_empty(clock):
+    bucket = sheets_client.TokenBucket(rate=2.0, capacity=1)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.5)]
+
+
+def test_refill_is_capped_at_capacity(clock):
+    bucket = sheets_client.TokenBucket(rate=1.0, capacity=2)
+    bucket.acquire()
+    clock.now += 60
+    for _ in range(2):
+        bucket.acquire()
+    assert clock.slept == []
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(1.0)]
+
+
+def test_drain_empties_the_bucket(clock):
+    bucket = sheets_client.TokenBucket(rate=4.0, capacity=10)
+    bucket.drain()
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.25)]
@@ -0,0 +1,120 @@
+import pandas as pd
+import pytest
+
+import sheet_store
+from sheet_store import (
+    SheetCache, SQLiteBackend, Transaction, TransactionJournal, UnsettledTransactions,
+    WriteConflict, replay_transactions,
+)
+
+TOOLS = ["tool_id", "name_te", "current_place_id"]
+MOVES = ["tool_move_id", "tool_id", "to_place_id"]
+
+
+class FlakyBackend(SQLiteBackend):
+    down = False
+
+    def commit(self, writes):
+        if self.down:
+            raise ConnectionError("offline")
+        super().commit(writes)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    backend = FlakyBackend(str(tmp_path / "farm.db"))
+    backend.append("tools", TOOLS, [["T001", "Axe", "P1"], ["T002", "Hoe", "P1"]])
+    backend.append("tool_moves", MOVES, [["TM000001", "T001", "P1"]])
+    journal = TransactionJournal(str(tmp_path / "txn.db"))
+    cache = SheetCache(60, 600)
+    monkeypatch.setattr(sheet_store, "get_backend", lambda: backend)
+    monkeypatch.setattr(sheet_store, "get_txn_journal", lambda: journal)
+    monkeypatch.setattr(sheet_store, "get_sheet_cache", lambda: cache)
+    return backend, journal, cache
+
+
+def load(backend, name):
+    return sheet_store.values_to_df(backend.fetch([name])[name], name)
+
+
+def move(backend, tool_pos, move_id, place):
+    """A tool move transaction as the app stages it."""
+    tools, moves = load(backend, "tools"), load(backend, "tool_moves")
+    txn = Transaction()
+    txn.append_rows(moves, pd.DataFrame([{
+        "tool_move_id": move_id, "tool_id": tools.at[tool_pos, "tool_id"], "to_place_id": place}]),
+        "tool_moves")
+    txn.update_rows(tools, "tools", {tools.index[tool_pos]: {"current_place_id": place}})
+    return txn
+
+
+def test_commit_stores_all_writes_and_updates_the_cache(store):
+    backend, journal, cache = store
+    frames = move(backend, 1, "TM000002", "P2").commit()
+    assert backend.fetch(["tools"])["tools"][2] == ["T002", "Hoe", "P2"]
+    assert backend.fetch(["tool_moves"])["tool_moves"][-1] == ["TM000002", "T002", "P2"]
+    assert frames["tools"].at[1, "current_place_id"] == "P2"
+    assert cache.peek("tool_moves").df["tool_move_id"].tolist() == ["TM000001", "TM000002"]
+    assert journal.unsettled() == []
+
+
+def test_conflicting_commit_is_not_journaled(store):
+    backend, journal, _ = store
+    txn = move(backend, 1, "TM000002", "P2")
+    backend.append("tool_moves", MOVES, [["TM000002", "T001", "P3"]])
+    with pytest.raises(WriteConflict):
+        txn.commit()
+    assert journal.unsettled() == []
+    assert backend.fetch(["tools"])["tools"][2] == ["T002", "Hoe", "P1"]
+
+
+def test_failed_commit_is_replayed(store):
+    backend, journal, _ = store
+    txn = move(backend, 1, "TM000002", "P2")
+    backend.down = True
+    with pytest.raises(ConnectionError):
+        txn.commit()
+    assert len(journal.unsettled()) == 1
+    # Unsettled transactions go first, and a new one waits while they fail
+    with pytest.raises(UnsettledTransactions):
+        move(backend, 0, "TM000003", "P3").commit()
+    backend.down = False
+    assert replay_transactions()
+    assert journal.unsettled() == []
+    assert backend.fetch(["tools"])["tools"][2] == ["T002", "Hoe", "P2"]
+
+
+def test_replay_skips_a_stored_transaction(store):
+    backend, journal, _ = store
+    txn = move(backend, 1, "TM000002", "P2")
+    _, writes, _ = txn._plan()
+    journal.record(writes)
+    backend.commit(writes)
+    assert replay_transactions()
+    assert len(backend.fetch(["tool_moves"])["tool_moves"]) == 3
+    assert journal.unsettled() == [] and journal.dead_letters() == []
+
+
+def test_replay_follows_moved_rows(store):
+    backend, journal, _ = store
+    _, writes, _ = move(backend, 1, "TM000002", "P2")._plan()
+    journal.record(writes)
+    backend.write_all("tools", [TOOLS, ["T002", "Hoe", "P1"], ["T001", "Axe", "P1"]])
+    assert replay_transactions()
+    assert backend.fetch(["tools"])["tools"][1:] == [["T002", "Hoe", "P2"], ["T001", "Axe", "P1"]]
+
+
+def test_replay_sets_aside_a_conflicting_transaction(store):
+    backend, journal, _ = store
+    _, writes, _ = move(backend, 1, "TM000002", "P2")._plan()
+    journal.record(writes)
+    backend.update("tools", TOOLS, [{"row": 1, "key": "T002", "col": "current_place_id", "value": "P9"}])
+    assert replay_transactions()
+    assert journal.unsettled() == []
+    assert backend.fetch(["tools"])["tools"][2] == ["T002", "Hoe", "P9"]
+    assert len(backend.fetch(["tool_moves"])["tool_moves"]) == 2
+    letters = journal.dead_letters()
+    assert sorted((d["sheet"], d["count"]) for d in letters) == [("tool_moves", 1), ("tools", 1)]
+    assert "WriteConflict" in letters[0]["error"]
+    journal.discard_dead_letters([letters[0]["id"]])
+    assert journal.dead_letters() == []
@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+
+from upload_to_sheets import Checkpoint
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "checkpoint.json")
+
+
+def test_new_sheet_starts_from_zero(path):
+    assert Checkpoint(path).get("workers", "10:1") == {
+        "fingerprint": "10:1", "rows": 0, "swapped": False}
+    assert not os.path.exists(path)
+
+
+def test_progress_survives_a_restart(path):
+    Checkpoint(path).save("workers", {"fingerprint": "10:1", "rows": 4000, "swapped": False})
+    assert Checkpoint(path).get("workers", "10:1")["rows"] == 4000
+
+
+def test_changed_csv_starts_over(path):
+    Checkpoint(path).save("workers", {"fingerprint": "10:1", "rows": 4000, "swapped": True})
+    assert Checkpoint(path).get("workers", "11:2") == {
+        "fingerprint": "11:2", "rows": 0, "swapped": False}
+
+
+def test_restart_ignores_the_file(path):
+    Checkpoint(path).save("workers", {"fingerprint": "10:1", "rows": 4000, "swapped": False})
+    assert Checkpoint(path, restart=True).get("workers", "10:1")["rows"] == 0
+
+
+def test_get_returns_a_copy(path):
+    checkpoint = Checkpoint(path)
+    checkpoint.save("workers", {"fingerprint": "10:1", "rows": 5, "swapped": False})
+    checkpoint.get("workers", "10:1")["rows"] = 99
+    assert checkpoint.get("workers", "10:1")["rows"] == 5
+
+
+def test_discard_keeps_other_sheets(path):
+    checkpoint = Checkpoint(path)
+    for name in ["workers", "tools"]:
+        checkpoint.save(name, {"fingerprint": "1:1", "rows": 7, "swapped": False})
+    checkpoint.discard(["workers"])
+    with open(path, encoding="utf-8") as f:
+        assert list(json.load(f)) == ["tools"]
+    checkpoint.discard(["tools"])
+    assert not os.path.exists(path)
+
+
+def test_discard_without_a_file(path):
+    Checkpoint(path).discard(["workers"])
+    assert not os.path.exists(path)
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import pytest
+
+import upload_to_sheets
+from upload_to_sheets import _swap_requests, main
+
+
+def test_swap_requests_copy_staging_over_target():
+    staging = SimpleNamespace(id=7, row_count=101, col_count=5)
+    target = SimpleNamespace(id=3, row_count=50, col_count=8)
+    resize, clear, copy, drop = _swap_requests(staging, target, 101, 5)
+    # The target grows to fit, but never shrinks
+    assert resize["updateSheetProperties"]["properties"] == {
+        "sheetId": 3, "gridProperties": {"rowCount": 101, "columnCount": 8}}
+    assert clear["updateCells"]["range"] == {"sheetId": 3}
+    assert copy["copyPaste"]["source"] == {"sheetId": 7, "startRowIndex": 0, "endRowIndex": 101,
+                                           "startColumnIndex": 0, "endColumnIndex": 5}
+    assert copy["copyPaste"]["destination"] == dict(copy["copyPaste"]["source"], sheetId=3)
+    assert copy["copyPaste"]["pasteType"] == "PASTE_VALUES"
+    assert drop == {"deleteSheet": {"sheetId": 7}}
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    """Run main() against tmp_path without Google; returns the sheets uploaded."""
+    uploaded = []
+    monkeypatch.setattr(upload_to_sheets.Credentials, "from_service_account_file",
+                        lambda *args, **kwargs: None)
+    monkeypatch.setattr(upload_to_sheets.sheets_client, "authorize",
+                        lambda *args, **kwargs: SimpleNamespace(open_by_key=lambda key: None))
+    monkeypatch.setattr(upload_to_sheets, "upload_sheet",
+                        lambda spreadsheet, sheet_name, *args: uploaded.append(sheet_name))
+    return uploaded
+
+
+def run(tmp_path, *args):
+    return main(["--csv-dir", str(tmp_path), "--checkpoint", str(tmp_path / "cp.json"), *args])
+
+
+def test_default_run_skips_sheets_without_a_csv(tmp_path, uploads, capsys):
+    (tmp_path / "workers.csv").write_text("worker_id\nW001\n")
+    assert run(tmp_path) == 0
+    assert uploads == ["workers"]
+    assert "[tools] Skipped: no CSV at" in capsys.readouterr().out
+
+
+def test_named_sheet_without_a_csv_fails_before_uploading(tmp_path, uploads, capsys):
+    (tmp_path / "workers.csv").write_text("worker_id\nW001\n")
+    assert run(tmp_path, "--sheets", "workers", "tools") == 2
+    assert uploads == []
+    err = capsys.readouterr().err
+    assert "[tools] CSV not found" in err and "resume" not in err
+
+
+def test_no_csvs_at_all(tmp_path, uploads, capsys):
+    assert run(tmp_path) == 2
+    assert uploads == []
+    assert "No CSVs to import" in capsys.readouterr().err
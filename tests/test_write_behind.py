@@ -0,0 +1,214 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from sheet_store import SQLiteBackend, WriteBehindBackend
+
+HEADER = ["worker_id", "name_te", "phone", "default_daily_wage", "active", "notes"]
+
+
+class FlakyBackend(SQLiteBackend):
+    """SQLiteBackend whose writes fail like a dropped connection while down is set.
+
+    Appends of rows whose ID is in refuse are refused outright.
+    """
+
+    down = False
+    refuse = ()
+
+    def append(self, sheet_name, header, rows):
+        if self.down:
+            raise ConnectionError("offline")
+        if any(row[0] in self.refuse for row in rows):
+            raise sqlite3.IntegrityError("refused")
+        super().append(sheet_name, header, rows)
+
+    def update(self, sheet_name, header, cells):
+        if self.down:
+            raise ConnectionError("offline")
+        super().update(sheet_name, header, cells)
+
+    def commit(self, writes):
+        if self.down:
+            raise ConnectionError("offline")
+        super().commit(writes)
+
+
+@pytest.fixture
+def inner(tmp_path):
+    inner = FlakyBackend(str(tmp_path / "farm.db"))
+    inner.append("workers", HEADER, [["W001", "Ramu", "", "500", "Y", ""]])
+    return inner
+
+
+@pytest.fixture
+def backend(inner, tmp_path, monkeypatch):
+    monkeypatch.setattr(WriteBehindBackend, "RETRY_MIN_SECONDS", 0.05)
+    monkeypatch.setattr(WriteBehindBackend, "RETRY_MAX_SECONDS", 0.05)
+    return WriteBehindBackend(inner, str(tmp_path / "queue.db"))
+
+
+def drain(backend, sheet_name="workers"):
+    backend._wake.set()
+    deadline = time.monotonic() + 5
+    while backend.pending(sheet_name):
+        assert time.monotonic() < deadline, "queue did not drain"
+        time.sleep(0.01)
+
+
+def ids(values):
+    return [row[0] for row in values[1:]]
+
+
+def test_queued_writes_show_in_reads(inner, backend):
+    inner.down = True
+    backend.append("workers", HEADER, [["W002", "Sita", "", "550", "Y", ""]])
+    backend.update("workers", HEADER, [{"row": 0, "key": "W001", "col": "notes", "value": "paid"}])
+    assert backend.pending("workers")
+    values = backend.fetch(["workers"])["workers"]
+    assert ids(values) == ["W001", "W002"]
+    assert values[1][5] == "paid"
+    assert backend.fetch_columns({"workers": ["worker_id"]})["workers"] == [["worker_id"], ["W001"], ["W002"]]
+    assert ids(inner.fetch(["workers"])["workers"]) == ["W001"]
+
+
+def test_flush_sends_queued_writes_in_order(inner, backend):
+    inner.down = True
+    backend.append("workers", HEADER, [["W002", "Sita", "", "550", "Y", ""]])
+    backend.append("workers", HEADER, [["W003", "Ravi", "", "600", "Y", ""]])
+    backend.update("workers", HEADER, [{"row": 2, "key": "W003", "col": "active", "value": "N"}])
+    inner.down = False
+    drain(backend)
+    values = inner.fetch(["workers"])["workers"]
+    assert ids(values) == ["W001", "W002", "W003"]
+    assert values[3][4] == "N"
+    assert backend.fetch(["workers"])["workers"] == values
+    assert backend.dead_letters() == []
+
+
+def test_refused_write_is_dead_lettered(inner, backend):
+    inner.down = True
+    inner.refuse = {"W009"}
+    backend.append("workers", HEADER, [["W009", "Bad", "", "", "", ""]])
+    backend.append("workers", HEADER, [["W002", "Sita", "", "550", "Y", ""]])
+    inner.down = False
+    drain(backend)
+    # The refused write is set aside; the one behind it still goes through
+    assert ids(inner.fetch(["workers"])["workers"]) == ["W001", "W002"]
+    letters = backend.dead_letters()
+    assert [(d["sheet"], d["kind"], d["count"]) for d in letters] == [("workers", "append", 1)]
+    assert "IntegrityError" in letters[0]["error"]
+    assert backend.dropped_sheets() == ["workers"]
+    assert backend.dropped_sheets() == []
+    backend.discard_dead_letters([letters[0]["id"]])
+    assert backend.dead_letters() == []
+
+
+def test_failed_flush_stays_queued(inner, backend):
+    inner.down = True
+    backend.append("workers", HEADER, [["W002", "Sita", "", "550", "Y", ""]])
+    time.sleep(0.2)
+    assert backend.pending("workers")
+    assert backend.dead_letters() == []
+    inner.down = False
+    drain(backend)
+    assert ids(inner.fetch(["workers"])["workers"]) == ["W001", "W002"]
+
+
+def test_queued_transaction_is_sent_whole(inner, backend):
+    inner.append("tools", ["tool_id", "name"], [["T001", "Axe"]])
+    inner.down = True
+    backend.commit([
+        {"sheet": "workers", "kind": "append", "header": HEADER,
+         "rows": [["W002", "Sita", "", "550", "Y", ""]]},
+        {"sheet": "tools", "kind": "update", "header": ["tool_id", "name"],
+         "cells": [{"row": 0, "key": "T001", "col": "name", "value": "Hoe"}]},
+    ])
+    assert backend.fetch(["tools"])["tools"][1] == ["T001", "Hoe"]
+    inner.down = False
+    drain(backend)
+    drain(backend, "tools")
+    assert ids(inner.fetch(["workers"])["workers"]) == ["W001", "W002"]
+    assert inner.fetch(["tools"])["tools"][1] == ["T001", "Hoe"]
+
+
+def test_read_during_flush_sees_each_row_once(tmp_path):
+    class SlowBackend(SQLiteBackend):
+        """Holds the flusher between storing rows and returning."""
+
+        def __init__(self, path):
+            super().__init__(path)
+            self.stored = threading.Event()
+            self.release = threading.Event()
+
+        def append(self, sheet_name, header, rows):
+            super().append(sheet_name, header, rows)
+            self.stored.set()
+            self.release.wait(5)
+
+    inner = SlowBackend(str(tmp_path / "farm.db"))
+    inner.release.set()
+    inner.append("workers", HEADER, [["W001", "Ramu", "", "500", "Y", ""]])
+    inner.stored.clear()
+    inner.release.clear()
+    backend = WriteBehindBackend(inner, str(tmp_path / "queue.db"))
+    backend.append("workers", HEADER, [["W002", "Sita", "", "550", "Y", ""]])
+    assert inner.stored.wait(5)
+    got = []
+    reader = threading.Thread(target=lambda: got.append(backend.fetch(["workers"])["workers"]))
+    reader.start()
+    time.sleep(0.1)
+    # The read waits for the flush instead of seeing W002 stored and still queued
+    assert got == []
+    inner.release.set()
+    reader.join(5)
+    assert ids(got[0]) == ["W001", "W002"]
+    drain(backend)
+    assert ids(backend.fetch(["workers"])["workers"]) == ["W001", "W002"]
+
+
+def test_queuing_does_not_read_the_wrapped_backend(inner, backend):
+    inner.down = True
+    assert backend.fetch_rows({"workers": ([0], 0)}) == {}
+
+
+def test_queued_writes_are_checked_before_sending(inner, backend):
+    inner.append("workers", HEADER, [["W002", "Sita", "", "550", "Y", ""]])
+    inner.down = True
+    backend.update("workers", HEADER, [{"row": 0, "key": "W001", "col": "notes", "value": "ours", "old": ""}])
+    backend.update("workers", HEADER, [{"row": 1, "key": "W002", "col": "phone", "value": "123", "old": ""}])
+    # Meanwhile W001's notes are edited and a row is added above W002
+    inner.down = False
+    inner.write_all("workers", [HEADER, ["W001", "Ramu", "", "500", "Y", "theirs"],
+                                ["W000", "New", "", "", "", ""], ["W002", "Sita", "", "550", "Y", ""]])
+    drain(backend)
+    rows = inner.fetch(["workers"])["workers"][1:]
+    assert rows[0][5] == "theirs"
+    assert rows[2][:3] == ["W002", "Sita", "123"]
+    letters = backend.dead_letters()
+    assert [(d["kind"], d["count"]) for d in letters] == [("update", 1)]
+    assert "WriteConflict" in letters[0]["error"]
+
+
+def test_conflicting_transaction_is_dead_lettered_whole(inner, backend):
+    inner.down = True
+    backend.commit([
+        {"sheet": "workers", "kind": "append", "header": HEADER,
+         "rows": [["W002", "Sita", "", "550", "Y", ""]]},
+        {"sheet": "workers", "kind": "update", "header": HEADER,
+         "cells": [{"row": 0, "key": "W001", "col": "notes", "value": "ours", "old": ""}]},
+    ])
+    inner.down = False
+    inner.update("workers", HEADER, [{"row": 0, "key": "W001", "col": "notes", "value": "theirs"}])
+    drain(backend)
+    assert inner.fetch(["workers"])["workers"][1:] == [["W001", "Ramu", "", "500", "Y", "theirs"]]
+    assert [d["kind"] for d in backend.dead_letters()] == ["commit"]
+
+
+def test_refresh_sizes_reaches_the_wrapped_backend(inner, backend, monkeypatch):
+    calls = []
+    monkeypatch.setattr(inner, "refresh_sizes", lambda: calls.append(True))
+    backend.refresh_sizes()
+    assert calls == [True]
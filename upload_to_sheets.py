@@ -1,84 +1,275 @@
 """
-One-time script to upload CSV data from farm_app_synth_data/ into Google Sheets.
+Bulk import of the CSV data in farm_app_synth_data/ into Google Sheets.
 
 Prerequisites:
   1. Place your service_account.json in this folder (farm_app_cloud/).
   2. Create a Google Spreadsheet and copy its ID from the URL.
   3. Share the spreadsheet with the service account email (Editor).
 
+Each CSV is streamed in chunks into a staging worksheet ("<sheet>__import").
+Only once every chunk is in does one batchUpdate copy it over the real sheet
+and drop the staging sheet, so an interrupted import never leaves a sheet
+cleared or half written. Several sheets upload at once, sharing the rate
+limit of one client. Progress is saved to a checkpoint file after every
+chunk; running the script again resumes from the last saved chunk (a CSV
+that changed since starts over). A sheet's entry is dropped from the
+checkpoint once it is imported, and the file is removed when none are left.
+By default every sheet with a CSV in the CSV folder is imported and the
+others are skipped; a sheet named with --sheets must have its CSV.
+
 Usage:
   python upload_to_sheets.py
+  python upload_to_sheets.py --sheets work_logs tools --chunk-rows 5000
+  python upload_to_sheets.py --restart        # ignore the checkpoint
 """
 
+import argparse
+import json
 import os
-import time
-import gspread
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
+import sheet_config
+import sheets_client
 from google.oauth2.service_account import Credentials
 
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
-CSV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "farm_app_synth_data")
-SERVICE_ACCOUNT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "service_account.json")
-
-# Paste your Google Spreadsheet ID here (from the URL)
-SPREADSHEET_ID = "1JPhIKXqMMJJU8x-UotNjSRfVLblkhwHJ7MuYIR_77nI"
-
-SHEETS = {
-    "workers": "workers.csv",
-    "work_types": "work_types.csv",
-    "work_logs": "work_logs.csv",
-    "tools": "tools.csv",
-    "tool_moves": "tool_moves.csv",
-    "storage_places": "storage_places.csv",
-}
-
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive",
-]
-
-
-def main():
-    # Authenticate
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    client = gspread.authorize(creds)
-    spreadsheet = client.open_by_key(SPREADSHEET_ID)
-
-    for sheet_name, csv_file in SHEETS.items():
-        csv_path = os.path.join(CSV_DIR, csv_file)
-        print(f"Reading {csv_path} ...")
-        df = pd.read_csv(csv_path, encoding="utf-8-sig")
-
-        # Clean up phone numbers: float → string (e.g. 9.87654e+09 → "9876543210")
-        if "phone" in df.columns:
-            df["phone"] = (
-                df["phone"]
-                .apply(lambda v: str(int(v)) if pd.notna(v) and v != "" else "")
-            )
-
-        # Convert everything to string for Sheets upload
-        df = df.fillna("")
-        data = [df.columns.tolist()] + df.astype(str).values.tolist()
-
-        # Create or get worksheet
-        try:
-            ws = spreadsheet.worksheet(sheet_name)
-            ws.clear()
-            print(f"  Cleared existing worksheet '{sheet_name}'")
-        except gspread.exceptions.WorksheetNotFound:
-            ws = spreadsheet.add_worksheet(title=sheet_name, rows=len(data) + 10, cols=len(data[0]) + 2)
-            print(f"  Created new worksheet '{sheet_name}'")
-
-        ws.update(range_name="A1", values=data)
-        print(f"  Uploaded {len(df)} rows to '{sheet_name}'")
-
-        # Rate limit: avoid hitting Google API quota
-        time.sleep(2)
+HERE = os.path.dirname(os.path.abspath(__file__))
+CSV_DIR = os.path.join(HERE, "..", "farm_app_synth_data")
+SERVICE_ACCOUNT_FILE = os.path.join(HERE, "service_account.json")
+CHECKPOINT_FILE = os.path.join(HERE, ".upload_checkpoint.json")
+
+# Sheet -> CSV file
+SHEETS = {name: f"{name}.csv" for name in sheet_config.PRIMARY_KEYS}
+
+# Rows sent per request; keeps each request well under the API payload limit
+CHUNK_ROWS = 2000
+# Sheets uploaded at the same time
+WORKERS = 3
+STAGING_SUFFIX = "__import"
+
+
+# ---------------------------------------------------------------------------
+# Checkpoint
+# ---------------------------------------------------------------------------
+class Checkpoint:
+    """Import progress per sheet, saved to a JSON file on every change.
+
+    A sheet's entry records the CSV it was started from (size and mtime),
+    how many data rows are in its staging sheet, and whether the final copy
+    over the real sheet has been sent.
+    """
+
+    def __init__(self, path: str, restart: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        if not restart and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._state = json.load(f)
+
+    def get(self, sheet_name: str, fingerprint: str) -> dict:
+        with self._lock:
+            entry = self._state.get(sheet_name)
+            if entry is None or entry.get("fingerprint") != fingerprint:
+                entry = {"fingerprint": fingerprint, "rows": 0, "swapped": False}
+            return dict(entry)
+
+    def save(self, sheet_name: str, entry: dict):
+        with self._lock:
+            self._state[sheet_name] = dict(entry)
+            self._write()
+
+    def discard(self, sheet_names: list):
+        """Forget the given sheets; the file is removed once no sheet is left."""
+        with self._lock:
+            for sheet_name in sheet_names:
+                self._state.pop(sheet_name, None)
+            if self._state:
+                self._write()
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+_print_lock = threading.Lock()
+
+
+def report(sheet_name: str, message: str):
+    """Print one progress line; upload threads share stdout."""
+    with _print_lock:
+        print(f"[{sheet_name}] {message}", flush=True)
+
+
+def _fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+# ---------------------------------------------------------------------------
+# CSV reading
+# ---------------------------------------------------------------------------
+def _read_csv(path: str, **kwargs):
+    # Every cell is read as text, exactly as it appears in the CSV
+    return pd.read_csv(path, encoding="utf-8-sig", dtype=str, keep_default_na=False, **kwargs)
+
+
+def csv_header(path: str) -> list:
+    return _read_csv(path, nrows=0).columns.tolist()
+
+
+def csv_row_count(path: str, chunk_rows: int) -> int:
+    return sum(len(chunk) for chunk in _read_csv(path, usecols=[0], chunksize=chunk_rows))
+
+
+def csv_chunks(path: str, chunk_rows: int, skip_rows: int = 0):
+    """Yield (index of the first data row, rows) for the data rows after skip_rows."""
+    start = skip_rows
+    skip = range(1, skip_rows + 1) if skip_rows else None
+    for chunk in _read_csv(path, chunksize=chunk_rows, skiprows=skip):
+        if "phone" in chunk.columns:
+            # Phone numbers saved from a float column: "9876543210.0" -> "9876543210"
+            chunk["phone"] = chunk["phone"].str.replace(r"\.0+$", "", regex=True)
+        yield start, chunk.values.tolist()
+        start += len(chunk)
+
+
+# ---------------------------------------------------------------------------
+# Upload
+# ---------------------------------------------------------------------------
+def _swap_requests(staging, target, rows: int, cols: int) -> list:
+    """batchUpdate requests that replace target's values with staging's.
+
+    The target keeps its sheet ID, so a running app's worksheet handles
+    stay valid.
+    """
+    source = {"sheetId": staging.id, "startRowIndex": 0, "endRowIndex": rows,
+              "startColumnIndex": 0, "endColumnIndex": cols}
+    return [
+        {"updateSheetProperties": {
+            "properties": {"sheetId": target.id, "gridProperties": {
+                "rowCount": max(target.row_count, rows), "columnCount": max(target.col_count, cols)}},
+            "fields": "gridProperties(rowCount,columnCount)",
+        }},
+        {"updateCells": {"range": {"sheetId": target.id}, "fields": "userEnteredValue"}},
+        {"copyPaste": {"source": source, "destination": dict(source, sheetId=target.id),
+                       "pasteType": "PASTE_VALUES"}},
+        {"deleteSheet": {"sheetId": staging.id}},
+    ]
+
+
+def upload_sheet(spreadsheet, sheet_name: str, csv_path: str, checkpoint: Checkpoint,
+                 chunk_rows: int = CHUNK_ROWS):
+    entry = checkpoint.get(sheet_name, _fingerprint(csv_path))
+    header = csv_header(csv_path)
+    total = csv_row_count(csv_path, chunk_rows)
+    staging_title = sheet_name + STAGING_SUFFIX
+    worksheets = {ws.title: ws for ws in spreadsheet.worksheets()}
+    staging = worksheets.get(staging_title)
+
+    if staging is None and entry["swapped"]:
+        # The copy went through before its checkpoint entry was dropped
+        report(sheet_name, "Already imported")
+        return
+    if staging is not None and entry["rows"] == 0:
+        # Left over from an import of another version of the CSV
+        spreadsheet.del_worksheet(staging)
+        staging = None
+    if staging is None:
+        entry["rows"] = 0
+        staging = spreadsheet.add_worksheet(title=staging_title, rows=total + 1, cols=len(header))
+        staging.update(range_name="A1", values=[header])
+        report(sheet_name, f"Importing {total} rows from {csv_path}")
+    else:
+        report(sheet_name, f"Resuming after row {entry['rows']} of {total}")
+
+    quoted = staging_title.replace("'", "''")
+    for start, rows in csv_chunks(csv_path, chunk_rows, entry["rows"]):
+        spreadsheet.values_update(
+            f"'{quoted}'!A{start + 2}",
+            params={"valueInputOption": "RAW"},
+            body={"values": rows},
+        )
+        entry["rows"] = start + len(rows)
+        checkpoint.save(sheet_name, entry)
+        report(sheet_name, f"  {entry['rows']}/{total} rows")
+
+    target = worksheets.get(sheet_name)
+    if target is None:
+        target = spreadsheet.add_worksheet(title=sheet_name, rows=total + 1, cols=len(header))
+    entry["swapped"] = True
+    checkpoint.save(sheet_name, entry)
+    spreadsheet.batch_update({"requests": _swap_requests(staging, target, total + 1, len(header))})
+    report(sheet_name, f"Uploaded {total} rows")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import the farm CSVs into Google Sheets.")
+    parser.add_argument("--sheets", nargs="+", choices=list(SHEETS),
+                        help="sheets to import (default: every sheet with a CSV in --csv-dir)")
+    parser.add_argument("--csv-dir", default=CSV_DIR)
+    parser.add_argument("--credentials", default=SERVICE_ACCOUNT_FILE,
+                        help="service account JSON file")
+    parser.add_argument("--spreadsheet-id", default=sheet_config.SPREADSHEET_ID)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="sheets uploaded at the same time")
+    parser.add_argument("--writes-per-minute", type=float, default=sheets_client.WRITES_PER_MINUTE)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the checkpoint and import every sheet from the start")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Find every CSV before starting, so a missing one is not reported as
+    # an upload to resume
+    paths = {name: os.path.join(args.csv_dir, SHEETS[name]) for name in args.sheets or SHEETS}
+    missing = [name for name, path in paths.items() if not os.path.isfile(path)]
+    if missing and args.sheets:
+        for sheet_name in missing:
+            print(f"[{sheet_name}] CSV not found: {paths[sheet_name]}", file=sys.stderr)
+        return 2
+    for sheet_name in missing:
+        report(sheet_name, f"Skipped: no CSV at {paths.pop(sheet_name)}")
+    if not paths:
+        print(f"No CSVs to import in {args.csv_dir}", file=sys.stderr)
+        return 2
+
+    # Authenticate; one client, so every upload thread shares its rate limit
+    creds = Credentials.from_service_account_file(args.credentials, scopes=sheet_config.SCOPES)
+    client = sheets_client.authorize(creds, writes_per_minute=args.writes_per_minute)
+    spreadsheet = client.open_by_key(args.spreadsheet_id)
+    checkpoint = Checkpoint(args.checkpoint, restart=args.restart)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            sheet_name: pool.submit(upload_sheet, spreadsheet, sheet_name, path,
+                                    checkpoint, args.chunk_rows)
+            for sheet_name, path in paths.items()
+        }
+    failed = {name: future.exception() for name, future in futures.items() if future.exception()}
 
+    if failed:
+        for sheet_name, exc in failed.items():
+            print(f"[{sheet_name}] FAILED: {exc!r}", file=sys.stderr)
+        print("\nSome sheets were not imported; run the script again to resume.", file=sys.stderr)
+        return 1
+    checkpoint.discard(list(paths))
     print("\nDone! All sheets uploaded. Verify in Google Sheets.")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())